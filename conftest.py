@@ -0,0 +1,34 @@
+import importlib
+
+import pytest
+from django.conf import settings as django_settings
+from django.urls import clear_url_caches
+
+from redirect.routing import invalidate_routing_table
+
+
+@pytest.fixture(autouse=True)
+def clean_routing_table():
+    """Don't let a routing table built in one test leak into another."""
+    invalidate_routing_table()
+    yield
+    invalidate_routing_table()
+
+
+@pytest.fixture
+def reload_urls():
+    """
+    Reload the URL conf after changing the settings it's built from, and restore it
+    after the test.
+    """
+    module = importlib.import_module(django_settings.ROOT_URLCONF)
+    original = dict(vars(module))
+
+    def reload():
+        importlib.reload(module)
+        clear_url_caches()
+
+    yield reload
+    vars(module).clear()
+    vars(module).update(original)
+    clear_url_caches()
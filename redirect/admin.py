@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
 
 from .models import Domain, DomainName, RedirectRule
 
@@ -31,7 +33,15 @@ class CommonPathPrefixListFilter(admin.SimpleListFilter):
 
 @admin.register(RedirectRule)
 class RedirectRuleAdmin(admin.ModelAdmin):
-    list_display = ("path", "domain", "destination", "permanent", "case_sensitive")
+    list_display = (
+        "path",
+        "domain",
+        "destination",
+        "permanent",
+        "case_sensitive",
+        "hits",
+        "last_hit_at",
+    )
     search_fields = ("path", "destination")
     list_filter = (
         "permanent",
@@ -40,7 +50,7 @@ class RedirectRuleAdmin(admin.ModelAdmin):
         CommonPathPrefixListFilter,
     )
     ordering = ("path",)
-    readonly_fields = ("created_at", "updated_at")
+    readonly_fields = ("created_at", "updated_at", "hits", "last_hit_at")
     fieldsets = (
         (
             None,
@@ -57,10 +67,31 @@ class RedirectRuleAdmin(admin.ModelAdmin):
                 )
             },
         ),
+        ("Caching", {"fields": ("cache_max_age",)}),
         ("Timestamps", {"fields": ("created_at", "updated_at")}),
+        ("Statistics", {"fields": ("hits", "last_hit_at")}),
         ("Notes", {"fields": ("notes",)}),
     )
 
+    def get_queryset(self, request):
+        # Rules without stats haven't been hit since they were counted
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(
+                hit_count=Coalesce(F("stats__hits"), Value(0)),
+                last_hit=F("stats__last_hit_at"),
+            )
+        )
+
+    @admin.display(description="Hits", ordering="hit_count")
+    def hits(self, obj):
+        return obj.hit_count
+
+    @admin.display(description="Last hit", ordering=F("last_hit").asc(nulls_first=True))
+    def last_hit_at(self, obj):
+        return obj.last_hit
+
 
 class DomainNameInline(admin.TabularInline):
     model = DomainName
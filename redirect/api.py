@@ -1,83 +1,247 @@
-from urllib.parse import urljoin
-
-from django.http import Http404
-from django.shortcuts import get_object_or_404
-from django.shortcuts import redirect as django_redirect
-from ninja import Router
-
-from redirect.models import Domain, RedirectRule
-
-router = Router()
-
-
-def get_domain_rule_or_404(domain, path) -> RedirectRule:
-    """Get a redirect rule for a domain or raise Http404 if not found."""
-    try:
-        # Try to find an exact match first
-        redirect_rule = RedirectRule.objects.get(
-            path=path.strip("/"), domain=domain, case_sensitive=True
-        )
-    except RedirectRule.DoesNotExist:
-        # If no exact match is found, try a case-insensitive match
-        redirect_rule = get_object_or_404(
-            RedirectRule,
-            path__iexact=path.strip("/"),
-            domain=domain,
-            case_sensitive=False,
+import time
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views import defaults
+from django.views.decorators.http import require_GET
+
+from redirect.models import DomainName, RedirectRule, RulesetGeneration
+from redirect.routing import (
+    RULE_MAX_AGE,
+    CompiledRule,
+    aget_routing_table,
+    cache_control,
+    default_max_ages,
+    get_routing_table,
+    observe_resolution,
+)
+
+# Fields read when answering a redirect request
+LOOKUP_FIELDS = (
+    "id",
+    "domain",
+    "path",
+    "destination",
+    "permanent",
+    "pass_query_string",
+    "match_subpaths",
+    "append_subpath",
+    "case_sensitive",
+    "cache_max_age",
+)
+
+
+# The body of a 404 response for a request without a matching redirect rule
+NOT_FOUND_BODY = {"detail": "Not Found"}
+
+
+class RedirectRuleNotFound(Http404):
+    """No redirect rule matches a request, see `page_not_found`."""
+
+    def __init__(self, cache_control: str):
+        super().__init__("No redirect rule matches the given query.")
+        # Of the 404 response
+        self.cache_control = cache_control
+
+
+def _path_prefixes(cleaned_path: str) -> dict[str, str]:
+    """
+    Map the lookup keys of a path and each of its ancestors to the corresponding
+    prefix of the path, e.g. "Foo/Bar" -> {"": "", "foo": "Foo", "foo/bar": "Foo/Bar"}.
+    """
+    prefixes = {"": ""}
+    segments = cleaned_path.split("/") if cleaned_path else []
+    for depth in range(1, len(segments) + 1):
+        prefix = "/".join(segments[:depth])
+        prefixes[prefix.lower()] = prefix
+    return prefixes
+
+
+def _select_wildcard_rule(candidates, prefixes: dict[str, str]) -> RedirectRule | None:
+    """
+    Pick the most specific wildcard rule whose path is the path or one of its
+    ancestors from candidates fetched by lookup key.
+    """
+    selected = None
+    for rule in candidates:
+        if not rule.match_subpaths:
+            continue
+        prefix = prefixes.get(rule.path.lower())
+        if prefix is None or (rule.case_sensitive and rule.path != prefix):
+            continue
+        if selected is None or len(rule.path) > len(selected.path):
+            selected = rule
+    return selected
+
+
+def _redirect_rule_candidates(host, cleaned_path, prefixes):
+    return (
+        RedirectRule.objects.only(*LOOKUP_FIELDS)
+        .annotate(max_age=RULE_MAX_AGE)
+        .filter(
+            # The path itself is one of the prefixes, so both the exact and the
+            # wildcard candidates are found with a single probe of the key index
+            Q(path_key=cleaned_path.lower()) | Q(match_subpaths=True),
+            domain__in=DomainName.objects.filter(name=host).values("domain_id"),
+            path_key__in=prefixes,
         )
+        .order_by()
+    )
+
+
+def _select_redirect_rule_or_404(
+    candidates, cleaned_path, prefixes: dict[str, str]
+) -> RedirectRule:
+    path_key = cleaned_path.lower()
+    exact_match = case_insensitive_match = None
+    for rule in candidates:
+        if rule.case_sensitive and rule.path == cleaned_path:
+            exact_match = rule
+        elif not rule.case_sensitive and rule.path.lower() == path_key:
+            case_insensitive_match = rule
+
+    redirect_rule = (
+        exact_match
+        or case_insensitive_match
+        or _select_wildcard_rule(candidates, prefixes)
+    )
+    if redirect_rule is None:
+        raise Http404("No redirect rule matches the given query.")
     return redirect_rule
 
 
-def find_wildcard_rule(domain, path) -> RedirectRule | None:
+def find_redirect_rule_or_404(host, path) -> RedirectRule:
+    """
+    Find the redirect rule for a host and path from the database in a single query.
+
+    Fetches the exact match candidates and the wildcard rules of the path's ancestors
+    at once and picks the winner with the usual precedence: an exact case-sensitive
+    match, an exact case-insensitive match and finally a wildcard match.
+    """
     cleaned_path = path.strip("/")
-    split_cleaned_path = cleaned_path.split("/") if cleaned_path else []
+    prefixes = _path_prefixes(cleaned_path)
+    candidates = list(_redirect_rule_candidates(host, cleaned_path, prefixes))
+    return _select_redirect_rule_or_404(candidates, cleaned_path, prefixes)
 
-    wildcard_redirects = RedirectRule.objects.filter(domain=domain, match_subpaths=True)
-    for wildcard_rule in wildcard_redirects:
-        split_wildcard_path = (
-            wildcard_rule.path.split("/") if wildcard_rule.path else []
-        )
-        if len(split_wildcard_path) > len(split_cleaned_path):
-            continue
 
-        if not wildcard_rule.case_sensitive:
-            split_cleaned_path = [part.lower() for part in split_cleaned_path]
-            split_wildcard_path = [part.lower() for part in split_wildcard_path]
+async def afind_redirect_rule_or_404(host, path) -> RedirectRule:
+    """Async version of `find_redirect_rule_or_404`."""
+    cleaned_path = path.strip("/")
+    prefixes = _path_prefixes(cleaned_path)
+    candidates = [
+        rule async for rule in _redirect_rule_candidates(host, cleaned_path, prefixes)
+    ]
+    return _select_redirect_rule_or_404(candidates, cleaned_path, prefixes)
+
+
+def _not_found_in_database() -> RedirectRuleNotFound:
+    # The domain's own max-age would cost another query
+    return RedirectRuleNotFound(cache_control(default_max_ages()[2]))
+
+
+def resolve_redirect_rule_or_404(host, path) -> CompiledRule:
+    """
+    Find the redirect rule for a host and path, or raise `RedirectRuleNotFound` if not
+    found.
+    """
+    if not settings.REDIRECT_ROUTING_TABLE:
+        try:
+            rule = find_redirect_rule_or_404(host, path)
+        except Http404:
+            raise _not_found_in_database() from None
+        return CompiledRule.from_model(rule, rule.max_age)
+
+    table = get_routing_table()
+    redirect_rule = table.resolve(host, path)
+    if redirect_rule is None:
+        raise RedirectRuleNotFound(table.not_found_cache_control(host))
+    return redirect_rule
 
-        if split_cleaned_path[: len(split_wildcard_path)] == split_wildcard_path:
-            return wildcard_rule
 
-    return None
+async def aresolve_redirect_rule_or_404(host, path) -> CompiledRule:
+    """Async version of `resolve_redirect_rule_or_404`."""
+    if not settings.REDIRECT_ROUTING_TABLE:
+        try:
+            rule = await afind_redirect_rule_or_404(host, path)
+        except Http404:
+            raise _not_found_in_database() from None
+        return CompiledRule.from_model(rule, rule.max_age)
 
+    table = await aget_routing_table()
+    redirect_rule = table.resolve(host, path)
+    if redirect_rule is None:
+        raise RedirectRuleNotFound(table.not_found_cache_control(host))
+    return redirect_rule
 
-@router.get("/{path:path}")
-def redirect(request, path: str):
-    domain = get_object_or_404(Domain, names__name=request.get_host())
-    try:
-        redirect_rule = get_domain_rule_or_404(domain, path)
-    except Http404:
-        redirect_rule = find_wildcard_rule(domain, path)
-        if redirect_rule is None:
-            # No rule found at all, raise 404
-            raise
 
-    destination = redirect_rule.destination
+def ruleset_generation() -> int:
+    """
+    The ruleset generation redirects are currently resolved from, loading the routing
+    table if needed.
+    """
+    if not settings.REDIRECT_ROUTING_TABLE:
+        return RulesetGeneration.current()
+    return get_routing_table().generation
 
-    # Append subpath if needed
-    if redirect_rule.match_subpaths and redirect_rule.append_subpath:
-        # Needs to behave like /foo/(.*) -> someurl.com/(.*), where (.*) is the subpath
-        subpath = path.lstrip(redirect_rule.path)
-        destination = urljoin(destination, subpath)
 
-    # Append query string if needed
-    if redirect_rule.pass_query_string and (
-        query_string := request.META.get("QUERY_STRING")
-    ):
-        destination += f"?{query_string}"
+class RuleRedirectResponse(HttpResponse):
+    """
+    Redirect to a location computed by a `CompiledRule`. Unlike
+    `HttpResponseRedirect`, the location is not encoded and validated again.
+    """
 
-    return django_redirect(destination, permanent=redirect_rule.permanent)
+    def __init__(self, location: str, status: int, cache_control: str):
+        super().__init__(status=status)
+        self["Location"] = location
+        self["Cache-Control"] = cache_control
 
+    url = property(lambda self: self["Location"])
 
-@router.get("/")
-def redirect_root(request):
-    return redirect(request, "")
+
+@require_GET
+def redirect(request, path: str = ""):
+    start = time.perf_counter()
+    host = request.get_host()
+    try:
+        redirect_rule = resolve_redirect_rule_or_404(host, path)
+    except Http404:
+        observe_resolution(host, path, None, start)
+        raise
+    location = redirect_rule.location_for(path, request.META.get("QUERY_STRING", ""))
+    observe_resolution(host, path, redirect_rule, start)
+    return RuleRedirectResponse(
+        location, redirect_rule.status, redirect_rule.cache_control
+    )
+
+
+@require_GET
+async def aredirect(request, path: str = ""):
+    """
+    Same as `redirect`, for ASGI deployments. Under ASGI an async view runs on the
+    event loop without a thread hop, as all the middleware is async-capable.
+    """
+    start = time.perf_counter()
+    host = request.get_host()
+    try:
+        redirect_rule = await aresolve_redirect_rule_or_404(host, path)
+    except Http404:
+        observe_resolution(host, path, None, start)
+        raise
+    location = redirect_rule.location_for(path, request.META.get("QUERY_STRING", ""))
+    observe_resolution(host, path, redirect_rule, start)
+    return RuleRedirectResponse(
+        location, redirect_rule.status, redirect_rule.cache_control
+    )
+
+
+def page_not_found(request, exception):
+    """
+    Django's 404 handler. Requests without a matching redirect rule are answered with
+    a JSON body and the Cache-Control header of the domain.
+    """
+    if isinstance(exception, RedirectRuleNotFound):
+        response = JsonResponse(NOT_FOUND_BODY, status=404)
+        response["Cache-Control"] = exception.cache_control
+        return response
+    return defaults.page_not_found(request, exception)
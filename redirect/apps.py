@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RedirectConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "redirect"
+
+    def ready(self):
+        from redirect import signals  # noqa: F401
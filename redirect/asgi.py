@@ -0,0 +1,110 @@
+"""
+ASGI fast path for redirect traffic.
+
+The ASGI counterpart of `redirect.wsgi.RedirectApplication`. Django's built-in
+middleware run their hooks in a thread even under ASGI, so `RedirectASGIApplication`
+answers requests that match a redirect rule on the event loop and passes everything
+else on to Django. The routing table is refreshed by a single coroutine shared by all
+waiting requests, and without the routing table rules are looked up with the async ORM.
+
+Enable it with `REDIRECT_ASGI_FAST_PATH=True`, see `tirehtoori/asgi.py`.
+"""
+
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import DisallowedRedirect
+from django.db import close_old_connections
+from django.http import Http404
+
+from redirect.api import aresolve_redirect_rule_or_404
+from redirect.routing import observe_resolution, routing_table_needs_check
+from redirect.tracing import DEBUG_HEADER_SCOPE_NAME
+from redirect.wsgi import is_allowed_host, reserved_path_prefixes
+
+
+class RedirectASGIApplication:
+    def __init__(self, django_application):
+        self.django_application = django_application
+        self.reserved_prefixes = reserved_path_prefixes()
+        # Debug requests are left to the view adding the debug headers
+        self.debug_header = (
+            DEBUG_HEADER_SCOPE_NAME if settings.REDIRECT_DEBUG_SECRET else None
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and (response := await self.handle(scope)):
+            status, headers = response
+            await send(
+                {"type": "http.response.start", "status": status, "headers": headers}
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await self.django_application(scope, receive, send)
+
+    async def handle(self, scope) -> tuple[int, list] | None:
+        uses_database = (
+            not settings.REDIRECT_ROUTING_TABLE or routing_table_needs_check()
+        )
+        try:
+            return await self.respond(scope)
+        except (DisallowedRedirect, Http404, UnicodeDecodeError):
+            # Let Django produce the error response
+            return None
+        finally:
+            if uses_database:
+                # What Django does at the start and end of each request. Costs a
+                # thread hop, so only done when a query may have been made.
+                await sync_to_async(close_old_connections)()
+
+    async def respond(self, scope) -> tuple[int, list] | None:
+        """
+        Return the status and headers of a redirect response, or None to pass the
+        request on to Django.
+        """
+        start = time.perf_counter()
+        if scope["method"] != "GET":
+            return None
+
+        path = scope["path"].removeprefix(scope.get("root_path", ""))
+        if path.startswith(self.reserved_prefixes):
+            return None
+        if self.debug_header is not None and any(
+            name == self.debug_header for name, _value in scope["headers"]
+        ):
+            return None
+
+        host = self.get_host(scope)
+        if host is None:
+            return None
+
+        rule = await aresolve_redirect_rule_or_404(host, path)
+        query_string = scope.get("query_string", b"")
+        if isinstance(query_string, bytes):
+            query_string = query_string.decode()
+        location = rule.location_for(path[1:], query_string)
+        # Misses are passed on to the view, which records them
+        observe_resolution(host, path, rule, start)
+        return rule.status, [
+            (b"content-type", b"text/html; charset=utf-8"),
+            (b"location", location.encode("latin-1")),
+            (b"cache-control", rule.cache_control.encode("latin-1")),
+            (b"content-length", b"0"),
+        ]
+
+    def get_host(self, scope) -> str | None:
+        """
+        Return the request host like `HttpRequest.get_host`, or None if it is not in
+        `ALLOWED_HOSTS`.
+        """
+        host = None
+        for name, value in scope.get("headers", ()):
+            if name == b"host":
+                host = value.decode("latin-1")
+        if not host:
+            server_name, port = scope.get("server") or ("unknown", 0)
+            host = server_name
+            if port != (443 if scope.get("scheme") == "https" else 80):
+                host = f"{host}:{port}"
+        return host if is_allowed_host(host) else None
@@ -0,0 +1,396 @@
+"""
+Helpers for benchmarking redirect resolution, see the `benchmark_redirects`
+management command.
+"""
+
+import asyncio
+import importlib
+import itertools
+import multiprocessing
+import statistics
+import time
+from collections.abc import Callable, Iterable, Sequence
+from dataclasses import dataclass
+from io import BytesIO
+from random import Random
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection, connections
+from django.urls import clear_url_caches
+from django.utils import timezone
+
+from redirect.asgi import RedirectASGIApplication
+from redirect.models import (
+    Domain,
+    DomainName,
+    RedirectRule,
+    RedirectRuleStats,
+    RulesetGeneration,
+)
+
+BENCHMARK_HOST = "benchmark.tirehtoori.test"
+
+SCENARIOS = ("exact", "case_insensitive", "wildcard", "miss", "unknown_host")
+
+
+@dataclass
+class SyntheticRuleset:
+    """
+    A generated ruleset of `rule_count` rules spread evenly over `domain_count`
+    domains, named "domain-<n>.benchmark.tirehtoori.test".
+
+    Rule number `i` has a unique path `depth` segments deep. A `wildcard_ratio` share
+    of the rules match subpaths, half of them appending the subpath. Of the other
+    rules, the even-numbered ones are case-sensitive. Everything about a rule can be
+    derived from its number, so requests for each scenario can be generated without
+    reading the rules back.
+    """
+
+    domain_count: int = 10
+    rule_count: int = 1000
+    wildcard_ratio: float = 0.1
+    depth: int = 2
+
+    def host(self, domain: int) -> str:
+        return f"domain-{domain}.{BENCHMARK_HOST}"
+
+    def path(self, rule: int) -> str:
+        parents = [
+            f"level{level}-{rule % (level + 2)}" for level in range(self.depth - 1)
+        ]
+        return "/".join([*parents, f"page-{rule}"])
+
+    def is_wildcard(self, rule: int) -> bool:
+        # Spreads the wildcard rules evenly, e.g. every tenth rule for 0.1
+        return int((rule + 1) * self.wildcard_ratio) > int(rule * self.wildcard_ratio)
+
+    def is_case_sensitive(self, rule: int) -> bool:
+        return not self.is_wildcard(rule) and rule % 2 == 0
+
+    def create(self) -> list[Domain]:
+        """
+        Insert the ruleset into the database, streaming the rules with COPY which
+        is an order of magnitude faster than even `bulk_create` for 1M rules.
+        """
+        domains = Domain.objects.bulk_create(
+            Domain(
+                display_name=self.host(domain), notes="Created by benchmark_redirects"
+            )
+            for domain in range(self.domain_count)
+        )
+        DomainName.objects.bulk_create(
+            DomainName(name=self.host(number), domain=domain)
+            for number, domain in enumerate(domains)
+        )
+        columns = (
+            "domain_id",
+            "path",
+            "path_key",
+            "destination",
+            "permanent",
+            "pass_query_string",
+            "match_subpaths",
+            "append_subpath",
+            "case_sensitive",
+            "notes",
+            "created_at",
+            "updated_at",
+        )
+        now = timezone.now()
+        with (
+            connection.cursor() as cursor,
+            cursor.copy(
+                f"COPY {RedirectRule._meta.db_table} ({', '.join(columns)}) FROM STDIN"
+            ) as copy,
+        ):
+            for rule in range(self.rule_count):
+                path = self.path(rule)
+                copy.write_row(
+                    (
+                        domains[rule % self.domain_count].id,
+                        path,
+                        path.lower(),
+                        f"https://destination.test/{rule}",
+                        rule % 3 == 0,
+                        False,
+                        self.is_wildcard(rule),
+                        self.is_wildcard(rule) and rule % 2 == 0,
+                        self.is_case_sensitive(rule),
+                        "",
+                        now,
+                        now,
+                    )
+                )
+        # Nothing was saved through the ORM, so no signal bumped the generation
+        RulesetGeneration.bump()
+        return domains
+
+    def requests(self, scenario: str, count: int) -> list[tuple[str, str]]:
+        """
+        (host, path) pairs of `count` requests for a scenario, picked at random from
+        the whole ruleset. Empty if the ruleset has no rules for the scenario.
+        """
+        random = Random(scenario)  # noqa: S311
+        matches = {
+            "exact": self.is_case_sensitive,
+            "case_insensitive": lambda rule: (
+                not (self.is_wildcard(rule) or self.is_case_sensitive(rule))
+            ),
+            "wildcard": self.is_wildcard,
+        }.get(scenario)
+        if matches is not None and not any(
+            matches(rule) for rule in range(min(self.rule_count, 1000))
+        ):
+            return []
+
+        requests = []
+        while len(requests) < count:
+            rule = random.randrange(self.rule_count)
+            host = self.host(rule % self.domain_count)
+            if scenario == "miss":
+                requests.append((host, f"/missing/{rule}"))
+            elif scenario == "unknown_host":
+                requests.append((f"unknown-{rule}.{BENCHMARK_HOST}", "/"))
+            elif not matches(rule):
+                continue
+            elif scenario == "exact":
+                requests.append((host, f"/{self.path(rule)}"))
+            elif scenario == "case_insensitive":
+                requests.append((host, f"/{self.path(rule).upper()}"))
+            else:
+                requests.append((host, f"/{self.path(rule)}/sub/page"))
+        return requests
+
+
+def benchmark_domains():
+    return Domain.objects.filter(names__name__endswith=f".{BENCHMARK_HOST}")
+
+
+def delete_benchmark_domains():
+    """Delete all generated benchmark domains and their rules."""
+    domains = list(benchmark_domains().values_list("id", flat=True).distinct())
+    # Deleting through the ORM would load every rule to send the delete signals
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {RedirectRuleStats._meta.db_table} WHERE rule_id IN "  # noqa: S608
+            f"(SELECT id FROM {RedirectRule._meta.db_table} WHERE domain_id = ANY(%s))",
+            [domains],
+        )
+        cursor.execute(
+            f"DELETE FROM {RedirectRule._meta.db_table} WHERE domain_id = ANY(%s)",  # noqa: S608
+            [domains],
+        )
+    Domain.objects.filter(id__in=domains).delete()
+    RulesetGeneration.bump()
+
+
+def wsgi_environ(path: str, host: str = BENCHMARK_HOST, query_string: str = ""):
+    """A minimal WSGI environ for a GET request."""
+    return {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": path,
+        "QUERY_STRING": query_string,
+        "SCRIPT_NAME": "",
+        "SERVER_NAME": host,
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": host,
+        "wsgi.url_scheme": "http",
+        "wsgi.input": BytesIO(),
+        "wsgi.errors": BytesIO(),
+        "wsgi.multithread": False,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        "wsgi.version": (1, 0),
+    }
+
+
+def asgi_scope(path: str, host: str = BENCHMARK_HOST, query_string: str = ""):
+    """A minimal ASGI HTTP scope for a GET request."""
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query_string.encode(),
+        "headers": [(b"host", host.encode())],
+        "server": (host, 80),
+    }
+
+
+@dataclass
+class Timings:
+    """
+    Per-request durations of a benchmark run, in seconds, the wall-clock time of the
+    whole run if requests were made concurrently and the number of database queries
+    made, if counted.
+    """
+
+    durations: list[float]
+    elapsed: float | None = None
+    queries: int | None = None
+
+    @property
+    def mean(self) -> float:
+        return statistics.fmean(self.durations)
+
+    def percentile(self, percent: int) -> float:
+        ordered = sorted(self.durations)
+        return ordered[min(len(ordered) - 1, len(ordered) * percent // 100)]
+
+    @property
+    def throughput(self) -> float:
+        return len(self.durations) / (self.elapsed or sum(self.durations))
+
+    @property
+    def queries_per_request(self) -> float | None:
+        if self.queries is None:
+            return None
+        return self.queries / len(self.durations)
+
+    def as_dict(self) -> dict:
+        """Summary of the run as saved in the JSON results, latencies in µs."""
+        return {
+            "requests": len(self.durations),
+            "mean_us": round(self.mean * 1e6, 1),
+            "p50_us": round(self.percentile(50) * 1e6, 1),
+            "p99_us": round(self.percentile(99) * 1e6, 1),
+            "throughput": round(self.throughput, 1),
+            "queries_per_request": self.queries_per_request,
+        }
+
+
+def _start_response(status, headers, exc_info=None):
+    pass
+
+
+def time_wsgi_requests(application: Callable, environs: Iterable[dict]) -> Timings:
+    """Call a WSGI application once per environ and time each call."""
+    durations = []
+    for environ in environs:
+        start = time.perf_counter()
+        response = application(dict(environ), _start_response)
+        for _ in response:
+            pass
+        if hasattr(response, "close"):
+            response.close()
+        durations.append(time.perf_counter() - start)
+    return Timings(durations)
+
+
+def count_wsgi_requests(application: Callable, environs: Sequence[dict]) -> Timings:
+    """Like `time_wsgi_requests`, also counting the database queries made."""
+    queries = 0
+
+    def count_query(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    # Unlike CaptureQueriesContext, doesn't keep the queries or cap their number
+    with connection.execute_wrapper(count_query):
+        timings = time_wsgi_requests(application, environs)
+    timings.queries = queries
+    return timings
+
+
+# Set before forking, inherited by the worker processes
+_wsgi_application: Callable | None = None
+
+
+def _time_wsgi_worker(environs: list[dict]) -> list[float]:
+    return time_wsgi_requests(_wsgi_application, environs).durations
+
+
+def time_wsgi_processes(
+    application: Callable, environs: Sequence[dict], processes: int
+) -> Timings:
+    """
+    Split the requests between `processes` forked worker processes, each calling the
+    WSGI application one request at a time like a single-threaded uWSGI worker.
+    """
+    global _wsgi_application
+
+    _wsgi_application = application
+    # Each worker opens its own database connection
+    connections.close_all()
+    chunks = [list(environs[index::processes]) for index in range(processes)]
+    with multiprocessing.get_context("fork").Pool(processes) as pool:
+        start = time.perf_counter()
+        results = pool.map(_time_wsgi_worker, chunks)
+        elapsed = time.perf_counter() - start
+    return Timings(list(itertools.chain.from_iterable(results)), elapsed)
+
+
+async def _asgi_request(application: Callable, scope: dict) -> float:
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if request_sent:
+            # Django keeps listening for a disconnect until the response is sent
+            await asyncio.Event().wait()
+        request_sent = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    await application(dict(scope), receive, send)
+    return time.perf_counter() - start
+
+
+async def _time_asgi_connection(application: Callable, scopes: list[dict]):
+    return [await _asgi_request(application, scope) for scope in scopes]
+
+
+async def time_asgi_requests(
+    application: Callable, scopes: Sequence[dict], concurrency: int
+) -> Timings:
+    """
+    Split the requests between `concurrency` simulated keep-alive connections, each
+    making one request at a time, served concurrently by the ASGI application on the
+    running event loop.
+    """
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            _time_asgi_connection(application, list(scopes[index::concurrency]))
+            for index in range(concurrency)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    return Timings(list(itertools.chain.from_iterable(results)), elapsed)
+
+
+def _time_asgi_worker(
+    scopes: list[dict], concurrency: int, *, fast_path: bool
+) -> Timings:
+    # The view is chosen when the URL conf is imported, see tirehtoori/urls.py
+    settings.REDIRECT_ASYNC_VIEW = True
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+    application = ASGIHandler()
+    if fast_path:
+        application = RedirectASGIApplication(application)
+    return asyncio.run(time_asgi_requests(application, scopes, concurrency))
+
+
+def time_asgi_process(
+    scopes: Sequence[dict], concurrency: int, *, fast_path: bool = False
+) -> Timings:
+    """
+    Serve the requests with the async redirect view, or the ASGI fast path, in a
+    single forked process running one event loop, like an ASGI server worker.
+    """
+    connections.close_all()
+    with multiprocessing.get_context("fork").Pool(1) as pool:
+        return pool.apply(
+            _time_asgi_worker, (list(scopes), concurrency), {"fast_path": fast_path}
+        )
@@ -0,0 +1,135 @@
+"""
+Structured log of redirect decisions: which rule, if any, a request resolved to.
+
+Writing a log record through the logging handlers on the request thread would add
+their latency, and that of whatever they write to, to every request. Instead a
+decision is put on a bounded queue, and a background thread in each process writes
+it as a line of JSON to the `redirect.decisions` logger. When the queue is full the
+decision is dropped and counted rather than waited for.
+
+Enable it with `REDIRECT_DECISION_LOG=True`, and log only a share of the requests with
+`REDIRECT_DECISION_LOG_SAMPLE_RATE`.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import UTC, datetime
+
+from django.conf import settings
+
+from redirect import metrics
+
+logger = logging.getLogger(__name__)
+decision_logger = logging.getLogger("redirect.decisions")
+
+
+def format_decision(
+    timestamp: float,
+    host: str,
+    path: str,
+    rule_id: int | None,
+    outcome: str,
+    seconds: float,
+) -> str:
+    return json.dumps(
+        {
+            "time": datetime.fromtimestamp(timestamp, UTC).isoformat(),
+            "host": host,
+            # The views get the path without its leading slash, the fast paths with it
+            "path": path if path.startswith("/") else "/" + path,
+            "rule_id": rule_id,
+            "outcome": outcome,
+            "duration_ms": round(seconds * 1000, 3),
+        }
+    )
+
+
+class DecisionLog:
+    """Decisions of this process waiting to be written."""
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.lock = threading.Lock()
+        self.queue: queue.Queue | None = None
+        self.thread: threading.Thread | None = None
+        self.sample_rate = 1.0
+        self.dropped = 0
+        self.reported_dropped = 0
+
+    def record(
+        self, host: str, path: str, rule_id: int | None, outcome: str, seconds: float
+    ):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.start()
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:  # noqa: S311
+            return
+        try:
+            self.queue.put_nowait((time.time(), host, path, rule_id, outcome, seconds))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            metrics.DECISION_LOG_DROPPED.inc()
+
+    def start(self):
+        # The settings are read once, like by `stats.HitCounter`
+        self.sample_rate = settings.REDIRECT_DECISION_LOG_SAMPLE_RATE
+        self.queue = queue.Queue(settings.REDIRECT_DECISION_LOG_QUEUE_SIZE)
+        self.thread = threading.Thread(
+            target=self.run, name="redirect-decision-log", daemon=True
+        )
+        self.thread.start()
+
+    def run(self):
+        while True:
+            decision = self.queue.get()
+            try:
+                self.write(decision)
+            except Exception:
+                logger.exception("Could not write redirect decision")
+
+    def write(self, decision: tuple):
+        decision_logger.info(format_decision(*decision))
+        if self.dropped != self.reported_dropped:
+            with self.lock:
+                dropped = self.dropped - self.reported_dropped
+                self.reported_dropped = self.dropped
+            logger.warning(
+                "Dropped %d redirect decisions, the decision log queue was full",
+                dropped,
+            )
+
+    def drain(self):
+        """Write the decisions still waiting in the queue."""
+        if self.queue is None:
+            return
+        while True:
+            try:
+                decision = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            self.write(decision)
+
+
+decision_log = DecisionLog()
+
+
+def _drain_at_exit():
+    try:
+        decision_log.drain()
+    except Exception:
+        logger.exception("Could not write redirect decisions")
+
+
+# Reset in a forked child for the same reasons as `stats.hit_counter`
+os.register_at_fork(after_in_child=decision_log._reset)
+atexit.register(_drain_at_exit)
@@ -0,0 +1,290 @@
+import json
+import logging
+import platform
+import time
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.http.request import validate_host
+from django.test import override_settings
+
+from redirect.benchmark import (
+    BENCHMARK_HOST,
+    SCENARIOS,
+    SyntheticRuleset,
+    Timings,
+    asgi_scope,
+    benchmark_domains,
+    count_wsgi_requests,
+    delete_benchmark_domains,
+    time_asgi_process,
+    time_wsgi_processes,
+    wsgi_environ,
+)
+from redirect.routing import get_routing_table, invalidate_routing_table
+from redirect.wsgi import RedirectApplication
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark resolving redirects for a synthetic ruleset through the Django "
+        "application and the WSGI fast path, for exact, case-insensitive and wildcard "
+        "matches, misses and unknown hosts. Creates temporary benchmark domains in "
+        "the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--domains",
+            type=int,
+            default=10,
+            help="Number of domains to spread the rules over",
+        )
+        parser.add_argument(
+            "--rules",
+            type=int,
+            default=1000,
+            help="Total number of redirect rules to create",
+        )
+        parser.add_argument(
+            "--wildcard-ratio",
+            type=float,
+            default=0.1,
+            help="Share of the rules that match subpaths",
+        )
+        parser.add_argument(
+            "--depth",
+            type=int,
+            default=2,
+            help="Number of path segments in each rule",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=10000,
+            help="Number of requests to time per scenario and application",
+        )
+        parser.add_argument(
+            "--resolver",
+            choices=["table", "database"],
+            default="table",
+            help="Resolve redirects from the in-memory routing table or with "
+            "database queries, i.e. REDIRECT_ROUTING_TABLE. The fast path is only "
+            "timed with the routing table.",
+        )
+        parser.add_argument(
+            "--output",
+            type=Path,
+            help="Save the results to this JSON file",
+        )
+        parser.add_argument(
+            "--baseline",
+            type=Path,
+            help="Compare the results to an earlier --output JSON file",
+        )
+        parser.add_argument(
+            "--asgi",
+            action="store_true",
+            help="Also compare one ASGI worker serving concurrent connections with "
+            "the async view against single-threaded WSGI worker processes",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=12,
+            help="Number of WSGI worker processes for --asgi, as in uWSGI's config",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1000,
+            help="Number of concurrent connections to the ASGI worker for --asgi",
+        )
+
+    def _report(self, name: str, timings: Timings):
+        queries = ""
+        if timings.queries is not None:
+            queries = f"  {timings.queries_per_request:5.2f} queries/req"
+        self.stdout.write(
+            f"{name:<16} "
+            f"mean {timings.mean * 1e6:8.1f} µs  "
+            f"p50 {timings.percentile(50) * 1e6:8.1f} µs  "
+            f"p99 {timings.percentile(99) * 1e6:8.1f} µs  "
+            f"{timings.throughput:9.0f} req/s{queries}"
+        )
+
+    def handle(self, *args, **kwargs):
+        if not settings.ENABLE_REDIRECT_APP:
+            raise CommandError("ENABLE_REDIRECT_APP must be set")
+        ruleset = SyntheticRuleset(
+            domain_count=kwargs["domains"],
+            rule_count=kwargs["rules"],
+            wildcard_ratio=kwargs["wildcard_ratio"],
+            depth=kwargs["depth"],
+        )
+        # Unknown hosts must be allowed too, to time resolving them rather than
+        # Django's DisallowedHost error
+        for host in (ruleset.host(0), f"unknown.{BENCHMARK_HOST}"):
+            if not validate_host(host, settings.ALLOWED_HOSTS):
+                raise CommandError(f"{host} must be in ALLOWED_HOSTS")
+        if benchmark_domains().exists():
+            raise CommandError(
+                "Benchmark domains already exist, delete them or the previous run "
+                "didn't clean up"
+            )
+        baseline = None
+        if kwargs["baseline"]:
+            baseline = json.loads(kwargs["baseline"].read_text())
+
+        # Don't log a warning for every miss and unknown host
+        request_logger = logging.getLogger("django.request")
+        request_logger_level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            start = time.perf_counter()
+            ruleset.create()
+            created_in = time.perf_counter() - start
+            self.stdout.write(
+                f"Created {ruleset.rule_count} rules for {ruleset.domain_count} "
+                f"domains in {created_in:.1f} s"
+            )
+            use_table = kwargs["resolver"] == "table"
+            with override_settings(REDIRECT_ROUTING_TABLE=use_table):
+                invalidate_routing_table()
+                results = self._run_scenarios(
+                    ruleset, kwargs["requests"], fast_path=use_table
+                )
+                if kwargs["asgi"]:
+                    self._compare_asgi(
+                        ruleset.requests("exact", kwargs["requests"]),
+                        kwargs["processes"],
+                        kwargs["concurrency"],
+                    )
+        finally:
+            request_logger.setLevel(request_logger_level)
+            delete_benchmark_domains()
+            invalidate_routing_table()
+
+        report = {
+            "parameters": {
+                "domains": ruleset.domain_count,
+                "rules": ruleset.rule_count,
+                "wildcard_ratio": ruleset.wildcard_ratio,
+                "depth": ruleset.depth,
+                "requests": kwargs["requests"],
+                "resolver": kwargs["resolver"],
+            },
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "machine": platform.machine(),
+            },
+            "create_seconds": round(created_in, 2),
+            "results": {
+                application: {
+                    scenario: timings.as_dict()
+                    for scenario, timings in scenarios.items()
+                }
+                for application, scenarios in results.items()
+            },
+        }
+        if baseline is not None:
+            self._compare_baseline(report, baseline)
+        if kwargs["output"]:
+            kwargs["output"].write_text(json.dumps(report, indent=2) + "\n")
+            self.stdout.write(f"\nSaved the results to {kwargs['output']}")
+
+    def _run_scenarios(
+        self, ruleset: SyntheticRuleset, request_count: int, *, fast_path: bool
+    ) -> dict[str, dict[str, Timings]]:
+        django_application = WSGIHandler()
+        applications = {"django": django_application}
+        if fast_path:
+            applications["fast path"] = RedirectApplication(django_application)
+
+        results = {name: {} for name in applications}
+        for scenario in SCENARIOS:
+            environs = [
+                wsgi_environ(path, host)
+                for host, path in ruleset.requests(scenario, request_count)
+            ]
+            if not environs:
+                continue
+            self.stdout.write(f"\n{scenario}: {len(environs)} requests")
+            for name, application in applications.items():
+                # Warm up, e.g. build the routing table
+                count_wsgi_requests(application, environs[:100])
+                results[name][scenario] = count_wsgi_requests(application, environs)
+                self._report(name, results[name][scenario])
+
+        if fast_path and "exact" in results["django"]:
+            django_mean = results["django"]["exact"].mean
+            speedup = django_mean / results["fast path"]["exact"].mean
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"\nFast path is {speedup:.1f}x faster per exact match request"
+                )
+            )
+        return results
+
+    def _compare_baseline(self, report: dict, baseline: dict):
+        if baseline.get("parameters") != report["parameters"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    "\nThe baseline was run with different parameters: "
+                    f"{baseline.get('parameters')}"
+                )
+            )
+        self.stdout.write("\nCompared to the baseline:")
+        for application, scenarios in report["results"].items():
+            for scenario, result in scenarios.items():
+                previous = baseline.get("results", {}).get(application, {})
+                previous = previous.get(scenario)
+                if previous is None:
+                    continue
+                changes = "  ".join(
+                    f"{key.removesuffix('_us')} {_change(result[key], previous[key])}"
+                    for key in ("p50_us", "p99_us", "throughput")
+                )
+                self.stdout.write(f"{application:<10} {scenario:<17} {changes}")
+
+    def _compare_asgi(
+        self, requests: list[tuple[str, str]], processes: int, concurrency: int
+    ):
+        environs = [wsgi_environ(path, host) for host, path in requests]
+        scopes = [asgi_scope(path, host) for host, path in requests]
+        # Build the routing table before forking, like uWSGI's preforking master would
+        # load the application once
+        get_routing_table()
+
+        self.stdout.write(
+            f"\nServing {len(environs)} requests with {processes} WSGI processes and "
+            f"one ASGI worker with {concurrency} concurrent connections\n"
+        )
+        wsgi = time_wsgi_processes(WSGIHandler(), environs, processes)
+        self._report(f"wsgi {processes}x1", wsgi)
+        self._report(
+            "wsgi fast path",
+            time_wsgi_processes(
+                RedirectApplication(WSGIHandler()), environs, processes
+            ),
+        )
+        for name, fast_path in (("asgi", False), ("asgi fast path", True)):
+            asgi = time_asgi_process(scopes, concurrency, fast_path=fast_path)
+            self._report(name, asgi)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"\nOne ASGI worker with the fast path serves "
+                f"{asgi.throughput / wsgi.throughput:.2f}x the throughput of "
+                f"{processes} WSGI processes"
+            )
+        )
+
+
+def _change(current: float | None, previous: float | None) -> str:
+    if not current or not previous:
+        return "n/a"
+    return f"{(current - previous) / previous:+7.1%}"
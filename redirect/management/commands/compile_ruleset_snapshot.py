@@ -0,0 +1,34 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from redirect.snapshot import compile_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Compile the redirect rules into a snapshot file shared by the worker "
+        "processes, see REDIRECT_RULESET_SNAPSHOT."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            nargs="?",
+            default=settings.REDIRECT_RULESET_SNAPSHOT,
+            help="Where to write the snapshot, defaults to REDIRECT_RULESET_SNAPSHOT",
+        )
+
+    def handle(self, *args, **kwargs):
+        path = kwargs["path"]
+        if not path:
+            raise CommandError("Give a path or set REDIRECT_RULESET_SNAPSHOT")
+
+        generation, rule_count = compile_snapshot(path)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {rule_count} rules of generation {generation} to {path} "
+                f"({os.path.getsize(path)} bytes)"
+            )
+        )
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from redirect.nginx import MAPS_FILE, SERVER_FILE, export_nginx_maps
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the redirect rules as nginx maps, so that the ingress can answer "
+        "redirects without passing them on. Include "
+        f"{MAPS_FILE} in the http context and {SERVER_FILE} in the server context. "
+        "Files are only written when their contents change."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Where to write the files")
+        parser.add_argument(
+            "--include-dir",
+            help="Where nginx finds the files, defaults to the absolute path of "
+            "the directory",
+        )
+
+    def handle(self, *args, **kwargs):
+        export, changed, removed = export_nginx_maps(
+            kwargs["directory"], kwargs["include_dir"]
+        )
+
+        for name in export.skipped_names:
+            self.stderr.write(
+                self.style.WARNING(
+                    f"Skipped domain name {name}: not in ALLOWED_HOSTS, left to the "
+                    "application"
+                )
+            )
+        for skipped in export.skipped_rules:
+            left_to_application = (
+                f"domain {skipped.domain_id} left to the application"
+                if skipped.domain_skipped
+                else "left to the application"
+            )
+            self.stderr.write(
+                self.style.WARNING(
+                    f"Can't express rule {skipped.rule_id} (/{skipped.path}) in "
+                    f"nginx: {skipped.reason}, {left_to_application}"
+                )
+            )
+
+        for name in changed:
+            self.stdout.write(f"Wrote {name}")
+        for name in removed:
+            self.stdout.write(f"Removed {name}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Exported {export.rule_count} rules, "
+                f"{len(changed) + len(removed)} files changed"
+            )
+        )
@@ -0,0 +1,88 @@
+import os
+import tempfile
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from redirect.rule_files import (
+    EXPORT_FORMATS,
+    JSON,
+    detect_format,
+    export_domains,
+    write_domains,
+)
+
+# Domains and rules fetched at a time
+CHUNK_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the redirect rules in a format import_redirect_rules reads, sorted, "
+        "so that exports of the same rules can be diffed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "file",
+            nargs="?",
+            default="-",
+            help="Where to write the rules, standard output by default",
+        )
+        parser.add_argument(
+            "--format",
+            choices=EXPORT_FORMATS,
+            help="The format of the file, detected from its extension by default",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help=f"Domains and rules fetched at a time, {CHUNK_SIZE} by default",
+        )
+
+    def handle(self, *args, **kwargs):
+        file_path = kwargs["file"]
+        file_format = kwargs["format"] or (
+            JSON if file_path == "-" else detect_format(file_path)
+        )
+        if file_format not in EXPORT_FORMATS:
+            raise CommandError(f"Can't export in the {file_format} format")
+        rule_count = 0
+
+        def count_rules(items):
+            nonlocal rule_count
+            for item in items:
+                rule_count += len(item["rules"])
+                yield item
+
+        items = count_rules(export_domains(kwargs["chunk_size"]))
+        if file_path == "-":
+            # Written as is, without a line ending added to every write
+            self.stdout.ending = ""
+            domain_count = write_domains(self.stdout, items, file_format)
+        else:
+            # Replaced only once complete
+            path = Path(file_path)
+            with tempfile.NamedTemporaryFile(
+                "w",
+                encoding="utf-8",
+                newline="",
+                dir=path.parent,
+                prefix=f".{path.name}.",
+                delete=False,
+            ) as file:
+                try:
+                    domain_count = write_domains(file, items, file_format)
+                except BaseException:
+                    os.unlink(file.name)
+                    raise
+            os.chmod(file.name, 0o644)
+            os.replace(file.name, path)
+
+        # Not mixed with the rules written to standard output
+        self.stderr.write(
+            self.style.SUCCESS(
+                f"Exported {domain_count} domains and {rule_count} rules"
+            )
+        )
@@ -1,11 +1,44 @@
-import json
-from dataclasses import dataclass
-
-from django.core.management.base import BaseCommand
-from django.db import transaction
+import hashlib
+import os
+import time
+from collections import defaultdict
+from contextlib import closing
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import NamedTuple
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
 from django.utils import timezone
 
-from redirect.models import Domain, DomainName, RedirectRule
+from redirect.models import (
+    Domain,
+    DomainName,
+    ImportCheckpoint,
+    RedirectRule,
+    RedirectRuleStats,
+)
+from redirect.rule_files import (
+    FORMATS,
+    RULE_FLAGS,
+    TIMESTAMP_NOTE_PREFIX,
+    detect_format,
+    read_domains,
+    strip_timestamp_note,
+)
+from redirect.signals import ruleset_changed
+
+# Rules read, validated and inserted at a time
+BATCH_SIZE = 1000
+# Bytes read at a time when hashing the file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+RULE_FLAG_DEFAULTS = {
+    flag: RedirectRule._meta.get_field(flag).get_default() for flag in RULE_FLAGS
+}
+# Compared to the file and updated by --sync
+SYNCED_FIELDS = ("destination", *RULE_FLAGS, "notes")
 
 
 class SentinelValue:
@@ -42,19 +75,152 @@ class Stats:
         return self.total - self.successful - self.failed
 
 
+@dataclass
+class SyncStats:
+    """What --sync changed, or would change in dry-run mode."""
+
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    names_added: int = 0
+    names_removed: int = 0
+
+
+class RulePath(NamedTuple):
+    """What the conflict checks need to know of a rule."""
+
+    path: str
+    path_key: str
+    case_sensitive: bool
+    match_subpaths: bool
+
+
+class RuleConflicts:
+    """
+    The conflict checks of `RedirectRule.clean` against the rules imported so far to
+    a new domain, done in memory instead of with queries per rule.
+    """
+
+    def __init__(self):
+        self.paths: set[str] = set()
+        # Path key -> paths of the rules with it
+        self.keys: dict[str, list[str]] = defaultdict(list)
+        self.case_sensitive_paths: set[str] = set()
+        # Path key -> (path, case_sensitive) of the wildcard rules with it, and of the
+        # wildcard rules with it as an ancestor
+        self.wildcards: dict[str, list[tuple[str, bool]]] = defaultdict(list)
+        self.wildcard_ancestors: dict[str, list[tuple[str, bool]]] = defaultdict(list)
+
+    def check(self, rule: RulePath):
+        """Raise a `ValidationError` like `RedirectRule.clean` would."""
+        if rule.case_sensitive:
+            conflicting_paths = [
+                path
+                for path in self.keys.get(rule.path_key, [])
+                if path == rule.path or path not in self.case_sensitive_paths
+            ]
+        else:
+            conflicting_paths = self.keys.get(rule.path_key, [])
+        if conflicting_paths:
+            raise ValidationError(
+                f"Path {rule.path} conflicts with existing rule(s): "
+                f"{', '.join(conflicting_paths)}"
+            )
+
+        if rule.match_subpaths:
+            for other_path, other_case_sensitive in self._related_wildcards(rule):
+                if rule.case_sensitive and other_case_sensitive:
+                    a, b = rule.path, other_path
+                else:
+                    a, b = rule.path.lower(), other_path.lower()
+                if a.startswith(f"{b}/") or b.startswith(f"{a}/"):
+                    raise ValidationError(
+                        f"Path {rule.path} conflicts with existing rule {other_path}"
+                    )
+
+    def _related_wildcards(self, rule: RulePath):
+        """Wildcard rules whose path is an ancestor or descendant of the rule's."""
+        segments = rule.path_key.split("/")
+        for index in range(1, len(segments)):
+            yield from self.wildcards.get("/".join(segments[:index]), [])
+        yield from self.wildcard_ancestors.get(rule.path_key, [])
+
+    def add(self, rule: RulePath):
+        self.paths.add(rule.path)
+        self.keys[rule.path_key].append(rule.path)
+        if rule.case_sensitive:
+            self.case_sensitive_paths.add(rule.path)
+        if rule.match_subpaths:
+            entry = (rule.path, rule.case_sensitive)
+            self.wildcards[rule.path_key].append(entry)
+            segments = rule.path_key.split("/")
+            for index in range(1, len(segments)):
+                self.wildcard_ancestors["/".join(segments[:index])].append(entry)
+
+
+@dataclass
+class DomainImport:
+    """A domain being imported, with what is needed to validate its rules."""
+
+    domain: Domain
+    names: list[str]
+    conflicts: RuleConflicts = field(default_factory=RuleConflicts)
+    # The id and `SYNCED_FIELDS` of the rules of an existing domain being synced by
+    # path. Those left after its rules have been processed are not in the file.
+    existing_rules: dict[str, tuple] = field(default_factory=dict)
+
+    def __str__(self):
+        # Like `Domain.__str__`, without querying the names
+        return f"{self.domain.display_name} ({', '.join(self.names)})"
+
+
 class Command(BaseCommand):
-    help = "Import redirect rules from a JSON file"
+    help = (
+        "Import redirect rules from a JSON, JSON Lines or CSV file. The file is read "
+        "and imported in batches, so that it doesn't need to fit in memory."
+    )
 
     def __init__(self):
         super().__init__()
         self.force: bool = NOT_SET
+        self.sync: bool = False
         self.collected_errors = []
         self.rule_import_stats = Stats()
         self.domain_import_stats = Stats()
+        self.sync_stats = SyncStats()
+        self.batch_size = BATCH_SIZE
+        # Domains committed at a time in chunked mode
+        self.chunk_size: int | None = None
+        # Items of the file processed so far
+        self.index = 0
+        # Domain names of the current batch in the database, to the id of their
+        # domain, or to None when taken earlier in the batch
+        self.taken_names: dict[str, int | None] = {}
+        # Display names of the current batch in the database or earlier in the batch
+        self.taken_display_names: set[str] = set()
+        # The existing domains of the current batch, and their names and rules, in
+        # sync mode
+        self.existing_domains: dict[int, Domain] = {}
+        self.existing_names: dict[int, dict[str, int]] = {}
+        self.existing_rules: dict[int, dict[str, tuple]] = {}
+        self.synced_domain_ids: set[int] = set()
+        # Validated but not yet written
+        self.pending_domains: list[DomainImport] = []
+        self.pending_names: list[DomainName] = []
+        self.pending_rules: list[RedirectRule] = []
+        self.pending_updates: list[RedirectRule] = []
+        self.pending_name_deletes: list[int] = []
+        self.pending_rule_deletes: list[int] = []
+        # Phase -> seconds spent in it
+        self.timings: dict[str, float] = defaultdict(float)
 
     def add_arguments(self, parser):
+        parser.add_argument("file", type=str, help="The file containing redirect rules")
         parser.add_argument(
-            "json_file", type=str, help="The JSON file containing redirect rules"
+            "--format",
+            choices=FORMATS,
+            help="The format of the file, detected from its extension by default",
         )
         parser.add_argument(
             "--dry-run",
@@ -66,6 +232,30 @@ class Command(BaseCommand):
             action="store_true",
             help="Force the import to continue even if there are errors",
         )
+        parser.add_argument(
+            "--sync",
+            action="store_true",
+            help="Update the existing domains with the same domain names to match the "
+            "file, creating, updating and deleting only the rules that differ",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help=f"Rules read and inserted at a time, {BATCH_SIZE} by default",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            help="Commit every CHUNK_SIZE domains and record the progress, instead of "
+            "importing the whole file in one transaction",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue a chunked import of the same file after its last "
+            "committed chunk",
+        )
 
     # Shortcuts for printing messages
 
@@ -84,7 +274,7 @@ class Command(BaseCommand):
     # Shortcuts end
 
     def _prepend_timestamp_note(self, notes: str) -> str:
-        return f"Generated by import command on {timezone.now()}\n{notes}"
+        return f"{TIMESTAMP_NOTE_PREFIX}{timezone.now()}\n{notes}"
 
     def raise_or_skip(self, message: str, error_type=ImporterError):
         """Raise an error or continue if --force is set"""
@@ -95,61 +285,309 @@ class Command(BaseCommand):
             raise SkipIteration()
         raise error_type(message)
 
-    def process_rule(self, domain, rule):
+    def load_taken_names(self, batch: list[dict]):
+        """
+        Look up the domain names and display names of a batch in one go. The earlier
+        batches have been inserted already, so they are found in the database too.
+        """
+        names = {name for item in batch for name in item["domain_names"]}
+        self.taken_names = dict(
+            DomainName.objects.filter(name__in=names).values_list("name", "domain_id")
+        )
+        display_names = {
+            self._display_name(item) for item in batch if item["domain_names"]
+        }
+        self.taken_display_names = set(
+            Domain.objects.filter(display_name__in=display_names).values_list(
+                "display_name", flat=True
+            )
+        )
+
+    def load_existing_domains(self):
+        """
+        Load the domains of the names taken in the database with all their names and
+        rules, so that they can be compared to the file without further queries.
+        """
+        domain_ids = set(self.taken_names.values())
+        self.existing_domains = Domain.objects.in_bulk(domain_ids)
+        self.existing_names = defaultdict(dict)
+        for name_id, name, domain_id in DomainName.objects.filter(
+            domain_id__in=domain_ids
+        ).values_list("id", "name", "domain_id"):
+            self.existing_names[domain_id][name] = name_id
+        # Compared as tuples, which is many times faster than instantiating models
+        self.existing_rules = defaultdict(dict)
+        for domain_id, path, *rule in RedirectRule.objects.filter(
+            domain_id__in=domain_ids
+        ).values_list("domain_id", "path", "id", *SYNCED_FIELDS):
+            self.existing_rules[domain_id][path] = tuple(rule)
+
+    def read_batches(self, items):
+        """Group the domains read from the file into batches of about a batch size."""
+        batch = []
+        rule_count = 0
+        start = time.perf_counter()
+        for count, item in enumerate(items, start=1):
+            batch.append(item)
+            rule_count += len(item["rules"])
+            if (
+                rule_count >= self.batch_size
+                or len(batch) >= self.batch_size
+                # Batches don't span chunks
+                or (self.chunk_size and count % self.chunk_size == 0)
+            ):
+                self.timings["read"] += time.perf_counter() - start
+                yield batch
+                batch = []
+                rule_count = 0
+                start = time.perf_counter()
+        self.timings["read"] += time.perf_counter() - start
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _display_name(item: dict) -> str:
+        return item.get("display_name") or item["domain_names"][0]
+
+    def process_rule(self, domain: DomainImport, rule: dict):
+        path = rule["path"].strip().strip("/")
         # Validate rule
-        if RedirectRule.objects.filter(
-            domain=domain, path=rule["path"].strip("/")
-        ).exists():
+        if path in domain.conflicts.paths:
             self.raise_or_skip(
                 f"Rule for {rule['path']} already exists for domain {domain}"
             )
+        # Taken out before validating, so that a rule failing it isn't deleted
+        existing = domain.existing_rules.pop(path, None)
 
-        create_kwargs = {
-            "domain": domain,
-            "path": rule["path"],
-            "destination": rule["destination"],
-            "permanent": rule.get("permanent"),
-            "case_sensitive": rule.get("case_sensitive"),
-            "pass_query_string": rule.get("pass_query_string"),
-            "match_subpaths": rule.get("match_subpaths"),
-            "append_subpath": rule.get("append_subpath"),
-            "notes": rule.get("notes", ""),
-        }
-        create_kwargs["notes"] = self._prepend_timestamp_note(create_kwargs["notes"])
-        create_kwargs = {k: v for k, v in create_kwargs.items() if v is not None}
-
-        obj = RedirectRule.objects.create(**create_kwargs)
+        values = {"destination": rule["destination"]}
+        for flag in RULE_FLAGS:
+            value = rule.get(flag)
+            values[flag] = RULE_FLAG_DEFAULTS[flag] if value is None else value
+        notes = rule.get("notes", "")
 
-        self._info(f"Created rule {obj.path or '/'} -> {obj.destination}")
+        rule_path = RulePath(
+            path, path.lower(), values["case_sensitive"], values["match_subpaths"]
+        )
+        try:
+            domain.conflicts.check(rule_path)
+        except ValidationError as e:
+            if existing is not None:
+                # The existing rule is kept, so the rules after it are checked
+                # against it instead
+                existing_values = dict(zip(SYNCED_FIELDS, existing[1:], strict=True))
+                domain.conflicts.add(
+                    RulePath(
+                        path,
+                        path.lower(),
+                        existing_values["case_sensitive"],
+                        existing_values["match_subpaths"],
+                    )
+                )
+            self.raise_or_skip(e.message, error_type=ValidationError)
+        domain.conflicts.add(rule_path)
         self.rule_import_stats.successful += 1
 
+        if existing is None:
+            obj = RedirectRule(
+                domain=domain.domain,
+                path=path,
+                path_key=rule_path.path_key,
+                notes=self._prepend_timestamp_note(notes),
+                **values,
+            )
+            self.pending_rules.append(obj)
+            self._info(f"Created rule {obj.path or '/'} -> {obj.destination}")
+            self.sync_stats.created += 1
+            return
+
+        rule_id, *existing_values, existing_notes = existing
+        changed_fields = [
+            field_name
+            for field_name, existing_value in zip(values, existing_values, strict=True)
+            if values[field_name] != existing_value
+        ]
+        if strip_timestamp_note(existing_notes) != notes:
+            changed_fields.append("notes")
+            existing_notes = self._prepend_timestamp_note(notes)
+        if not changed_fields:
+            self.sync_stats.unchanged += 1
+            return
+        self.pending_updates.append(
+            RedirectRule(id=rule_id, notes=existing_notes, **values)
+        )
+        self._info(f"Updated rule {path or '/'}: {', '.join(changed_fields)}")
+        self.sync_stats.updated += 1
+
     def process_domain(self, item, index):
         # Validate domain names
-        if len(item["domain_names"]) == 0:
+        names = item["domain_names"]
+        if len(names) == 0:
             self.raise_or_skip(f"No domain names provided for item at index {index}")
-        if DomainName.objects.filter(name__in=item["domain_names"]).exists():
+        domain_ids = {
+            self.taken_names[name] for name in names if name in self.taken_names
+        }
+        if self.sync and domain_ids and None not in domain_ids:
+            if len(domain_ids) > 1:
+                self.raise_or_skip(
+                    f"Domain names {names} belong to different domains for item at "
+                    f"index {index}"
+                )
+            (domain_id,) = domain_ids
+            if domain_id in self.synced_domain_ids:
+                self.raise_or_skip(
+                    f"Domain names {names} already synced for item at index {index}"
+                )
+            self.sync_domain(item, domain_id)
+            return
+        if domain_ids:
             self.raise_or_skip(
-                f"Domain names {item['domain_names']} already "
-                f"exist for item at index {index}"
+                f"Domain names {names} already exist for item at index {index}"
             )
-
-        domain = Domain.objects.create(
-            display_name=item.get("display_name") or item["domain_names"][0],
-            notes=self._prepend_timestamp_note(item.get("notes", "")),
+        display_name = self._display_name(item)
+        if display_name in self.taken_display_names:
+            self.raise_or_skip(
+                f"Domain {display_name} already exists for item at index {index}"
+            )
+        self.taken_names.update(dict.fromkeys(names))
+        self.taken_display_names.add(display_name)
+
+        domain = DomainImport(
+            Domain(
+                display_name=display_name,
+                notes=self._prepend_timestamp_note(item.get("notes", "")),
+            ),
+            names,
         )
-
-        for domain_name in item["domain_names"]:
-            DomainName.objects.create(name=domain_name, domain=domain)
+        self.pending_domains.append(domain)
 
         self._info(f"Created domain {domain}")
         self.domain_import_stats.successful += 1
+        self.process_rules(domain, item["rules"])
+
+    def sync_domain(self, item, domain_id: int):
+        """Update an existing domain to match the item, in sync mode."""
+        names = item["domain_names"]
+        domain = DomainImport(
+            self.existing_domains[domain_id],
+            names,
+            existing_rules=self.existing_rules.pop(domain_id, {}),
+        )
+        self.synced_domain_ids.add(domain_id)
+        self.taken_names.update(dict.fromkeys(names))
+        self._info(f"Syncing domain {domain}")
+        self.domain_import_stats.successful += 1
 
-        for rule in item["rules"]:
+        existing_names = self.existing_names.pop(domain_id, {})
+        for name in names:
+            if name not in existing_names:
+                self.pending_names.append(DomainName(name=name, domain=domain.domain))
+                self._info(f"Added domain name {name}")
+                self.sync_stats.names_added += 1
+        for name, name_id in existing_names.items():
+            if name not in names:
+                self.pending_name_deletes.append(name_id)
+                self._info(f"Removed domain name {name}")
+                self.sync_stats.names_removed += 1
+
+        self.process_rules(domain, item["rules"])
+        for path, (rule_id, *_) in domain.existing_rules.items():
+            self.pending_rule_deletes.append(rule_id)
+            self._info(f"Deleted rule {path or '/'}")
+            self.sync_stats.deleted += 1
+
+    def process_rules(self, domain: DomainImport, rules: list[dict]):
+        for rule in rules:
             try:
                 self.process_rule(domain, rule)
             except SkipIteration:
                 self.rule_import_stats.failed += 1
 
+    def delete_pending(self):
+        """
+        Delete the rules and domain names not in the file by id, without loading them
+        for the delete signals.
+        """
+        tables_and_ids = [
+            (RedirectRuleStats._meta.db_table, "rule_id", self.pending_rule_deletes),
+            (RedirectRule._meta.db_table, "id", self.pending_rule_deletes),
+            (DomainName._meta.db_table, "id", self.pending_name_deletes),
+        ]
+        using = router.db_for_write(RedirectRule)
+        with connections[using].cursor() as cursor:
+            for table, column, ids in tables_and_ids:
+                for start in range(0, len(ids), self.batch_size):
+                    cursor.execute(
+                        f"DELETE FROM {table} WHERE {column} = ANY(%s)",  # noqa: S608
+                        [ids[start : start + self.batch_size]],
+                    )
+
+    def insert_pending(self):
+        """Write the validated domains, their names and rules in batches."""
+        start = time.perf_counter()
+        changed = any(
+            (
+                self.pending_domains,
+                self.pending_names,
+                self.pending_rules,
+                self.pending_updates,
+                self.pending_name_deletes,
+                self.pending_rule_deletes,
+            )
+        )
+        # Deleted first, so that a rule can be replaced by one differing in case
+        self.delete_pending()
+        if self.pending_domains:
+            Domain.objects.bulk_create(
+                [domain.domain for domain in self.pending_domains],
+                batch_size=self.batch_size,
+            )
+            DomainName.objects.bulk_create(
+                [
+                    DomainName(name=name, domain=domain.domain)
+                    for domain in self.pending_domains
+                    for name in domain.names
+                ],
+                batch_size=self.batch_size,
+            )
+        if self.pending_names:
+            DomainName.objects.bulk_create(
+                self.pending_names, batch_size=self.batch_size
+            )
+        if self.pending_updates:
+            # Not set by bulk updates
+            now = timezone.now()
+            for rule in self.pending_updates:
+                rule.updated_at = now
+            RedirectRule.objects.bulk_update(
+                self.pending_updates,
+                [*SYNCED_FIELDS, "updated_at"],
+                batch_size=self.batch_size,
+            )
+        if self.pending_rules:
+            RedirectRule.objects.bulk_create(
+                self.pending_rules, batch_size=self.batch_size
+            )
+        if changed:
+            # Bulk writes don't send the signals saving one by one does
+            ruleset_changed(using=router.db_for_write(RedirectRule))
+        self.pending_domains = []
+        self.pending_names = []
+        self.pending_rules = []
+        self.pending_updates = []
+        self.pending_name_deletes = []
+        self.pending_rule_deletes = []
+        self.timings["insert"] += time.perf_counter() - start
+
+    def show_progress(self, file):
+        """Show how much of the file has been imported."""
+        size = os.fstat(file.fileno()).st_size
+        read = f"{file.tell() / size:.0%}" if size else "100%"
+        self._info(
+            f"Progress: {read} of the file read, "
+            f"{self.domain_import_stats.total} domain(s) and "
+            f"{self.rule_import_stats.total} rule(s) processed"
+        )
+
     def show_summary(self):
         self._info("\n========== summary ==========")
         self._info("domains:")
@@ -168,43 +606,147 @@ class Command(BaseCommand):
             self._warning(f"{self.rule_import_stats.skipped} skipped")
         self._info(f"total: {self.rule_import_stats.total}")
 
+        if self.sync:
+            self._info("\n========== diff ==========")
+            self._info(
+                f"redirect rules: {self.sync_stats.created} created, "
+                f"{self.sync_stats.updated} updated, {self.sync_stats.deleted} "
+                f"deleted, {self.sync_stats.unchanged} unchanged"
+            )
+            self._info(
+                f"domain names: {self.sync_stats.names_added} added, "
+                f"{self.sync_stats.names_removed} removed"
+            )
+
+        self._info("\n========== timing ==========")
+        for phase, seconds in self.timings.items():
+            self._info(f"{phase}: {seconds:.2f} s")
+        total = sum(self.timings.values())
+        rate = self.rule_import_stats.successful / total if total else 0
+        self._info(f"total: {total:.2f} s, {rate:.0f} rules/s")
+
         if self.collected_errors:
             self._warning("\n========== errors ==========")
             for error in self.collected_errors:
                 self._error(error)
 
+    def import_batch(self, file, batch: list[dict]):
+        start = time.perf_counter()
+        self.domain_import_stats.total += len(batch)
+        self.rule_import_stats.total += sum(len(item["rules"]) for item in batch)
+        self.load_taken_names(batch)
+        if self.sync:
+            self.load_existing_domains()
+        for item in batch:
+            self._info(f"--- Processing item #{self.index + 1}... ---")
+            try:
+                self.process_domain(item, self.index)
+            except SkipIteration:
+                self.domain_import_stats.failed += 1
+            self.index += 1
+        self.timings["validate"] += time.perf_counter() - start
+        self.insert_pending()
+        self.show_progress(file)
+
+    def load_checkpoint(self, file, *, resume: bool) -> ImportCheckpoint:
+        """The checkpoint of the file, created or restarted unless resuming."""
+        start = time.perf_counter()
+        file_hash = hashlib.sha256()
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            file_hash.update(chunk)
+        file.seek(0)
+        self.timings["read"] += time.perf_counter() - start
+
+        checkpoint, created = ImportCheckpoint.objects.get_or_create(
+            file_hash=file_hash.hexdigest(), defaults={"file_name": file.name}
+        )
+        if resume:
+            if created:
+                self._warning("No checkpoint found, starting from the beginning")
+            else:
+                self._info(
+                    f"Resuming after item #{checkpoint.committed_items} of the "
+                    f"import started on {checkpoint.created_at}"
+                )
+        elif not created:
+            if not checkpoint.finished:
+                self._warning(
+                    f"Restarting the import that stopped after item "
+                    f"#{checkpoint.committed_items}, give --resume to continue it"
+                )
+            checkpoint.file_name = file.name
+            checkpoint.committed_items = 0
+            checkpoint.finished = False
+            checkpoint.save()
+        return checkpoint
+
+    def import_in_chunks(self, file, items, checkpoint: ImportCheckpoint):
+        """Import the items after the checkpoint, committing them in chunks."""
+        self.index = checkpoint.committed_items
+        batches = self.read_batches(islice(items, checkpoint.committed_items, None))
+        batch = next(batches, None)
+        while batch is not None:
+            chunk_end = self.index + self.chunk_size
+            with transaction.atomic():
+                while batch is not None and self.index < chunk_end:
+                    self.import_batch(file, batch)
+                    batch = next(batches, None)
+                # Committed together with the chunk
+                checkpoint.committed_items = self.index
+                checkpoint.finished = batch is None
+                checkpoint.save()
+            self._info(f"Committed items up to #{self.index}")
+
     def handle(self, *args, **kwargs):
         dry_run = kwargs["dry_run"]
         self.force = kwargs["force"]
-
+        self.sync = kwargs["sync"]
+        self.batch_size = kwargs["batch_size"]
+        self.chunk_size = kwargs["chunk_size"]
+        resume = kwargs["resume"]
+
+        if resume and not self.chunk_size:
+            raise CommandError("--resume requires --chunk-size")
+        if dry_run and self.chunk_size:
+            raise CommandError("--dry-run can't be combined with --chunk-size")
         if dry_run:
             self._warning("Running in dry-run mode")
 
-        json_file = kwargs["json_file"]
-        with open(json_file) as file:
-            data = json.load(file)
-
-        self.domain_import_stats.total = len(data)
-        self._info(f"Found {self.domain_import_stats.total} item(s).")
-        self.rule_import_stats.total = sum(len(item["rules"]) for item in data)
-        self._info(f"Found {self.rule_import_stats.total} rule(s) in total.")
-
-        try:
-            with transaction.atomic():
-                for index, item in enumerate(data):
-                    self._info(f"--- Processing item #{index + 1}... ---")
-                    try:
-                        self.process_domain(item, index)
-                    except SkipIteration:
-                        self.domain_import_stats.failed += 1
-                if dry_run:
-                    raise DryRunException()
-        except DryRunException:
-            pass
-        except Exception as e:
-            self._error(f"An error occurred: {e}")
-            self._error("Rolling back changes")
-            raise
+        file_path = kwargs["file"]
+        file_format = kwargs["format"] or detect_format(file_path)
+        with open(file_path, "rb") as file:
+            checkpoint = None
+            if self.chunk_size:
+                checkpoint = self.load_checkpoint(file, resume=resume)
+                if checkpoint.finished:
+                    self._success(
+                        f"The file was imported already on {checkpoint.updated_at}"
+                    )
+                    return
+            try:
+                # Closed before the file when the import fails midway
+                with closing(read_domains(file, file_format)) as items:
+                    if checkpoint is not None:
+                        self.import_in_chunks(file, items, checkpoint)
+                    else:
+                        with transaction.atomic():
+                            for batch in self.read_batches(items):
+                                self.import_batch(file, batch)
+                            if dry_run:
+                                raise DryRunException()
+            except DryRunException:
+                pass
+            except Exception as e:
+                self._error(f"An error occurred: {e}")
+                if checkpoint is not None:
+                    self._error(
+                        "Rolling back the current chunk, the items up to "
+                        f"#{checkpoint.committed_items} stay imported. Give --resume "
+                        "to continue after them."
+                    )
+                else:
+                    self._error("Rolling back changes")
+                raise
 
         self.show_summary()
 
@@ -0,0 +1,390 @@
+"""
+Prometheus metrics for redirect resolution, served at `__metrics`.
+
+Each process records into its own in-memory registry, which costs a few dictionary
+operations per request. With `REDIRECT_METRICS_DIR` set, processes write their values
+to a file of their own in that directory at most every
+`REDIRECT_METRICS_FLUSH_INTERVAL` seconds, and a scrape adds up the files of all
+processes, so that one scrape covers every uWSGI worker of the pod. Files left behind
+by exited workers, e.g. ones recycled by `max-requests`, are merged into an archive
+file so that counters never go backwards.
+
+Counters and histograms are summed across processes, gauges take the maximum.
+"""
+
+import abc
+import atexit
+import contextlib
+import fcntl
+import json
+import logging
+import math
+import os
+import secrets
+import tempfile
+import time
+from bisect import bisect_left
+from collections.abc import Iterable
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Resolution outcomes
+EXACT = "exact"
+CASE_INSENSITIVE = "case_insensitive"
+WILDCARD = "wildcard"
+NOT_FOUND = "not_found"
+UNKNOWN_HOST = "unknown_host"
+
+# From 5 µs for the routing table to 250 ms for a slow database
+LATENCY_BUCKETS = (
+    0.000005,
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+)
+LOAD_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+ARCHIVE_FILE = "archive.json"
+LOCK_FILE = "archive.lock"
+
+
+class Metric(abc.ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Label values -> value
+        self.values = {}
+
+    @abc.abstractmethod
+    def merge(self, current, other):
+        """Combine the values of two processes."""
+
+    def samples(self, labels: tuple, value) -> Iterable[tuple[str, dict, float]]:
+        yield self.name, dict(zip(self.labelnames, labels, strict=True)), value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def merge(self, current, other):
+        return current + other
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, labels: tuple = ()):
+        self.values[labels] = value
+
+    def merge(self, current, other):
+        return max(current, other)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, labels: tuple = ()):
+        # Observations per bucket, not cumulative, followed by their sum
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def merge(self, current, other):
+        return [a + b for a, b in zip(current, other, strict=True)]
+
+    def samples(self, labels: tuple, value) -> Iterable[tuple[str, dict, float]]:
+        labels = dict(zip(self.labelnames, labels, strict=True))
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), value, strict=False):
+            cumulative += count
+            yield self.name + "_bucket", {**labels, "le": _format(bound)}, cumulative
+        yield self.name + "_sum", labels, value[-1]
+        yield self.name + "_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+        self._reset_file()
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def reset(self):
+        """
+        Forget the values recorded by the parent of a forked process, except gauges,
+        which describe state the child inherited.
+        """
+        for metric in self.metrics.values():
+            if not isinstance(metric, Gauge):
+                metric.values = {}
+        self._reset_file()
+
+    def _reset_file(self):
+        # A reused pid must not overwrite the file of an exited process
+        self.file_name = f"{os.getpid()}-{secrets.token_hex(4)}.json"
+        self.next_flush_at = 0.0
+
+    def dump(self) -> dict[str, list]:
+        # Copying a dict doesn't release the GIL, so this is safe even with threads
+        return {
+            name: _serialize(dict(metric.values))
+            for name, metric in self.metrics.items()
+        }
+
+    def flush(self, directory: str | Path):
+        """Write this process's values to its file in the metrics directory."""
+        _write_json(Path(directory) / self.file_name, self.dump())
+
+    def maybe_flush(self):
+        """Flush if the flush interval has passed since the last time."""
+        now = time.monotonic()
+        # Reading a Django setting takes longer than recording the metrics, so they
+        # are only read once per interval
+        if now < self.next_flush_at:
+            return
+        self.next_flush_at = now + settings.REDIRECT_METRICS_FLUSH_INTERVAL
+        if directory := settings.REDIRECT_METRICS_DIR:
+            try:
+                self.flush(directory)
+            except OSError:
+                logger.exception("Could not write metrics to %s", directory)
+
+    def merge(self, dumps: Iterable[dict[str, list]]) -> dict[str, dict]:
+        """Combine dumps of several processes, keyed by metric name and labels."""
+        merged: dict[str, dict] = {name: {} for name in self.metrics}
+        for dump in dumps:
+            for name, values in dump.items():
+                if (metric := self.metrics.get(name)) is None:
+                    continue
+                combined = merged[name]
+                for labels, value in values:
+                    labels = tuple(labels)
+                    current = combined.get(labels)
+                    combined[labels] = (
+                        value if current is None else metric.merge(current, value)
+                    )
+        return merged
+
+    def exposition(self, values: dict[str, dict]) -> str:
+        """Render values in the Prometheus text exposition format."""
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for labels, value in sorted(values.get(name, {}).items()):
+                for sample, sample_labels, sample_value in metric.samples(
+                    labels, value
+                ):
+                    lines.append(
+                        f"{sample}{_format_labels(sample_labels)} "
+                        f"{_format(sample_value)}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+def _serialize(values: dict) -> list:
+    # JSON has no tuples to use as keys
+    return [[list(labels), value] for labels, value in values.items()]
+
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+        for value in labels.values()
+    )
+    return (
+        "{"
+        + ",".join(
+            f'{name}="{value}"' for name, value in zip(labels, escaped, strict=True)
+        )
+        + "}"
+    )
+
+
+def _write_json(path: Path, data):
+    with tempfile.NamedTemporaryFile(
+        "w", dir=path.parent, prefix=f".{path.name}.", delete=False
+    ) as file:
+        try:
+            json.dump(data, file)
+        except BaseException:
+            os.unlink(file.name)
+            raise
+    os.replace(file.name, path)
+
+
+def _read_json(path: Path):
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logger.warning("Ignoring unreadable metrics file %s", path)
+        return None
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _archive_exited(directory: Path):
+    """Merge the files of exited processes into the archive, dropping their gauges."""
+    archived = []
+    for path in directory.glob("*-*.json"):
+        pid = path.name.partition("-")[0]
+        if pid.isdigit() and not _is_running(int(pid)):
+            dump = _read_json(path)
+            archived.append((path, dump or {}))
+    if not archived:
+        return
+
+    dumps = [
+        {
+            name: values
+            for name, values in dump.items()
+            if not isinstance(REGISTRY.metrics.get(name), Gauge)
+        }
+        for _path, dump in archived
+    ]
+    archive = _read_json(directory / ARCHIVE_FILE) or {}
+    merged = REGISTRY.merge([archive, *dumps])
+    _write_json(
+        directory / ARCHIVE_FILE,
+        {name: _serialize(values) for name, values in merged.items()},
+    )
+    for path, _dump in archived:
+        path.unlink(missing_ok=True)
+
+
+def collect() -> str:
+    """
+    The metrics of all processes sharing `REDIRECT_METRICS_DIR`, or of this process
+    only if it isn't set, in the Prometheus text exposition format.
+    """
+    directory = settings.REDIRECT_METRICS_DIR
+    if not directory:
+        return REGISTRY.exposition(REGISTRY.merge([REGISTRY.dump()]))
+
+    directory = Path(directory)
+    REGISTRY.flush(directory)
+    with open(directory / LOCK_FILE, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _archive_exited(directory)
+        dumps = [
+            dump
+            for path in [directory / ARCHIVE_FILE, *directory.glob("*-*.json")]
+            if (dump := _read_json(path)) is not None
+        ]
+    return REGISTRY.exposition(REGISTRY.merge(dumps))
+
+
+def record_resolution(outcome: str, seconds: float, domain: str | None = None):
+    """Record how long resolving a redirect request took and how it turned out."""
+    RESOLUTION_SECONDS.observe(seconds, (outcome,))
+    if domain is not None:
+        REDIRECTS.inc((domain,))
+    REGISTRY.maybe_flush()
+
+
+def _flush_at_exit():
+    if settings.configured and settings.REDIRECT_METRICS_DIR:
+        with contextlib.suppress(OSError):
+            REGISTRY.flush(settings.REDIRECT_METRICS_DIR)
+
+
+REGISTRY = Registry()
+
+RESOLUTION_SECONDS = REGISTRY.register(
+    Histogram(
+        "tirehtoori_redirect_resolution_seconds",
+        "Time taken to resolve a redirect request, by outcome.",
+        ("outcome",),
+    )
+)
+REDIRECTS = REGISTRY.register(
+    Counter(
+        "tirehtoori_redirects_total",
+        "Requests redirected, by requested domain name.",
+        ("domain",),
+    )
+)
+CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "tirehtoori_cache_requests_total",
+        "Lookups of the per-process routing table and unknown host cache, by whether "
+        "they were answered from the cache.",
+        ("cache", "result"),
+    )
+)
+RULESET_GENERATION = REGISTRY.register(
+    Gauge(
+        "tirehtoori_ruleset_generation",
+        "Newest ruleset generation loaded by any process.",
+    )
+)
+RULESET_LOAD_SECONDS = REGISTRY.register(
+    Histogram(
+        "tirehtoori_ruleset_load_seconds",
+        "Time taken to build or open the routing table.",
+        buckets=LOAD_BUCKETS,
+    )
+)
+DECISION_LOG_DROPPED = REGISTRY.register(
+    Counter(
+        "tirehtoori_decision_log_dropped_total",
+        "Redirect decisions not logged because the decision log queue was full.",
+    )
+)
+
+os.register_at_fork(after_in_child=REGISTRY.reset)
+atexit.register(_flush_at_exit)
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:33
+
+from django.db import migrations, models
+
+
+def create_ruleset_generation(apps, schema_editor):
+    RulesetGeneration = apps.get_model("redirect", "RulesetGeneration")
+    RulesetGeneration.objects.create(pk=1, generation=0)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("redirect", "0005_domain_notes_redirectrule_notes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RulesetGeneration",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("generation", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(
+            create_ruleset_generation, reverse_code=migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:45
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def populate_path_key(apps, schema_editor):
+    # Lowercased in Python like on save, since the database's lower() leaves
+    # non-ASCII letters as they are under e.g. the C collation
+    RedirectRule = apps.get_model("redirect", "RedirectRule")
+    rules = []
+    for rule in RedirectRule.objects.only("path").iterator(chunk_size=BATCH_SIZE):
+        rule.path_key = rule.path.lower()
+        rules.append(rule)
+        if len(rules) >= BATCH_SIZE:
+            RedirectRule.objects.bulk_update(rules, ["path_key"])
+            rules = []
+    RedirectRule.objects.bulk_update(rules, ["path_key"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("redirect", "0006_rulesetgeneration"),
+    ]
+
+    operations = [
+        # Default is only used for existing rows, which are populated right after.
+        migrations.AddField(
+            model_name="redirectrule",
+            name="path_key",
+            field=models.CharField(
+                default="",
+                editable=False,
+                help_text="Lowercase path used for case-insensitive lookups. Set on "
+                "save.",
+                max_length=1000,
+                verbose_name="Path lookup key",
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_path_key, reverse_code=migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="redirectrule",
+            index=models.Index(
+                fields=["domain", "path_key"],
+                include=[
+                    "id",
+                    "permanent",
+                    "pass_query_string",
+                    "match_subpaths",
+                    "append_subpath",
+                    "case_sensitive",
+                ],
+                name="redirect_rule_path_key_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("redirect", "0007_redirectrule_path_key"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="redirectrule",
+            index=models.Index(
+                condition=models.Q(("match_subpaths", True)),
+                fields=["domain", "path_key"],
+                include=(
+                    "id",
+                    "permanent",
+                    "pass_query_string",
+                    "match_subpaths",
+                    "append_subpath",
+                    "case_sensitive",
+                ),
+                name="redirect_rule_wildcard_idx",
+            ),
+        ),
+    ]
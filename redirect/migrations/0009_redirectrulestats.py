@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("redirect", "0008_redirectrule_wildcard_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RedirectRuleStats",
+            fields=[
+                (
+                    "rule",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to="redirect.redirectrule",
+                        verbose_name="Redirect rule",
+                    ),
+                ),
+                (
+                    "hits",
+                    models.PositiveBigIntegerField(default=0, verbose_name="Hits"),
+                ),
+                (
+                    "last_hit_at",
+                    models.DateTimeField(null=True, verbose_name="Last hit"),
+                ),
+            ],
+            options={
+                "verbose_name": "redirect rule statistics",
+                "verbose_name_plural": "redirect rule statistics",
+            },
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("redirect", "0009_redirectrulestats"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="redirectrule",
+            name="redirect_rule_path_key_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="redirectrule",
+            name="redirect_rule_wildcard_idx",
+        ),
+        migrations.AddField(
+            model_name="domain",
+            name="not_found_max_age",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="How many seconds browsers and CDNs may cache the response to paths of this domain without a redirect rule, 0 to disable caching. Leave empty for the default.",
+                null=True,
+                verbose_name="Not found max-age",
+            ),
+        ),
+        migrations.AddField(
+            model_name="domain",
+            name="permanent_max_age",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="How many seconds browsers and CDNs may cache permanent redirects of this domain, 0 to disable caching. Leave empty for the default.",
+                null=True,
+                verbose_name="Permanent redirect max-age",
+            ),
+        ),
+        migrations.AddField(
+            model_name="domain",
+            name="temporary_max_age",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="How many seconds browsers and CDNs may cache temporary redirects of this domain, 0 to disable caching. Leave empty for the default.",
+                null=True,
+                verbose_name="Temporary redirect max-age",
+            ),
+        ),
+        migrations.AddField(
+            model_name="redirectrule",
+            name="cache_max_age",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="How many seconds browsers and CDNs may cache this redirect, 0 to disable caching. Leave empty to use the max-age of the domain.",
+                null=True,
+                verbose_name="Max-age",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="redirectrule",
+            index=models.Index(
+                fields=["domain", "path_key"],
+                include=(
+                    "id",
+                    "permanent",
+                    "pass_query_string",
+                    "match_subpaths",
+                    "append_subpath",
+                    "case_sensitive",
+                    "cache_max_age",
+                ),
+                name="redirect_rule_path_key_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="redirectrule",
+            index=models.Index(
+                condition=models.Q(("match_subpaths", True)),
+                fields=["domain", "path_key"],
+                include=(
+                    "id",
+                    "permanent",
+                    "pass_query_string",
+                    "match_subpaths",
+                    "append_subpath",
+                    "case_sensitive",
+                    "cache_max_age",
+                ),
+                name="redirect_rule_wildcard_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("redirect", "0010_cache_max_age"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "file_hash",
+                    models.CharField(
+                        help_text="SHA-256 of the imported file",
+                        max_length=64,
+                        unique=True,
+                        verbose_name="File hash",
+                    ),
+                ),
+                (
+                    "file_name",
+                    models.CharField(max_length=1024, verbose_name="File name"),
+                ),
+                (
+                    "committed_items",
+                    models.PositiveBigIntegerField(
+                        default=0,
+                        help_text="How many items of the file have been committed",
+                        verbose_name="Committed items",
+                    ),
+                ),
+                (
+                    "finished",
+                    models.BooleanField(default=False, verbose_name="Finished"),
+                ),
+            ],
+            options={
+                "verbose_name": "import checkpoint",
+                "verbose_name_plural": "import checkpoints",
+            },
+        ),
+    ]
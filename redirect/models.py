@@ -1,6 +1,6 @@
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models import Q
+from django.db.models import F, Q
 
 
 class TimestampedModel(models.Model):
@@ -23,6 +23,28 @@ class Domain(TimestampedModel):
         verbose_name="Notes",
         help_text="Additional notes about the domain.",
     )
+    permanent_max_age = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="Permanent redirect max-age",
+        help_text="How many seconds browsers and CDNs may cache permanent redirects "
+        "of this domain, 0 to disable caching. Leave empty for the default.",
+    )
+    temporary_max_age = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="Temporary redirect max-age",
+        help_text="How many seconds browsers and CDNs may cache temporary redirects "
+        "of this domain, 0 to disable caching. Leave empty for the default.",
+    )
+    not_found_max_age = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="Not found max-age",
+        help_text="How many seconds browsers and CDNs may cache the response to paths "
+        "of this domain without a redirect rule, 0 to disable caching. Leave empty "
+        "for the default.",
+    )
 
     def __str__(self):
         domain_names = self.names.values_list("name", flat=True)
@@ -63,6 +85,12 @@ class RedirectRule(TimestampedModel):
         "stripped on save.",
         db_index=True,
     )
+    path_key = models.CharField(
+        max_length=1000,
+        editable=False,
+        verbose_name="Path lookup key",
+        help_text="Lowercase path used for case-insensitive lookups. Set on save.",
+    )
     destination = models.URLField(
         max_length=1000,
         verbose_name="Destination URL",
@@ -94,6 +122,13 @@ class RedirectRule(TimestampedModel):
         'Does nothing if "Match subpaths" is not checked.',
     )
     case_sensitive = models.BooleanField(default=False)
+    cache_max_age = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="Max-age",
+        help_text="How many seconds browsers and CDNs may cache this redirect, 0 to "
+        "disable caching. Leave empty to use the max-age of the domain.",
+    )
     notes = models.TextField(
         blank=True,
         verbose_name="Notes",
@@ -107,6 +142,40 @@ class RedirectRule(TimestampedModel):
                 fields=["domain", "path"], name="unique_domain_path"
             )
         ]
+        indexes = [
+            # Covers case-insensitive lookups. The path and the destination are read
+            # from the table, as with them an index row of long ones would exceed
+            # the maximum size of a btree index row.
+            models.Index(
+                fields=["domain", "path_key"],
+                include=[
+                    "id",
+                    "permanent",
+                    "pass_query_string",
+                    "match_subpaths",
+                    "append_subpath",
+                    "case_sensitive",
+                    "cache_max_age",
+                ],
+                name="redirect_rule_path_key_idx",
+            ),
+            # Wildcard rules of a request path's ancestors are looked up by key. Like
+            # above, the path and the destination are read from the table.
+            models.Index(
+                fields=["domain", "path_key"],
+                include=[
+                    "id",
+                    "permanent",
+                    "pass_query_string",
+                    "match_subpaths",
+                    "append_subpath",
+                    "case_sensitive",
+                    "cache_max_age",
+                ],
+                condition=Q(match_subpaths=True),
+                name="redirect_rule_wildcard_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.domain.display_name}/{self.path} -> {self.destination}"
@@ -118,6 +187,7 @@ class RedirectRule(TimestampedModel):
     def clean(self):
         # Normalize path.
         self.path = self.path.strip().strip("/")
+        self.path_key = self.path.lower()
 
         if self.case_sensitive:
             self._validate_case_sensitive_path()
@@ -135,7 +205,7 @@ class RedirectRule(TimestampedModel):
             # Compare against case-sensitive rules
             Q(domain=self.domain, path=self.path, case_sensitive=True)
             # Compare against case-insensitive rules
-            | Q(domain=self.domain, path__iexact=self.path, case_sensitive=False)
+            | Q(domain=self.domain, path_key=self.path_key, case_sensitive=False)
         ).exclude(pk=self.pk)
         if conflicting_rules.exists():
             raise ValidationError(
@@ -148,7 +218,7 @@ class RedirectRule(TimestampedModel):
         Check for case-insensitive conflicts with existing rules.
         """
         conflicting_rules = RedirectRule.objects.filter(
-            domain=self.domain, path__iexact=self.path
+            domain=self.domain, path_key=self.path_key
         ).exclude(pk=self.pk)
         if conflicting_rules.exists():
             raise ValidationError(
@@ -183,3 +253,97 @@ class RedirectRule(TimestampedModel):
                 raise ValidationError(
                     f"Path {self.path} conflicts with existing rule {rule.path}"
                 )
+
+
+class RedirectRuleStats(models.Model):
+    """
+    Hit count of a redirect rule. Kept out of `RedirectRule` so that recording hits
+    neither touches `updated_at` nor bumps the ruleset generation, see
+    `redirect.stats`.
+    """
+
+    rule = models.OneToOneField(
+        RedirectRule,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="stats",
+        verbose_name="Redirect rule",
+    )
+    hits = models.PositiveBigIntegerField(default=0, verbose_name="Hits")
+    last_hit_at = models.DateTimeField(null=True, verbose_name="Last hit")
+
+    class Meta:
+        verbose_name = "redirect rule statistics"
+        verbose_name_plural = "redirect rule statistics"
+
+    def __str__(self):
+        return f"{self.hits} hits for redirect rule {self.rule_id}"
+
+
+class RulesetGeneration(models.Model):
+    """
+    Counter of changes to the redirect rules, stored in a single row.
+
+    It is bumped once in every transaction changing a `Domain`, `DomainName` or
+    `RedirectRule`, so processes caching the rules only need to compare it to the
+    generation they have loaded to know whether to reload.
+    """
+
+    SINGLETON_ID = 1
+
+    generation = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Ruleset generation {self.generation}"
+
+    @classmethod
+    def _generation_queryset(cls, using=None):
+        return (
+            cls.objects.db_manager(using)
+            .filter(pk=cls.SINGLETON_ID)
+            .values_list("generation", flat=True)
+        )
+
+    @classmethod
+    def current(cls, using=None) -> int:
+        return cls._generation_queryset(using).first() or 0
+
+    @classmethod
+    async def acurrent(cls, using=None) -> int:
+        return await cls._generation_queryset(using).afirst() or 0
+
+    @classmethod
+    def bump(cls, using=None):
+        manager = cls.objects.db_manager(using)
+        if not manager.filter(pk=cls.SINGLETON_ID).update(
+            generation=F("generation") + 1
+        ):
+            manager.create(pk=cls.SINGLETON_ID, generation=1)
+
+
+class ImportCheckpoint(TimestampedModel):
+    """
+    Progress of a chunked `import_redirect_rules` run, committed together with each
+    chunk of domains, so that `--resume` can continue an import that stopped midway.
+    """
+
+    file_hash = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name="File hash",
+        help_text="SHA-256 of the imported file",
+    )
+    file_name = models.CharField(max_length=1024, verbose_name="File name")
+    committed_items = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name="Committed items",
+        help_text="How many items of the file have been committed",
+    )
+    finished = models.BooleanField(default=False, verbose_name="Finished")
+
+    class Meta:
+        verbose_name = "import checkpoint"
+        verbose_name_plural = "import checkpoints"
+
+    def __str__(self):
+        return f"{self.file_name}: {self.committed_items} items committed"
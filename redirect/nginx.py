@@ -0,0 +1,539 @@
+"""
+Export of the ruleset as nginx configuration, so that an nginx ingress can answer
+redirects itself and pass only the remaining requests on to the application.
+
+The export is a directory of:
+
+- `tirehtoori-maps.conf`: `map` blocks to include in the `http` context. They
+  resolve a request to a redirect, or to an empty string when nginx should pass it on.
+- `tirehtoori-server.conf`: the directives to include in the `server` context that
+  answer the resolved redirects.
+- `exact/domain-<id>.map`: the exact rules of a domain as plain strings, looked up
+  from a hash table. Plain strings match case-insensitively in nginx, so each
+  case-sensitive rule carries its path, and the path of the request is compared to it
+  before the rule applies.
+- `regex/domain-<id>.map`: the rules needing a regular expression, tried in order:
+  exact matches of rules sharing a path up to case with another rule or appending the
+  subpath, then the `match_subpaths` rules, the case-sensitive ones and the most
+  specific ones first.
+
+nginx answers a request only when it resolves exactly like the application would, and
+passes on anything it can't be sure about, e.g. requests other than GET, paths with
+percent-encoded or other unusual characters after the path of a wildcard rule, or
+doubled slashes. A domain with a rule that can't be expressed in nginx is left to the
+application as a whole, since answering its other rules could shadow it.
+
+The files are written in a deterministic order, and only when their contents change,
+so that the ingress only needs to reload when the ruleset has actually changed.
+"""
+
+import os
+import re
+import tempfile
+from collections import Counter, defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from pathlib import Path
+from urllib.parse import quote, urljoin
+
+from django.core.exceptions import DisallowedRedirect
+from django.utils.encoding import iri_to_uri
+
+from redirect.routing import (
+    APPEND_SUBPATH,
+    MATCH_SUBPATHS,
+    CompiledRule,
+    default_max_ages,
+    normalize_host,
+    pack_flags,
+    read_ruleset,
+)
+from redirect.wsgi import is_allowed_host, reserved_path_prefixes
+
+MAPS_FILE = "tirehtoori-maps.conf"
+SERVER_FILE = "tirehtoori-server.conf"
+EXACT_DIR = "exact"
+REGEX_DIR = "regex"
+DOMAIN_FILE_RE = re.compile(r"^domain-\d+\.map$")
+
+HEADER = "# Generated by the export_nginx_maps management command, do not edit.\n"
+
+# Left unencoded in paths by browsers; every other character of a rule's path is
+# percent-encoded in the raw request path the rules are matched against
+SAFE_PATH_CHARACTERS = "/!$&'()*+,;=:@~"
+# What nginx lets through after the path of a wildcard rule: characters that don't
+# decode to anything else nor need encoding in the location
+SUBPATH_CHARACTER = "[-A-Za-z0-9._~!$&'()*+,;=@/]"
+REGEX_SPECIAL_CHARACTERS = frozenset(".^$|?*+()[]{}\\")
+
+# The key the rules are matched against: the host and the raw path of GET requests
+# without a debug header, prefixed with a "-" for anything else, so that it matches
+# nothing. Paths with empty segments are left out, as the application strips
+# surrounding slashes before matching exact rules.
+MAPS_TEMPLATE = """\
+{header}
+map "$request_method:$http_x_redirect_debug" $tirehtoori_skip {{
+    "GET:" "";
+    default "-";
+}}
+
+map $request_uri $tirehtoori_path {{
+    "~^(?<tirehtoori_raw_path>(?:/[^?/]+)*/?)(?:\\\\?|$)" $tirehtoori_raw_path;
+}}
+
+geo $tirehtoori_dollar {{
+    default "$";
+}}
+
+map "$tirehtoori_skip$host$tirehtoori_path" $tirehtoori_exact {{
+    default "";
+    include {include_dir}/{exact_dir}/*.map;
+}}
+
+map "$tirehtoori_skip$host$tirehtoori_path" $tirehtoori_regex {{
+    default "";
+    include {include_dir}/{regex_dir}/*.map;
+}}
+
+# Exact rules carry the case-sensitive key they apply to, if any
+map "$host$tirehtoori_path $tirehtoori_exact" $tirehtoori_redirect {{
+    "~^(?<tirehtoori_key>\\\\S*) (?:\\\\k<tirehtoori_key>)?\\\\|(?<tirehtoori_value>.+)$" $tirehtoori_value;
+    default $tirehtoori_regex;
+}}
+
+# Redirects are "<status>|<Cache-Control>|<location>"
+map $tirehtoori_redirect $tirehtoori_cache_control {{
+    "~^\\\\d+\\\\|(?<tirehtoori_value>[^|]*)\\\\|" $tirehtoori_value;
+}}
+
+map $tirehtoori_redirect $tirehtoori_location {{
+    "~^\\\\d+\\\\|[^|]*\\\\|(?<tirehtoori_value>.*)$" $tirehtoori_value;
+}}
+"""  # noqa: E501
+
+SERVER_TEMPLATE = """\
+{header}
+# Not added when empty, i.e. to the responses of the application
+add_header Cache-Control $tirehtoori_cache_control always;
+
+if ($tirehtoori_redirect ~ "^301\\\\|") {{
+    return 301 $tirehtoori_location;
+}}
+if ($tirehtoori_redirect ~ "^302\\\\|") {{
+    return 302 $tirehtoori_location;
+}}
+"""
+
+
+@dataclass
+class SkippedRule:
+    domain_id: int
+    rule_id: int
+    path: str
+    reason: str
+    # Whether the rest of the domain's rules were left to the application, too
+    domain_skipped: bool
+
+
+@dataclass
+class NginxExport:
+    # File path relative to the export directory -> contents
+    files: dict[str, str] = field(default_factory=dict)
+    rule_count: int = 0
+    skipped_rules: list[SkippedRule] = field(default_factory=list)
+    # Domain names the application doesn't accept requests for
+    skipped_names: list[str] = field(default_factory=list)
+
+
+class InexpressibleRule(Exception):  # noqa: N818
+    pass
+
+
+def quote_string(value: str) -> str:
+    """Quote a string for an nginx configuration file."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def encode_path(path: str) -> str:
+    """The raw form of a path as sent by a browser."""
+    return quote(path, safe=SAFE_PATH_CHARACTERS)
+
+
+def path_pattern(encoded_path: str, *, case_sensitive: bool) -> str:
+    """A regular expression matching an encoded path, up to case if not sensitive."""
+    parts = []
+    index = 0
+    while index < len(encoded_path):
+        character = encoded_path[index]
+        if character == "%":
+            # Only the encoding the exact rules are matched against
+            parts.append(encoded_path[index : index + 3])
+            index += 3
+            continue
+        if not case_sensitive and character.isascii() and character.isalpha():
+            parts.append(f"[{character.upper()}{character.lower()}]")
+        elif character in REGEX_SPECIAL_CHARACTERS:
+            parts.append("\\" + character)
+        else:
+            parts.append(character)
+        index += 1
+    return "".join(parts)
+
+
+def _character_class(characters: Iterable[str]) -> str:
+    return "".join(
+        "\\" + character if character in "\\]^-" else character
+        for character in sorted(set(characters))
+    )
+
+
+def _literal(location: str) -> str:
+    # A literal "$" can't be escaped in nginx, only produced by a variable
+    return location.replace("$", "${tirehtoori_dollar}")
+
+
+class DomainExport:
+    """The map entries of a single domain."""
+
+    def __init__(self, names: list[str], reserved_prefixes: tuple[str, ...]):
+        self.names = names
+        hosts = "|".join(path_pattern(name, case_sensitive=True) for name in names)
+        self.hosts = f"(?:{hosts})" if len(names) > 1 else hosts
+        self.guard = "(?!(?i:{}))".format(
+            "|".join(
+                path_pattern(prefix.lstrip("/"), case_sensitive=True)
+                for prefix in reserved_prefixes
+            )
+        )
+        self.exact: list[tuple[str, str]] = []
+        self.exact_regex: list[tuple[str, str]] = []
+        self.wildcard: list[tuple[str, str]] = []
+        self.wildcard_ci: list[tuple[str, str]] = []
+
+    def redirect(self, rule: CompiledRule, location: str) -> str:
+        value = f"{rule.status}|{rule.cache_control}|{location}"
+        if rule.pass_query_string:
+            value += "$is_args$args"
+        return value
+
+    def add_exact(self, rule: CompiledRule):
+        """Add a rule whose path no other rule of the domain shares up to case."""
+        value = self.redirect(rule, _literal(rule.location))
+        encoded = encode_path(rule.path)
+        for name in self.names:
+            for path in [encoded, encoded + "/"] if encoded else [""]:
+                key = f"{name}/{path}"
+                expected = key if rule.case_sensitive else ""
+                self.exact.append((key.lower(), f"{expected}|{value}"))
+
+    def add_exact_regex(self, rule: CompiledRule):
+        """Add a rule whose path another rule of the domain shares up to case."""
+        if _appends_subpath(rule):
+            self.exact_regex += self.appending_entries(rule, exact=True)
+            return
+        pattern = path_pattern(
+            encode_path(rule.path), case_sensitive=rule.case_sensitive
+        )
+        self.exact_regex.append(
+            (
+                f"^{self.hosts}/{pattern}/?$" if pattern else f"^{self.hosts}/$",
+                self.redirect(rule, _literal(rule.location)),
+            )
+        )
+
+    def add_wildcard(self, rule: CompiledRule):
+        entries = self.wildcard if rule.case_sensitive else self.wildcard_ci
+        if rule.append_subpath:
+            entries += self.appending_entries(rule, exact=False)
+            return
+        value = self.redirect(rule, _literal(rule.location))
+        if rule.path:
+            pattern = path_pattern(
+                encode_path(rule.path), case_sensitive=rule.case_sensitive
+            )
+            entries.append(
+                (f"^{self.hosts}/{pattern}(?:/{SUBPATH_CHARACTER}*)?$", value)
+            )
+            entries.append(self.pass_on(f"{pattern}(?:/|$)"))
+        else:
+            entries.append((f"^{self.hosts}/{self.guard}{SUBPATH_CHARACTER}*$", value))
+            entries.append(self.pass_on(self.guard))
+
+    def pass_on(self, start: str) -> tuple[str, str]:
+        """
+        An entry passing on the requests matching a rule that its other entries
+        didn't answer, instead of letting a less specific rule answer them.
+        """
+        return f"^{self.hosts}/{start}", ""
+
+    def appending_entries(self, rule: CompiledRule, *, exact: bool):
+        """
+        Entries of a rule appending the subpath, matching its path only if `exact`.
+
+        They follow `CompiledRule.location_for`: the subpath is what remains of the
+        request path after stripping the characters of the rule's path from its
+        start, and is joined with the destination like a relative URL.
+        """
+        if encode_path(rule.path) != rule.path:
+            raise InexpressibleRule(
+                rule,
+                "the path of a rule appending the subpath has characters needing "
+                "encoding",
+            )
+        try:
+            origin, directory = _join_prefixes(rule.destination)
+        except ValueError:
+            raise InexpressibleRule(
+                rule, "the destination can't have a subpath appended"
+            ) from None
+        if rule.path:
+            pattern = path_pattern(rule.path, case_sensitive=rule.case_sensitive)
+            end = "/?$" if exact else "(?:/|$)"
+            start = f"(?={pattern}{end})"
+            strip = f"[{_character_class(rule.path)}]*+"
+        else:
+            start = "(?=/?$)" if exact else self.guard
+            strip = ""
+        base = f"^{self.hosts}/{start}{strip}"
+        no_dot_segments = f"(?!{SUBPATH_CHARACTER}*/\\.)"
+        return [
+            (f"{base}$", self.redirect(rule, _literal(rule.location))),
+            # Joined as an absolute path, replacing the path of the destination
+            (
+                f"{base}(?<tirehtoori_subpath>/(?![/.]){no_dot_segments}"
+                f"{SUBPATH_CHARACTER}*)$",
+                self.redirect(rule, _literal(origin) + "$tirehtoori_subpath"),
+            ),
+            # Joined as a relative path, replacing the last segment of the destination
+            (
+                f"{base}(?<tirehtoori_subpath>(?![/.]){no_dot_segments}"
+                f"{SUBPATH_CHARACTER}+)$",
+                self.redirect(rule, _literal(directory) + "$tirehtoori_subpath"),
+            ),
+            self.pass_on(start),
+        ]
+
+
+def _join_prefixes(destination: str) -> tuple[str, str]:
+    """
+    What an absolute and a relative subpath are appended to when joined with the
+    destination, e.g. "https://acme.test" and "https://acme.test/foo/" for
+    "https://acme.test/foo/bar".
+    """
+
+    def join(subpath):
+        return iri_to_uri(urljoin(destination, subpath))
+
+    origin = join("/a")[: -len("/a")]
+    directory = join("a")[: -len("a")]
+    if join("/b/c") != f"{origin}/b/c" or join("b/c") != f"{directory}b/c":
+        raise ValueError(destination)
+    return origin, directory
+
+
+def compile_nginx_maps(
+    domain_names: Iterable[tuple],
+    rules: Iterable[tuple],
+    include_dir: str,
+) -> NginxExport:
+    """
+    Compile the ruleset into the files of the export.
+
+    :param domain_names: rows as read by `read_ruleset`
+    :param rules: rows as read by `read_ruleset`
+    :param include_dir: the directory nginx finds the export in
+    """
+    permanent_max_age, temporary_max_age, _ = default_max_ages()
+    reserved_prefixes = reserved_path_prefixes()
+    export = NginxExport()
+
+    names_by_domain = defaultdict(list)
+    for name, domain_id, _not_found_max_age in domain_names:
+        name = normalize_host(name)
+        if is_allowed_host(name):
+            names_by_domain[domain_id].append(name)
+        else:
+            export.skipped_names.append(name)
+    export.skipped_names.sort()
+
+    rules_by_domain = defaultdict(list)
+    for (
+        domain_id,
+        rule_id,
+        path,
+        destination,
+        permanent,
+        pass_query_string,
+        match_subpaths,
+        append_subpath,
+        case_sensitive,
+        max_age,
+    ) in rules:
+        if domain_id not in names_by_domain:
+            continue
+        flags = pack_flags(
+            permanent, pass_query_string, match_subpaths, append_subpath, case_sensitive
+        )
+        if max_age is None:
+            max_age = permanent_max_age if permanent else temporary_max_age
+        try:
+            rule = CompiledRule(rule_id, path, destination, flags, max_age=max_age)
+        except DisallowedRedirect as e:
+            # Not served by the application either
+            export.skipped_rules.append(
+                SkippedRule(domain_id, rule_id, path, str(e), domain_skipped=False)
+            )
+            continue
+        if ("/" + path.lower()).startswith(
+            tuple(prefix.lower() for prefix in reserved_prefixes)
+        ):
+            # nginx never answers these paths
+            export.skipped_rules.append(
+                SkippedRule(
+                    domain_id,
+                    rule_id,
+                    path,
+                    "the path is reserved for the application",
+                    domain_skipped=False,
+                )
+            )
+            continue
+        rules_by_domain[domain_id].append(rule)
+
+    for domain_id in sorted(rules_by_domain):
+        domain_rules = sorted(rules_by_domain[domain_id], key=lambda rule: rule.id)
+        domain = DomainExport(sorted(names_by_domain[domain_id]), reserved_prefixes)
+        try:
+            _add_rules(domain, domain_rules)
+        except InexpressibleRule as e:
+            rule, reason = e.args
+            export.skipped_rules.append(
+                SkippedRule(domain_id, rule.id, rule.path, reason, domain_skipped=True)
+            )
+            continue
+        export.rule_count += len(domain_rules)
+        if domain.exact:
+            export.files[f"{EXACT_DIR}/domain-{domain_id}.map"] = _map_file(
+                sorted(domain.exact)
+            )
+        regex_entries = domain.exact_regex + domain.wildcard + domain.wildcard_ci
+        if regex_entries:
+            export.files[f"{REGEX_DIR}/domain-{domain_id}.map"] = _map_file(
+                ("~" + pattern, value) for pattern, value in regex_entries
+            )
+
+    include_dir = include_dir.rstrip("/")
+    export.files[MAPS_FILE] = MAPS_TEMPLATE.format(
+        header=HEADER,
+        include_dir=include_dir,
+        exact_dir=EXACT_DIR,
+        regex_dir=REGEX_DIR,
+    )
+    export.files[SERVER_FILE] = SERVER_TEMPLATE.format(header=HEADER)
+    return export
+
+
+def _appends_subpath(rule: CompiledRule) -> bool:
+    return rule.flags & (MATCH_SUBPATHS | APPEND_SUBPATH) == (
+        MATCH_SUBPATHS | APPEND_SUBPATH
+    )
+
+
+def _add_rules(domain: DomainExport, rules: list[CompiledRule]):
+    # The hash table can't tell apart paths differing only in case
+    keys = Counter(encode_path(rule.path).lower() for rule in rules)
+    exact_regex_rules = []
+    for rule in rules:
+        if not rule.case_sensitive and not rule.path.isascii():
+            # Neither the hash table nor the regular expressions fold the case of
+            # percent-encoded characters
+            raise InexpressibleRule(
+                rule, "a case-insensitive path with non-ASCII characters"
+            )
+        # The location of a rule appending the subpath depends on the case and
+        # trailing slash of the request path even for an exact match
+        if keys[encode_path(rule.path).lower()] > 1 or _appends_subpath(rule):
+            exact_regex_rules.append(rule)
+        else:
+            domain.add_exact(rule)
+
+    # Case-sensitive rules first, like in `DomainRoutes.resolve`
+    for rule in sorted(
+        exact_regex_rules, key=lambda rule: (not rule.case_sensitive, rule.path)
+    ):
+        domain.add_exact_regex(rule)
+
+    # The most specific rules first, like in `PathTrie.find`
+    for rule in sorted(
+        (rule for rule in rules if rule.match_subpaths),
+        key=lambda rule: (-len(_segments(rule.path)), rule.path),
+    ):
+        domain.add_wildcard(rule)
+
+
+def _segments(path: str) -> list[str]:
+    return path.split("/") if path else []
+
+
+def _map_file(entries: Iterable[tuple[str, str]]) -> str:
+    lines = [HEADER]
+    lines += [f"{quote_string(key)} {quote_string(value)};\n" for key, value in entries]
+    return "".join(lines)
+
+
+def write_nginx_maps(directory, export: NginxExport) -> tuple[list[str], list[str]]:
+    """
+    Write the files of an export that have changed, replacing each atomically, and
+    remove the files of domains no longer exported. Returns the changed and removed
+    file paths relative to the directory.
+    """
+    directory = Path(directory)
+    changed = []
+    for name, contents in sorted(export.files.items()):
+        path = directory / name
+        try:
+            if path.read_text() == contents:
+                continue
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=path.parent, prefix=f".{path.name}.", delete=False
+        ) as file:
+            try:
+                file.write(contents)
+                file.flush()
+                os.fsync(file.fileno())
+            except BaseException:
+                os.unlink(file.name)
+                raise
+        os.chmod(file.name, 0o644)
+        os.replace(file.name, path)
+        changed.append(name)
+
+    removed = []
+    for subdirectory in (EXACT_DIR, REGEX_DIR):
+        if not (directory / subdirectory).is_dir():
+            continue
+        for path in sorted((directory / subdirectory).iterdir()):
+            name = f"{subdirectory}/{path.name}"
+            if DOMAIN_FILE_RE.match(path.name) and name not in export.files:
+                path.unlink()
+                removed.append(name)
+    return changed, removed
+
+
+def export_nginx_maps(
+    directory, include_dir: str | None = None
+) -> tuple[NginxExport, list[str], list[str]]:
+    """
+    Export the current ruleset from the database into a directory.
+
+    :param include_dir: the directory nginx finds the export in, by default the
+        absolute path of `directory`
+    """
+    _generation, domain_names, rules = read_ruleset()
+    export = compile_nginx_maps(
+        domain_names, rules, include_dir or str(Path(directory).resolve())
+    )
+    changed, removed = write_nginx_maps(directory, export)
+    return export, changed, removed
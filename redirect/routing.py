@@ -0,0 +1,703 @@
+"""
+In-process compiled routing table for redirect resolution.
+
+The table is built from the database in a couple of queries and kept per process.
+Resolving a request is then a matter of dictionary lookups and a walk down a
+path-segment trie, without touching the database.
+
+Hosts are matched after normalization, see `normalize_host`. Hosts that match no
+domain are remembered in a bounded negative cache, so repeated requests for them cost
+neither a query nor normalization. The cache belongs to the table and is discarded
+with it whenever the rules or domain names change.
+
+To notice changes made by other processes, the table remembers the ruleset generation
+it was built from. At most once per `REDIRECT_RULESET_CHECK_INTERVAL` seconds the
+generation is compared to the one in the database, and the table is rebuilt only if it
+has changed. Async code uses `aget_routing_table`, where concurrent requests share a
+single refresh instead of each checking the generation.
+
+With `REDIRECT_RULESET_SNAPSHOT` set, processes use a memory-mapped snapshot of the
+compiled rules shared by all of them instead, see `redirect.snapshot`.
+"""
+
+import asyncio
+import contextlib
+import functools
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+from urllib.parse import urljoin, urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import DisallowedRedirect
+from django.db.models import Case, When
+from django.db.models.functions import Coalesce
+from django.http.response import HttpResponseRedirectBase
+from django.utils.encoding import iri_to_uri
+
+from redirect import decision_log, metrics, stats
+from redirect.models import DomainName, RedirectRule, RulesetGeneration
+
+if TYPE_CHECKING:
+    from redirect.snapshot import RulesetSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+# Bits of `CompiledRule.flags`
+PERMANENT = 1
+PASS_QUERY_STRING = 2
+MATCH_SUBPATHS = 4
+APPEND_SUBPATH = 8
+CASE_SENSITIVE = 16
+
+# The max-age set for a rule, or for the permanent or temporary redirects of its domain
+RULE_MAX_AGE = Coalesce(
+    "cache_max_age",
+    Case(
+        When(permanent=True, then="domain__permanent_max_age"),
+        default="domain__temporary_max_age",
+    ),
+)
+
+# Label values of `metrics.CACHE_REQUESTS`
+TABLE_HIT = ("routing_table", "hit")
+TABLE_MISS = ("routing_table", "miss")
+UNKNOWN_HOST_HIT = ("unknown_hosts", "hit")
+UNKNOWN_HOST_MISS = ("unknown_hosts", "miss")
+
+
+def pack_flags(
+    permanent, pass_query_string, match_subpaths, append_subpath, case_sensitive
+) -> int:
+    """Pack the boolean fields of a rule into `CompiledRule.flags`."""
+    return (
+        (PERMANENT if permanent else 0)
+        | (PASS_QUERY_STRING if pass_query_string else 0)
+        | (MATCH_SUBPATHS if match_subpaths else 0)
+        | (APPEND_SUBPATH if append_subpath else 0)
+        | (CASE_SENSITIVE if case_sensitive else 0)
+    )
+
+
+@functools.cache
+def cache_control(max_age: int) -> str:
+    """The Cache-Control header of a response cacheable for `max_age` seconds."""
+    return f"public, max-age={max_age}" if max_age > 0 else "no-store"
+
+
+def default_max_ages() -> tuple[int, int, int]:
+    """The default max-age of permanent and temporary redirects and of not found."""
+    return (
+        settings.REDIRECT_PERMANENT_MAX_AGE,
+        settings.REDIRECT_TEMPORARY_MAX_AGE,
+        settings.REDIRECT_NOT_FOUND_MAX_AGE,
+    )
+
+
+class CompiledRule:
+    """
+    The subset of a `RedirectRule` needed to answer a redirect request, together with
+    the encoded and validated location, which only depends on the rule.
+
+    Tables hold one per rule, so it is kept small: the flags are packed into a single
+    integer, the location is the destination itself when it needs no encoding and the
+    Cache-Control header is shared by all rules with the same max-age.
+    """
+
+    __slots__ = ("id", "path", "destination", "location", "flags", "cache_control")
+
+    def __init__(
+        self,
+        id: int,  # noqa: A002
+        path: str,
+        destination: str,
+        flags: int,
+        *,
+        location: str | None = None,
+        max_age: int | None = None,
+    ):
+        """
+        :param flags: see `pack_flags`
+        :param location: the already encoded and validated location of the
+            destination, if known
+        :param max_age: seconds the redirect may be cached for, by default the
+            `REDIRECT_PERMANENT_MAX_AGE` or `REDIRECT_TEMPORARY_MAX_AGE` setting
+        """
+        self.id = id
+        self.path = path
+        self.destination = destination
+        self.flags = flags
+        if max_age is None:
+            permanent_max_age, temporary_max_age, _ = default_max_ages()
+            max_age = permanent_max_age if flags & PERMANENT else temporary_max_age
+        self.cache_control = cache_control(max_age)
+        if location is None:
+            location = encode_location(destination)
+        # Most destinations need no encoding, don't keep a copy of those
+        self.location = destination if location == destination else location
+
+    permanent = property(lambda self: bool(self.flags & PERMANENT))
+    pass_query_string = property(lambda self: bool(self.flags & PASS_QUERY_STRING))
+    match_subpaths = property(lambda self: bool(self.flags & MATCH_SUBPATHS))
+    append_subpath = property(lambda self: bool(self.flags & APPEND_SUBPATH))
+    case_sensitive = property(lambda self: bool(self.flags & CASE_SENSITIVE))
+    status = property(lambda self: 301 if self.flags & PERMANENT else 302)
+
+    def __eq__(self, other):
+        if not isinstance(other, CompiledRule):
+            return NotImplemented
+        return (
+            self.id,
+            self.path,
+            self.destination,
+            self.flags,
+            self.cache_control,
+        ) == (
+            other.id,
+            other.path,
+            other.destination,
+            other.flags,
+            other.cache_control,
+        )
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return (
+            f"CompiledRule(id={self.id!r}, path={self.path!r}, "
+            f"destination={self.destination!r}, flags={self.flags:#07b})"
+        )
+
+    @classmethod
+    def from_model(
+        cls, rule: RedirectRule, max_age: int | None = None
+    ) -> "CompiledRule":
+        """
+        :param max_age: the max-age set for the rule or its domain, the rule's own
+            `cache_max_age` by default
+        """
+        return cls(
+            rule.id,
+            rule.path,
+            rule.destination,
+            pack_flags(
+                rule.permanent,
+                rule.pass_query_string,
+                rule.match_subpaths,
+                rule.append_subpath,
+                rule.case_sensitive,
+            ),
+            max_age=rule.cache_max_age if max_age is None else max_age,
+        )
+
+    def location_for(self, path: str, query_string: str = "") -> str:
+        """Return the redirect location for a request path and query string."""
+        location = self.location
+
+        # Append subpath if needed
+        if self.flags & (MATCH_SUBPATHS | APPEND_SUBPATH) == (
+            MATCH_SUBPATHS | APPEND_SUBPATH
+        ):
+            # Needs to behave like /foo/(.*) -> someurl.com/(.*), where (.*) is the
+            # subpath
+            subpath = path.lstrip(self.path)
+            location = iri_to_uri(urljoin(self.destination, subpath))
+            _validate_location(location)
+
+        # Append query string if needed
+        if self.flags & PASS_QUERY_STRING and query_string:
+            location += f"?{iri_to_uri(query_string)}"
+
+        return location
+
+
+def encode_location(destination: str) -> str:
+    """Encode a destination for the Location header and validate it."""
+    location = iri_to_uri(destination)
+    _validate_location(location)
+    return location
+
+
+def _validate_location(location: str):
+    """Apply the same check as `HttpResponseRedirect` does to its URL."""
+    scheme = urlsplit(location).scheme
+    if scheme and scheme not in HttpResponseRedirectBase.allowed_schemes:
+        raise DisallowedRedirect(f"Unsafe redirect to URL with protocol '{scheme}'")
+
+
+class PathTrie:
+    """Path-segment trie holding `match_subpaths` rules."""
+
+    __slots__ = ("children", "rule")
+
+    def __init__(self):
+        # Created on demand, most nodes are leaves
+        self.children: dict[str, PathTrie] | None = None
+        self.rule: CompiledRule | None = None
+
+    def insert(self, segments: list[str], rule: CompiledRule):
+        node = self
+        for segment in segments:
+            if node.children is None:
+                node.children = {}
+            # Segments like "fi" or "palvelut" repeat across many paths
+            node = node.children.setdefault(sys.intern(segment), PathTrie())
+        node.rule = rule
+
+    def find(self, segments: list[str]) -> CompiledRule | None:
+        """Return the most specific rule whose path is a prefix of `segments`."""
+        node = self
+        found = node.rule
+        for segment in segments:
+            if node.children is None or (node := node.children.get(segment)) is None:
+                break
+            if node.rule is not None:
+                found = node.rule
+        return found
+
+
+class DomainRoutes:
+    """Compiled redirect rules of a single domain."""
+
+    __slots__ = (
+        "exact",
+        "exact_ci",
+        "wildcard",
+        "wildcard_ci",
+        "not_found_cache_control",
+    )
+
+    def __init__(self, not_found_cache_control: str | None = None):
+        """
+        :param not_found_cache_control: of responses to paths without a rule, by
+            default as set by `REDIRECT_NOT_FOUND_MAX_AGE`
+        """
+        if not_found_cache_control is None:
+            not_found_cache_control = cache_control(default_max_ages()[2])
+        self.not_found_cache_control = not_found_cache_control
+        # Case-sensitive rules keyed by path
+        self.exact: dict[str, CompiledRule] = {}
+        # Case-insensitive rules keyed by lowercase path
+        self.exact_ci: dict[str, CompiledRule] = {}
+        # Wildcard rules keyed by path segments (lowercased for case-insensitive)
+        self.wildcard = PathTrie()
+        self.wildcard_ci = PathTrie()
+
+    def add(self, rule: CompiledRule):
+        if rule.case_sensitive:
+            self.exact[rule.path] = rule
+        else:
+            key = rule.path.lower()
+            # Most paths already are lowercase, don't keep a copy of those
+            self.exact_ci[rule.path if key == rule.path else key] = rule
+
+        if rule.match_subpaths:
+            if rule.case_sensitive:
+                self.wildcard.insert(_split(rule.path), rule)
+            else:
+                self.wildcard_ci.insert(_split(rule.path.lower()), rule)
+
+    def resolve(self, path: str) -> CompiledRule | None:
+        """
+        Find the rule for a path. Same precedence as the database lookups: an exact
+        case-sensitive match, then an exact case-insensitive match, then a wildcard
+        rule matching one of the path's ancestors.
+        """
+        # Keep `redirect.tracing.trace_routes` in step
+        cleaned_path = path.strip("/")
+        if (rule := self.exact.get(cleaned_path)) is not None:
+            return rule
+
+        lowered_path = cleaned_path.lower()
+        if (rule := self.exact_ci.get(lowered_path)) is not None:
+            return rule
+
+        # Path validation guarantees at most one wildcard rule matches a given path
+        return self.wildcard.find(_split(cleaned_path)) or self.wildcard_ci.find(
+            _split(lowered_path)
+        )
+
+
+def _split(path: str) -> list[str]:
+    return path.split("/") if path else []
+
+
+def normalize_host(host: str) -> str:
+    """
+    Normalize a host for matching: lowercase it, drop the port and any trailing dot
+    and encode internationalized names to punycode, e.g. "Bücher.Example:8000" ->
+    "xn--bcher-kva.example".
+    """
+    host = host.strip().lower()
+    # Drop the port; IPv6 literals are enclosed in brackets, e.g. [::1]:8000
+    is_ipv6 = host.startswith("[")
+    host = host[: host.find("]") + 1] if is_ipv6 else host.partition(":")[0]
+    host = host.rstrip(".")
+    if not host.isascii():
+        # Not a valid domain name if it can't be encoded; it won't match anything
+        with contextlib.suppress(UnicodeError):
+            host = host.encode("idna").decode("ascii")
+    return host
+
+
+class HostIndex:
+    """Normalized host to domain routes mapping with a negative cache."""
+
+    __slots__ = ("routes", "unknown", "max_unknown")
+
+    def __init__(self, routes: dict[str, DomainRoutes], max_unknown: int = 10000):
+        self.routes = routes
+        # Unknown hosts as received, oldest first
+        self.unknown: OrderedDict[str, None] = OrderedDict()
+        self.max_unknown = max_unknown
+
+    def __len__(self):
+        return len(self.routes)
+
+    def get(self, host: str) -> DomainRoutes | None:
+        # Most requests carry an already normalized host
+        if (routes := self.routes.get(host)) is not None:
+            return routes
+        if host in self.unknown:
+            metrics.CACHE_REQUESTS.inc(UNKNOWN_HOST_HIT)
+            return None
+
+        routes = self.routes.get(normalize_host(host))
+        if routes is None and self.max_unknown > 0:
+            metrics.CACHE_REQUESTS.inc(UNKNOWN_HOST_MISS)
+            self.unknown[host] = None
+            while len(self.unknown) > self.max_unknown:
+                self.unknown.popitem(last=False)
+        return routes
+
+    def __contains__(self, host: str) -> bool:
+        # Unlike `get`, leaves the negative cache alone
+        return host in self.routes or normalize_host(host) in self.routes
+
+
+class RoutingTable:
+    """Host to domain mapping together with the compiled rules of each domain."""
+
+    def __init__(
+        self,
+        hosts: HostIndex,
+        generation: int = 0,
+        unknown_host_cache_control: str | None = None,
+    ):
+        """
+        :param unknown_host_cache_control: of responses to unknown hosts, by default
+            as set by `REDIRECT_NOT_FOUND_MAX_AGE`
+        """
+        self.hosts = hosts
+        self.generation = generation
+        if unknown_host_cache_control is None:
+            unknown_host_cache_control = cache_control(default_max_ages()[2])
+        self.unknown_host_cache_control = unknown_host_cache_control
+
+    @classmethod
+    def from_rows(
+        cls,
+        domain_names: Iterable[tuple[str, int]],
+        rules: Iterable[tuple],
+        generation: int = 0,
+        max_unknown_hosts: int = 10000,
+    ) -> "RoutingTable":
+        """
+        Compile a routing table.
+
+        :param domain_names: (name, domain_id, not_found_max_age) tuples
+        :param rules: (domain_id, id, path, destination, permanent,
+            pass_query_string, match_subpaths, append_subpath, case_sensitive,
+            max_age) tuples
+        :param generation: the ruleset generation the rows were read at
+        :param max_unknown_hosts: size of the negative cache for unknown hosts
+
+        A max-age of None stands for the default.
+        """
+        permanent_max_age, temporary_max_age, not_found_max_age = default_max_ages()
+
+        routes_by_domain: dict[int, DomainRoutes] = {}
+        hosts = {}
+        for name, domain_id, domain_not_found_max_age in domain_names:
+            if (routes := routes_by_domain.get(domain_id)) is None:
+                routes = routes_by_domain[domain_id] = DomainRoutes(
+                    cache_control(
+                        not_found_max_age
+                        if domain_not_found_max_age is None
+                        else domain_not_found_max_age
+                    )
+                )
+            hosts[sys.intern(normalize_host(name))] = routes
+
+        # Many rules share a destination, keep a single copy of it and its location
+        locations: dict[str, str] = {}
+        for (
+            domain_id,
+            rule_id,
+            path,
+            destination,
+            permanent,
+            pass_query_string,
+            match_subpaths,
+            append_subpath,
+            case_sensitive,
+            max_age,
+        ) in rules:
+            # Rules of a domain without any names can never be reached
+            if (routes := routes_by_domain.get(domain_id)) is None:
+                continue
+            destination = sys.intern(destination)
+            if (location := locations.get(destination)) is None:
+                try:
+                    location = locations[destination] = encode_location(destination)
+                except DisallowedRedirect as e:
+                    logger.warning("Skipping redirect rule %s: %s", rule_id, e)
+                    continue
+            flags = pack_flags(
+                permanent,
+                pass_query_string,
+                match_subpaths,
+                append_subpath,
+                case_sensitive,
+            )
+            if max_age is None:
+                max_age = permanent_max_age if permanent else temporary_max_age
+            rule = CompiledRule(
+                rule_id, path, destination, flags, location=location, max_age=max_age
+            )
+            routes.add(rule)
+
+        return cls(
+            HostIndex(hosts, max_unknown_hosts),
+            generation,
+            cache_control(not_found_max_age),
+        )
+
+    @classmethod
+    def build(cls) -> "RoutingTable":
+        """Compile a routing table from the current database contents."""
+        generation, domain_names, rules = read_ruleset()
+        return cls.from_rows(
+            domain_names,
+            rules,
+            generation,
+            max_unknown_hosts=settings.REDIRECT_UNKNOWN_HOST_CACHE_SIZE,
+        )
+
+    def resolve(self, host: str, path: str) -> CompiledRule | None:
+        """Find the rule for a host and path, or None if there is no match."""
+        routes = self.hosts.get(host)
+        if routes is None:
+            return None
+        return routes.resolve(path)
+
+    def knows_host(self, host: str) -> bool:
+        return host in self.hosts
+
+    def not_found_cache_control(self, host: str) -> str:
+        """The Cache-Control header of a response to a host without a matching rule."""
+        routes = self.hosts.routes.get(host) or self.hosts.routes.get(
+            normalize_host(host)
+        )
+        if routes is None:
+            return self.unknown_host_cache_control
+        return routes.not_found_cache_control
+
+
+def read_ruleset() -> tuple[int, Iterable[tuple], Iterable[tuple]]:
+    """
+    Read the current ruleset generation, domain names and rules from the database in
+    the format expected by `RoutingTable.from_rows`.
+    """
+    # Read the generation first; a change committed while the rows are being read
+    # then only causes one unnecessary rebuild instead of being missed.
+    generation = RulesetGeneration.current()
+    domain_names = DomainName.objects.values_list(
+        "name", "domain_id", "domain__not_found_max_age"
+    )
+    rules = (
+        RedirectRule.objects.order_by()
+        .annotate(max_age=RULE_MAX_AGE)
+        .values_list(
+            "domain_id",
+            "id",
+            "path",
+            "destination",
+            "permanent",
+            "pass_query_string",
+            "match_subpaths",
+            "append_subpath",
+            "case_sensitive",
+            "max_age",
+        )
+        .iterator(chunk_size=5000)
+    )
+    return generation, domain_names, rules
+
+
+def load_routing_table() -> "RoutingTable | RulesetSnapshot":
+    """
+    Build a routing table from the database, or with `REDIRECT_RULESET_SNAPSHOT` set,
+    open the shared snapshot, compiling it first if it is out of date.
+    """
+    start = time.perf_counter()
+    table = _load_routing_table()
+    metrics.RULESET_LOAD_SECONDS.observe(time.perf_counter() - start)
+    metrics.RULESET_GENERATION.set(table.generation)
+    metrics.CACHE_REQUESTS.inc(TABLE_MISS)
+    return table
+
+
+def _load_routing_table() -> "RoutingTable | RulesetSnapshot":
+    if not settings.REDIRECT_RULESET_SNAPSHOT:
+        return RoutingTable.build()
+
+    # Imported here as the snapshot builds on the rest of this module
+    from redirect.snapshot import SnapshotError, open_current_snapshot
+
+    try:
+        return open_current_snapshot(settings.REDIRECT_RULESET_SNAPSHOT)
+    except (OSError, SnapshotError):
+        logger.exception("Could not use the ruleset snapshot, building the table")
+        return RoutingTable.build()
+
+
+_routing_table: "RoutingTable | RulesetSnapshot | None" = None
+_checked_at = 0.0
+_lock = threading.Lock()
+_refresh: asyncio.Future | None = None
+
+
+def get_routing_table() -> "RoutingTable | RulesetSnapshot":
+    """
+    Return this process's routing table, building it first if it is missing or if the
+    ruleset generation has changed since it was built. The generation is checked at
+    most once per `REDIRECT_RULESET_CHECK_INTERVAL` seconds.
+    """
+    global _routing_table, _checked_at
+
+    table = _routing_table
+    since_check = time.monotonic() - _checked_at
+    if table is not None and since_check < settings.REDIRECT_RULESET_CHECK_INTERVAL:
+        metrics.CACHE_REQUESTS.inc(TABLE_HIT)
+        return table
+
+    with _lock:
+        # Another thread may have checked or rebuilt the table while we were waiting
+        if _routing_table is not None and (
+            _routing_table is not table
+            or time.monotonic() - _checked_at < settings.REDIRECT_RULESET_CHECK_INTERVAL
+        ):
+            metrics.CACHE_REQUESTS.inc(TABLE_HIT)
+            return _routing_table
+
+        if _routing_table is None or (
+            RulesetGeneration.current() != _routing_table.generation
+        ):
+            _routing_table = load_routing_table()
+        else:
+            metrics.CACHE_REQUESTS.inc(TABLE_HIT)
+        _checked_at = time.monotonic()
+        return _routing_table
+
+
+def routing_table_needs_check() -> bool:
+    """Whether getting the routing table would check the database first."""
+    since_check = time.monotonic() - _checked_at
+    return (
+        _routing_table is None
+        or since_check >= settings.REDIRECT_RULESET_CHECK_INTERVAL
+    )
+
+
+async def aget_routing_table() -> "RoutingTable | RulesetSnapshot":
+    """
+    Async version of `get_routing_table`. Requests arriving while the table is being
+    checked or rebuilt await the same refresh.
+    """
+    global _refresh
+
+    table = _routing_table
+    since_check = time.monotonic() - _checked_at
+    if table is not None and since_check < settings.REDIRECT_RULESET_CHECK_INTERVAL:
+        metrics.CACHE_REQUESTS.inc(TABLE_HIT)
+        return table
+
+    refresh = _refresh
+    if (
+        refresh is None
+        or refresh.done()
+        or refresh.get_loop() is not asyncio.get_running_loop()
+    ):
+        refresh = _refresh = asyncio.ensure_future(_refresh_routing_table())
+    # A cancelled request must not cancel the refresh the others are waiting for
+    return await asyncio.shield(refresh)
+
+
+async def _refresh_routing_table() -> "RoutingTable | RulesetSnapshot":
+    global _routing_table, _checked_at
+
+    table = _routing_table
+    if table is None or await RulesetGeneration.acurrent() != table.generation:
+        # Compiling the table is CPU-bound, keep it off the event loop
+        table = _routing_table = await sync_to_async(load_routing_table)()
+    else:
+        metrics.CACHE_REQUESTS.inc(TABLE_HIT)
+    _checked_at = time.monotonic()
+    return table
+
+
+def invalidate_routing_table():
+    """Drop this process's routing table so the next request rebuilds it."""
+    global _routing_table
+    _routing_table = None
+
+
+def resolution_outcome(rule: CompiledRule, path: str) -> str:
+    """How a rule matched a path, one of the `metrics` outcomes."""
+    # Any other rule only matches its own path, and a wildcard rule matching a subpath
+    # is shorter than the path
+    if rule.match_subpaths and len(rule.path) != len(path.strip("/")):
+        return metrics.WILDCARD
+    return metrics.EXACT if rule.case_sensitive else metrics.CASE_INSENSITIVE
+
+
+def observe_resolution(host: str, path: str, rule: CompiledRule | None, start: float):
+    """
+    Record the outcome and latency of resolving a request that started at `start`,
+    a `time.perf_counter()` value, count the hit of the rule and log the decision.
+    Misses are told apart from unknown hosts with the routing table, without it they
+    all count as not found.
+    """
+    if rule is not None and settings.REDIRECT_RULE_STATS:
+        stats.hit_counter.record(rule.id)
+    record_metrics = settings.REDIRECT_METRICS
+    log_decision = settings.REDIRECT_DECISION_LOG
+    if not (record_metrics or log_decision):
+        return
+    seconds = time.perf_counter() - start
+    if rule is not None:
+        outcome = resolution_outcome(rule, path)
+    elif (
+        settings.REDIRECT_ROUTING_TABLE
+        and _routing_table is not None
+        and not _routing_table.knows_host(host)
+    ):
+        outcome = metrics.UNKNOWN_HOST
+    else:
+        outcome = metrics.NOT_FOUND
+    if record_metrics:
+        metrics.record_resolution(
+            outcome, seconds, None if rule is None else normalize_host(host)
+        )
+    if log_decision:
+        decision_log.decision_log.record(
+            host, path, None if rule is None else rule.id, outcome, seconds
+        )
@@ -0,0 +1,311 @@
+"""
+Reading and writing the files of redirect rules of `import_redirect_rules` and
+`export_redirect_rules`.
+
+The files are read and written incrementally, one domain at a time, so that importing
+a file takes memory in proportion to its largest domain instead of its size, and
+exporting one constant memory. The formats:
+
+- `json`: an array of domains, each an object of `domain_names`, `rules` and the
+  optional `display_name` and `notes`, as documented in the README
+- `jsonl`: JSON Lines, one such domain object per line
+- `csv`: one rule per row with a header row naming the columns `domain_names`,
+  `path` and `destination`, and optionally `display_name`, the flags of the rule and
+  its `notes`. The domain names are separated by whitespace, and consecutive rows
+  with the same domain names are rules of the same domain. An empty flag leaves it to
+  its default. Only read.
+
+Exports are sorted by display name and path, and written the same way byte by byte
+for the same rules, so that they can be diffed.
+"""
+
+import csv
+import io
+import json
+import os
+from collections.abc import Iterable, Iterator
+from typing import BinaryIO, TextIO
+
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.db.models.functions import Collate
+
+from redirect.models import Domain, DomainName, RedirectRule
+
+JSON = "json"
+JSON_LINES = "jsonl"
+CSV = "csv"
+FORMATS = (JSON, JSON_LINES, CSV)
+EXPORT_FORMATS = (JSON, JSON_LINES)
+
+# Prepended to the notes of imported domains and rules
+TIMESTAMP_NOTE_PREFIX = "Generated by import command on "
+
+# Characters read from a JSON file at a time
+CHUNK_SIZE = 64 * 1024
+
+RULE_FLAGS = (
+    "permanent",
+    "case_sensitive",
+    "match_subpaths",
+    "append_subpath",
+    "pass_query_string",
+)
+CSV_TRUE = {"true", "1", "yes"}
+CSV_FALSE = {"false", "0", "no"}
+
+_WHITESPACE = " \t\r\n"
+# Characters of the longest token that fails to decode when cut short, \uXXXX
+_MAX_TOKEN_LENGTH = 6
+# Sorts by code point regardless of the collation of the database
+_BINARY_COLLATION = "C"
+
+
+class RuleFileError(ValueError):
+    """The file is not in the expected format."""
+
+
+def strip_timestamp_note(notes: str) -> str:
+    """The notes without the line added by the import."""
+    if notes.startswith(TIMESTAMP_NOTE_PREFIX):
+        return notes.partition("\n")[2]
+    return notes
+
+
+def detect_format(path: str) -> str:
+    """The format of a file by its extension, `json` unless recognized."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        return JSON_LINES
+    if extension == ".csv":
+        return CSV
+    return JSON
+
+
+def read_domains(file: BinaryIO, file_format: str) -> Iterator[dict]:
+    """Read the domains of a file opened in binary mode one at a time."""
+    readers = {JSON: _read_json, JSON_LINES: _read_json_lines, CSV: _read_csv}
+    if file_format not in readers:
+        raise ValueError(f"Unknown format {file_format}")
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        yield from readers[file_format](text)
+    finally:
+        # Leave closing the file to the caller
+        text.detach()
+
+
+def _is_truncated(error: json.JSONDecodeError, length: int) -> bool:
+    """
+    Whether decoding failed because the data ends midway through a value, rather than
+    at a syntax error that more data wouldn't fix.
+    """
+    # An unterminated string is reported at its start
+    return error.pos > length - _MAX_TOKEN_LENGTH or error.msg.startswith(
+        "Unterminated string"
+    )
+
+
+def _read_json(text: io.TextIOBase) -> Iterator[dict]:
+    decoder = json.JSONDecoder()
+    buffer = text.read(CHUNK_SIZE)
+    eof = not buffer
+    position = len(buffer) - len(buffer.lstrip(_WHITESPACE))
+    if buffer[position : position + 1] != "[":
+        raise RuleFileError("Expected a JSON array of domains")
+    position += 1
+    # Offset of `buffer` in the file, for error messages
+    offset = 0
+    expect_separator = False
+    while True:
+        # Skip to the next value, reading more when the buffer runs out
+        while True:
+            stripped = buffer[position:].lstrip(_WHITESPACE)
+            position = len(buffer) - len(stripped)
+            if stripped or eof:
+                break
+            chunk = text.read(CHUNK_SIZE)
+            eof = not chunk
+            offset += len(buffer)
+            buffer, position = chunk, 0
+
+        if eof and position >= len(buffer):
+            raise RuleFileError("Unexpected end of the JSON array")
+        if buffer[position] == "]":
+            return
+        if expect_separator:
+            if buffer[position] != ",":
+                raise RuleFileError(f"Expected , or ] at character {offset + position}")
+            position += 1
+            expect_separator = False
+            continue
+
+        # Drop what has been decoded, so that the buffer only holds the current domain
+        offset += position
+        buffer, position = buffer[position:], 0
+        # Decoding is retried with twice the data each time, so that a large domain is
+        # decoded in linear time
+        required = 0
+        while True:
+            if eof or len(buffer) >= required:
+                try:
+                    item, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError as e:
+                    # Raised right away, not after reading the rest of the file
+                    if eof or not _is_truncated(e, len(buffer)):
+                        raise RuleFileError(
+                            f"Invalid JSON at character {offset + e.pos}: {e.msg}"
+                        ) from e
+                else:
+                    break
+                required = 2 * len(buffer)
+            chunk = text.read(max(CHUNK_SIZE, required - len(buffer)))
+            eof = not chunk
+            buffer += chunk
+        if not isinstance(item, dict):
+            raise RuleFileError(f"Expected a domain object at character {offset}")
+        yield item
+        position = end
+        expect_separator = True
+
+
+def _read_json_lines(text: io.TextIOBase) -> Iterator[dict]:
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise RuleFileError(f"Invalid JSON on line {line_number}: {e.msg}") from e
+        if not isinstance(item, dict):
+            raise RuleFileError(f"Expected a domain object on line {line_number}")
+        yield item
+
+
+def _csv_flag(value: str, column: str, line_number: int) -> bool | None:
+    value = value.strip().lower()
+    if not value:
+        return None
+    if value in CSV_TRUE:
+        return True
+    if value in CSV_FALSE:
+        return False
+    raise RuleFileError(
+        f"Invalid value {value!r} for {column} on line {line_number}, expected true "
+        "or false"
+    )
+
+
+def _read_csv(text: io.TextIOBase) -> Iterator[dict]:
+    reader = csv.DictReader(text)
+    missing = {"domain_names", "path", "destination"}.difference(
+        reader.fieldnames or []
+    )
+    if missing:
+        raise RuleFileError(f"Missing CSV column(s): {', '.join(sorted(missing))}")
+
+    item = None
+    for row in reader:
+        domain_names = (row["domain_names"] or "").split()
+        if item is not None and domain_names != item["domain_names"]:
+            yield item
+            item = None
+        if item is None:
+            item = {"domain_names": domain_names, "rules": []}
+            if row.get("display_name"):
+                item["display_name"] = row["display_name"]
+
+        rule = {"path": row["path"] or "", "destination": row["destination"] or ""}
+        for column in RULE_FLAGS:
+            value = _csv_flag(row.get(column) or "", column, reader.line_num)
+            if value is not None:
+                rule[column] = value
+        if row.get("notes"):
+            rule["notes"] = row["notes"]
+        item["rules"].append(rule)
+    if item is not None:
+        yield item
+
+
+def export_domains(chunk_size: int) -> Iterator[dict]:
+    """
+    The domains and their rules in the import format, sorted, fetched in chunks with
+    server-side cursors from one snapshot of the database.
+    """
+    repeatable_read = not connection.in_atomic_block
+    with transaction.atomic():
+        if repeatable_read:
+            # The queries see the same rules, so that a rule added to a domain that
+            # has already been exported isn't merged with the next one
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        yield from _export_domains(chunk_size)
+
+
+def _export_domains(chunk_size: int) -> Iterator[dict]:
+    domains = (
+        Domain.objects.order_by(Collate("display_name", _BINARY_COLLATION), "id")
+        .only("display_name", "notes")
+        .prefetch_related(
+            Prefetch(
+                "names",
+                queryset=DomainName.objects.order_by(
+                    Collate("name", _BINARY_COLLATION)
+                ).only("domain_id", "name"),
+            )
+        )
+    )
+    # All rules in the same order in one query, merged with the domains, so that a
+    # domain with many rules doesn't need to fit in memory
+    rules = (
+        RedirectRule.objects.order_by(
+            Collate("domain__display_name", _BINARY_COLLATION),
+            "domain_id",
+            Collate("path", _BINARY_COLLATION),
+        )
+        .values_list("domain_id", "path", "destination", *RULE_FLAGS, "notes")
+        .iterator(chunk_size=chunk_size)
+    )
+    rule = next(rules, None)
+    for domain in domains.iterator(chunk_size=chunk_size):
+        item_rules = []
+        while rule is not None and rule[0] == domain.id:
+            item_rules.append(_export_rule(rule))
+            rule = next(rules, None)
+        item = {
+            "display_name": domain.display_name,
+            "domain_names": [name.name for name in domain.names.all()],
+        }
+        if notes := strip_timestamp_note(domain.notes):
+            item["notes"] = notes
+        item["rules"] = item_rules
+        yield item
+
+
+def _export_rule(row: tuple) -> dict:
+    _, path, destination, *flags, notes = row
+    rule = {"path": f"/{path}", "destination": destination}
+    rule.update(zip(RULE_FLAGS, flags, strict=True))
+    if notes := strip_timestamp_note(notes):
+        rule["notes"] = notes
+    return rule
+
+
+def write_domains(file: TextIO, items: Iterable[dict], file_format: str) -> int:
+    """Write domains in a format `read_domains` reads, returning how many."""
+    count = 0
+    if file_format == JSON:
+        # Like `json.dump` with an indent, one domain at a time
+        for count, item in enumerate(items, start=1):
+            dumped = json.dumps(item, ensure_ascii=False, indent=2)
+            file.write("[\n  " if count == 1 else ",\n  ")
+            file.write(dumped.replace("\n", "\n  "))
+        file.write("\n]\n" if count else "[]\n")
+    elif file_format == JSON_LINES:
+        for item in items:
+            file.write(json.dumps(item, ensure_ascii=False))
+            file.write("\n")
+            count += 1
+    else:
+        raise ValueError(f"Can't write format {file_format}")
+    return count
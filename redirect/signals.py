@@ -0,0 +1,40 @@
+import weakref
+
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from redirect.models import Domain, DomainName, RedirectRule, RulesetGeneration
+from redirect.routing import invalidate_routing_table
+
+
+@receiver(post_save, sender=Domain)
+@receiver(post_save, sender=DomainName)
+@receiver(post_save, sender=RedirectRule)
+@receiver(post_delete, sender=Domain)
+@receiver(post_delete, sender=DomainName)
+@receiver(post_delete, sender=RedirectRule)
+def ruleset_changed(using, **kwargs):
+    """
+    Bump the ruleset generation once per transaction and invalidate the routing table
+    when it's committed.
+
+    In a transaction the generation is bumped by the same connection on the first
+    change, so the changes and the new generation are committed together. In
+    autocommit mode the save or delete has been committed already, and the generation
+    is bumped and the table invalidated right after it.
+    """
+    connection = connections[using]
+    # Set until the callback runs, or is dropped along with the bump when its
+    # transaction or savepoint is rolled back
+    pending = getattr(connection, "ruleset_bump_pending", None)
+    if pending is not None and pending() is not None:
+        return
+    RulesetGeneration.bump(using=using)
+
+    def committed():
+        connection.ruleset_bump_pending = None
+        invalidate_routing_table()
+
+    connection.ruleset_bump_pending = weakref.ref(committed)
+    transaction.on_commit(committed, using=using)
@@ -0,0 +1,412 @@
+"""
+Memory-mapped snapshots of the compiled ruleset.
+
+A snapshot holds the same rules as a `RoutingTable` in a single binary file. Processes
+map the file read-only, so they all share one copy of it in the page cache, and a
+recycled worker can serve redirects as soon as it has opened the file instead of
+first building a table from the database. The file is written by the process that
+first notices it is out of date, or by the `compile_ruleset_snapshot` management
+command, and always replaced atomically.
+
+The file starts with a header of the magic bytes, the ruleset generation and the
+offset and length of each section, followed by the sections:
+
+- string_offsets, string_data: every host, path, lookup key and destination once,
+  sorted, as concatenated UTF-8 with the start offset of each string
+- hosts: (name, domain) pairs of normalized domain names
+- domain_max_ages: the not found max-age of each domain
+- rules: (domain, path, lookup key, destination, flags, max-age) tuples, flags as in
+  `CompiledRule.flags`, with the ids in rule_ids
+- host_index and the exact, exact_ci, wildcard and wildcard_ci rule indexes: open
+  addressing hash tables over `zlib.crc32` of the key, seeded with the domain for
+  rules. Slots hold a host or rule number plus one, or zero when empty.
+
+Strings are referred to by their number and domains by their order of appearance in
+the hosts. Max-ages left to the defaults are stored as `DEFAULT_MAX_AGE`, so that the
+defaults are read from the settings when the snapshot is opened. All integers are
+little-endian.
+"""
+
+import contextlib
+import fcntl
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+from collections.abc import Iterable
+from pathlib import Path
+
+from django.core.exceptions import DisallowedRedirect
+
+from redirect.models import RulesetGeneration
+from redirect.routing import (
+    PERMANENT,
+    CompiledRule,
+    cache_control,
+    default_max_ages,
+    normalize_host,
+    pack_flags,
+    read_ruleset,
+)
+
+MAGIC = b"TIRSNAP2"
+HEADER = struct.Struct("<8sQ")
+SECTION = struct.Struct("<QQ")
+# Section name and array type code, or None for raw bytes
+SECTIONS = (
+    ("string_offsets", "I"),
+    ("string_data", None),
+    ("hosts", "I"),
+    ("domain_max_ages", "I"),
+    ("host_index", "I"),
+    ("rules", "I"),
+    ("rule_ids", "Q"),
+    ("exact", "I"),
+    ("exact_ci", "I"),
+    ("wildcard", "I"),
+    ("wildcard_ci", "I"),
+)
+
+# Fields of a rule record
+RULE_DOMAIN, RULE_PATH, RULE_KEY, RULE_DESTINATION, RULE_FLAGS, RULE_MAX_AGE = range(6)
+RULE_SIZE = 6
+
+DEFAULT_MAX_AGE = 0xFFFFFFFF
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _index(keys: dict[tuple[int, bytes], int]) -> array:
+    """Build a hash table of (seed, key) -> entry number."""
+    size = 1
+    while size < len(keys) * 2:
+        size *= 2
+    mask = size - 1
+    slots = array("I", bytes(4 * size))
+    for (seed, key), number in keys.items():
+        slot = zlib.crc32(key, seed) & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = number + 1
+    return slots
+
+
+def write_snapshot(
+    file,
+    domain_names: Iterable[tuple[str, int]],
+    rules: Iterable[tuple],
+    generation: int = 0,
+) -> int:
+    """
+    Compile a snapshot into a binary file object from the same rows as
+    `RoutingTable.from_rows`. Returns the number of rules written.
+    """
+    domains: dict[int, int] = {}
+    domain_max_ages = array("I")
+    hosts: dict[str, int] = {}
+    for name, domain_id, not_found_max_age in domain_names:
+        if (domain := domains.get(domain_id)) is None:
+            domain = domains[domain_id] = len(domains)
+            domain_max_ages.append(
+                DEFAULT_MAX_AGE if not_found_max_age is None else not_found_max_age
+            )
+        hosts[normalize_host(name)] = domain
+
+    records = []
+    exact, exact_ci, wildcard, wildcard_ci = {}, {}, {}, {}
+    for domain_id, *fields in rules:
+        # Rules of a domain without any names can never be reached
+        if (domain := domains.get(domain_id)) is None:
+            continue
+        rule_id, path, destination, *flags, max_age = fields
+        try:
+            # Given a max-age, the defaults aren't read from the settings for every rule
+            rule = CompiledRule(
+                rule_id, path, destination, pack_flags(*flags), max_age=0
+            )
+        except DisallowedRedirect:
+            continue
+
+        # Same precedence as `DomainRoutes.add`: a later rule replaces an earlier one
+        number = len(records)
+        key = rule.path.lower()
+        records.append(
+            (domain, rule, key, DEFAULT_MAX_AGE if max_age is None else max_age)
+        )
+        if rule.case_sensitive:
+            exact[(domain, rule.path)] = number
+            if rule.match_subpaths:
+                wildcard[(domain, rule.path)] = number
+        else:
+            exact_ci[(domain, key)] = number
+            if rule.match_subpaths:
+                wildcard_ci[(domain, key)] = number
+
+    strings = set(hosts)
+    for _domain, rule, key, _max_age in records:
+        strings.update((rule.path, key, rule.destination))
+    # Code point order is the same as the order of the UTF-8 bytes
+    strings = sorted(strings)
+    string_numbers = {string: number for number, string in enumerate(strings)}
+    encoded = [string.encode() for string in strings]
+
+    string_offsets = array("I", [0])
+    for string in encoded:
+        string_offsets.append(string_offsets[-1] + len(string))
+
+    host_records = array("I")
+    for name, domain in hosts.items():
+        host_records.extend((string_numbers[name], domain))
+
+    rule_records = array("I")
+    rule_ids = array("Q")
+    for domain, rule, key, max_age in records:
+        rule_records.extend(
+            (
+                domain,
+                string_numbers[rule.path],
+                string_numbers[key],
+                string_numbers[rule.destination],
+                rule.flags,
+                max_age,
+            )
+        )
+        rule_ids.append(rule.id)
+
+    def encode_keys(keys):
+        return {(seed, key.encode()): number for (seed, key), number in keys.items()}
+
+    sections = {
+        "string_offsets": string_offsets,
+        "string_data": b"".join(encoded),
+        "hosts": host_records,
+        "domain_max_ages": domain_max_ages,
+        "host_index": _index(
+            {(0, name.encode()): number for number, name in enumerate(hosts)}
+        ),
+        "rules": rule_records,
+        "rule_ids": rule_ids,
+        "exact": _index(encode_keys(exact)),
+        "exact_ci": _index(encode_keys(exact_ci)),
+        "wildcard": _index(encode_keys(wildcard)),
+        "wildcard_ci": _index(encode_keys(wildcard_ci)),
+    }
+
+    # Sections are 8-byte aligned
+    position = HEADER.size + SECTION.size * len(SECTIONS)
+    table, data = [], []
+    for name, _typecode in SECTIONS:
+        section = sections[name]
+        if isinstance(section, array) and sys.byteorder != "little":
+            section.byteswap()
+        section = memoryview(section).cast("B")
+        padding = bytes(-position % 8)
+        position += len(padding)
+        table.append(SECTION.pack(position, len(section)))
+        data += (padding, section)
+        position += len(section)
+
+    file.write(HEADER.pack(MAGIC, generation))
+    file.write(b"".join(table))
+    for part in data:
+        file.write(part)
+    return len(records)
+
+
+class RulesetSnapshot:
+    """
+    Read-only view of a snapshot with the same interface as `RoutingTable`.
+    Rules are compiled on first use and kept for the lifetime of the snapshot.
+    """
+
+    def __init__(self, buffer):
+        if sys.byteorder != "little":
+            raise SnapshotError("Snapshots can only be read on little-endian machines")
+        view = memoryview(buffer)
+        if len(view) < HEADER.size + SECTION.size * len(SECTIONS):
+            raise SnapshotError("Truncated snapshot")
+        magic, self.generation = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise SnapshotError("Not a ruleset snapshot")
+
+        for number, (name, typecode) in enumerate(SECTIONS):
+            position = HEADER.size + number * SECTION.size
+            offset, length = SECTION.unpack_from(view, position)
+            if offset + length > len(view):
+                raise SnapshotError("Truncated snapshot")
+            section = view[offset : offset + length]
+            try:
+                setattr(self, name, section.cast(typecode) if typecode else section)
+            except TypeError as e:
+                raise SnapshotError(f"Invalid {name} section") from e
+
+        self._compiled: dict[int, CompiledRule] = {}
+        self._default_max_ages = default_max_ages()
+        # Keeps the mapping open for as long as the snapshot is in use
+        self._buffer = buffer
+
+    @classmethod
+    def open(cls, path) -> "RulesetSnapshot":
+        with open(path, "rb") as file:
+            try:
+                return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+            except ValueError as e:
+                # Empty files can't be mapped
+                raise SnapshotError("Truncated snapshot") from e
+
+    def __len__(self):
+        return len(self.hosts) // 2
+
+    def _string(self, number: int) -> memoryview:
+        return self.string_data[
+            self.string_offsets[number] : self.string_offsets[number + 1]
+        ]
+
+    def _find_domain(self, host: bytes) -> int | None:
+        index = self.host_index
+        mask = len(index) - 1
+        slot = zlib.crc32(host) & mask
+        while entry := index[slot]:
+            record = (entry - 1) * 2
+            if self._string(self.hosts[record]) == host:
+                return self.hosts[record + 1]
+            slot = (slot + 1) & mask
+        return None
+
+    def _find_rule(self, index, domain: int, key: bytes, field: int) -> int | None:
+        mask = len(index) - 1
+        slot = zlib.crc32(key, domain) & mask
+        while entry := index[slot]:
+            record = (entry - 1) * RULE_SIZE
+            if (
+                self.rules[record + RULE_DOMAIN] == domain
+                and self._string(self.rules[record + field]) == key
+            ):
+                return entry - 1
+            slot = (slot + 1) & mask
+        return None
+
+    def _find_wildcard(self, index, domain: int, path: bytes, field: int) -> int | None:
+        """Find the rule for the longest prefix of the path in a wildcard index."""
+        segments = path.split(b"/") if path else []
+        for depth in range(len(segments), -1, -1):
+            prefix = b"/".join(segments[:depth])
+            if (number := self._find_rule(index, domain, prefix, field)) is not None:
+                return number
+        return None
+
+    def _rule(self, number: int) -> CompiledRule:
+        if (rule := self._compiled.get(number)) is None:
+            record = number * RULE_SIZE
+            flags = self.rules[record + RULE_FLAGS]
+            max_age = self.rules[record + RULE_MAX_AGE]
+            if max_age == DEFAULT_MAX_AGE:
+                max_age = self._default_max_ages[0 if flags & PERMANENT else 1]
+            rule = self._compiled[number] = CompiledRule(
+                self.rule_ids[number],
+                str(self._string(self.rules[record + RULE_PATH]), "utf-8"),
+                str(self._string(self.rules[record + RULE_DESTINATION]), "utf-8"),
+                flags,
+                max_age=max_age,
+            )
+        return rule
+
+    def not_found_cache_control(self, host: str) -> str:
+        """The Cache-Control header of a response to a host without a matching rule."""
+        max_age = DEFAULT_MAX_AGE
+        for name in (host, normalize_host(host)):
+            domain = self._find_domain(name.encode("utf-8", "surrogatepass"))
+            if domain is not None:
+                max_age = self.domain_max_ages[domain]
+                break
+        if max_age == DEFAULT_MAX_AGE:
+            max_age = self._default_max_ages[2]
+        return cache_control(max_age)
+
+    def knows_host(self, host: str) -> bool:
+        for name in (host, normalize_host(host)):
+            if self._find_domain(name.encode("utf-8", "surrogatepass")) is not None:
+                return True
+        return False
+
+    def resolve(self, host: str, path: str) -> CompiledRule | None:
+        """Find the rule for a host and path, or None if there is no match."""
+        domain = self._find_domain(host.encode("utf-8", "surrogatepass"))
+        if domain is None:
+            normalized = normalize_host(host)
+            if normalized == host:
+                return None
+            domain = self._find_domain(normalized.encode("utf-8", "surrogatepass"))
+            if domain is None:
+                return None
+
+        # Same precedence as `DomainRoutes.resolve`
+        cleaned_path = path.strip("/")
+        encoded_path = cleaned_path.encode("utf-8", "surrogatepass")
+        lowered_path = cleaned_path.lower().encode("utf-8", "surrogatepass")
+        number = self._find_rule(self.exact, domain, encoded_path, RULE_PATH)
+        if number is None:
+            number = self._find_rule(self.exact_ci, domain, lowered_path, RULE_KEY)
+        if number is None:
+            number = self._find_wildcard(self.wildcard, domain, encoded_path, RULE_PATH)
+        if number is None:
+            number = self._find_wildcard(
+                self.wildcard_ci, domain, lowered_path, RULE_KEY
+            )
+        return None if number is None else self._rule(number)
+
+
+def compile_snapshot(path) -> tuple[int, int]:
+    """
+    Compile the current ruleset from the database into a snapshot file, replacing it
+    atomically. Returns the generation and the number of rules written.
+    """
+    path = Path(path)
+    generation, domain_names, rules = read_ruleset()
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f".{path.name}.", delete=False
+    ) as file:
+        try:
+            rule_count = write_snapshot(file, domain_names, rules, generation)
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            os.unlink(file.name)
+            raise
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+    return generation, rule_count
+
+
+def _open_if_current(path, generation: int) -> RulesetSnapshot | None:
+    with contextlib.suppress(FileNotFoundError, SnapshotError):
+        snapshot = RulesetSnapshot.open(path)
+        if snapshot.generation >= generation:
+            return snapshot
+    return None
+
+
+def open_current_snapshot(path) -> RulesetSnapshot:
+    """
+    Open the snapshot at `path`, first compiling it if it is missing or older than the
+    current ruleset generation. Only one process compiles it at a time; the others
+    wait for it and then open the result.
+    """
+    generation = RulesetGeneration.current()
+    if (snapshot := _open_if_current(path, generation)) is not None:
+        return snapshot
+
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if (snapshot := _open_if_current(path, generation)) is None:
+                compile_snapshot(path)
+                snapshot = RulesetSnapshot.open(path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return snapshot
@@ -0,0 +1,152 @@
+"""
+Per-rule hit counts.
+
+Answering a redirect only counts the hit in memory. A background thread in each
+process adds the counts to `RedirectRuleStats` with a single upsert every
+`REDIRECT_RULE_STATS_FLUSH_INTERVAL` seconds, or as soon as
+`REDIRECT_RULE_STATS_FLUSH_HITS` hits have accumulated, so that counting hits costs
+the database one statement per process and interval instead of one per request.
+
+Enable it with `REDIRECT_RULE_STATS=True`.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import UTC, datetime
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from redirect.models import RedirectRule, RedirectRuleStats
+
+logger = logging.getLogger(__name__)
+
+UPSERT_SQL = f"""
+INSERT INTO {RedirectRuleStats._meta.db_table} AS stats (rule_id, hits, last_hit_at)
+SELECT hit.rule_id, hit.hits, hit.last_hit_at
+FROM unnest(%s::bigint[], %s::bigint[], %s::timestamptz[])
+    AS hit (rule_id, hits, last_hit_at)
+-- Skips rules deleted since their hits were counted
+JOIN {RedirectRule._meta.db_table} AS rule ON rule.id = hit.rule_id
+ORDER BY hit.rule_id
+ON CONFLICT (rule_id) DO UPDATE SET
+    hits = stats.hits + EXCLUDED.hits,
+    last_hit_at = GREATEST(stats.last_hit_at, EXCLUDED.last_hit_at)
+"""  # noqa: S608
+
+
+def write_hits(hits: dict[int, list]):
+    """
+    Add hit counts to the stored ones in a single statement.
+
+    :param hits: rule id -> [hit count, timestamp of the last hit]
+    """
+    # Rows are upserted in id order, so concurrent flushes of several processes
+    # can't deadlock
+    rule_ids = sorted(hits)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            UPSERT_SQL,
+            [
+                rule_ids,
+                [hits[rule_id][0] for rule_id in rule_ids],
+                [datetime.fromtimestamp(hits[rule_id][1], UTC) for rule_id in rule_ids],
+            ],
+        )
+
+
+class HitCounter:
+    """Hit counts of this process not yet written to the database."""
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.lock = threading.Lock()
+        # Rule id -> [hit count, timestamp of the last hit]
+        self.hits: dict[int, list] = {}
+        self.pending = 0
+        self.wakeup = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.flush_hits = 0
+
+    def record(self, rule_id: int):
+        now = time.time()
+        with self.lock:
+            if (entry := self.hits.get(rule_id)) is None:
+                self.hits[rule_id] = [1, now]
+            else:
+                entry[0] += 1
+                entry[1] = now
+            self.pending += 1
+            pending = self.pending
+            if self.thread is None:
+                self.start()
+
+        if pending >= self.flush_hits:
+            self.wakeup.set()
+
+    def start(self):
+        # Read once, settings are slow to access on every request
+        self.flush_hits = settings.REDIRECT_RULE_STATS_FLUSH_HITS
+        self.thread = threading.Thread(
+            target=self.run,
+            args=(settings.REDIRECT_RULE_STATS_FLUSH_INTERVAL,),
+            name="redirect-rule-stats",
+            daemon=True,
+        )
+        self.thread.start()
+
+    def run(self, interval: float):
+        while True:
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not write redirect rule hits")
+            finally:
+                # Don't keep an idle connection open per process between flushes
+                connection.close()
+
+    def flush(self):
+        """Write the pending hit counts to the database."""
+        with self.lock:
+            hits, self.hits = self.hits, {}
+            self.pending = 0
+        if not hits:
+            return
+        try:
+            write_hits(hits)
+        except DatabaseError:
+            # Try again on the next flush
+            self._restore(hits)
+            raise
+
+    def _restore(self, hits: dict[int, list]):
+        with self.lock:
+            for rule_id, (count, last_hit) in hits.items():
+                if (entry := self.hits.get(rule_id)) is None:
+                    self.hits[rule_id] = [count, last_hit]
+                else:
+                    entry[0] += count
+                    entry[1] = max(entry[1], last_hit)
+                self.pending += count
+
+
+hit_counter = HitCounter()
+
+
+def _flush_at_exit():
+    try:
+        hit_counter.flush()
+    except Exception:
+        logger.exception("Could not write redirect rule hits")
+
+
+# Threads don't survive a fork, and the hits counted so far belong to the parent
+os.register_at_fork(after_in_child=hit_counter._reset)
+atexit.register(_flush_at_exit)
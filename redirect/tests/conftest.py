@@ -1,3 +1,7 @@
+from types import ModuleType
+from typing import NamedTuple
+
+import pytest
 from pytest_factoryboy import register
 
 from redirect.factories import DomainFactory, DomainNameFactory, RedirectRuleFactory
@@ -5,3 +9,62 @@ from redirect.factories import DomainFactory, DomainNameFactory, RedirectRuleFac
 register(DomainFactory)
 register(DomainNameFactory)
 register(RedirectRuleFactory)
+
+
+def rule_row(domain_id, rule_id, path, **kwargs):
+    """A rule row of `read_ruleset`, as taken by `RoutingTable.from_rows`."""
+    return (
+        domain_id,
+        rule_id,
+        path,
+        kwargs.get("destination", f"https://dest.test/{rule_id}"),
+        kwargs.get("permanent", False),
+        kwargs.get("pass_query_string", False),
+        kwargs.get("match_subpaths", False),
+        kwargs.get("append_subpath", False),
+        kwargs.get("case_sensitive", False),
+        kwargs.get("max_age"),
+    )
+
+
+@pytest.fixture(params=[True, False], ids=["table", "database"])
+def routing_table(request, settings):
+    """Run a test both with and without the in-process routing table."""
+    settings.REDIRECT_ROUTING_TABLE = request.param
+    return request.param
+
+
+@pytest.fixture
+def host(domain):
+    """A domain name of the default domain fixture."""
+    return domain.names.first().name
+
+
+class Server(NamedTuple):
+    """A fast path application and the fake Django application it falls back to."""
+
+    module: ModuleType
+    application_class: type
+    django_application_class: type
+
+
+@pytest.fixture
+def server() -> Server:
+    """Overridden by the tests of a fast path application."""
+    raise NotImplementedError
+
+
+@pytest.fixture
+def keep_connections(monkeypatch, server):
+    # Like Django's test client, don't close the test transaction's connection
+    monkeypatch.setattr(server.module, "close_old_connections", lambda: None)
+
+
+@pytest.fixture
+def django_application(server):
+    return server.django_application_class()
+
+
+@pytest.fixture
+def application(server, django_application):
+    return server.application_class(django_application)
@@ -1,49 +1,53 @@
 import pytest
+from asgiref.sync import async_to_sync
 from django.http import Http404
 from django.test import Client
 
-from redirect.api import find_wildcard_rule, get_domain_rule_or_404
+from redirect.api import (
+    afind_redirect_rule_or_404,
+    find_redirect_rule_or_404,
+)
 
 
 @pytest.mark.django_db
-def test_domain_rule_exact_match(domain, redirect_rule_factory):
+def test_domain_rule_exact_match(host, domain, redirect_rule_factory):
     expected_rule = redirect_rule_factory(
         path="TEST", domain=domain, case_sensitive=True
     )
     redirect_rule_factory(path="test", domain=domain, case_sensitive=True)
-    result = get_domain_rule_or_404(domain, "/TEST")
+    result = find_redirect_rule_or_404(host, "/TEST")
     assert result == expected_rule
 
 
 @pytest.mark.django_db
-def test_domain_rule_case_insensitive_match(domain, redirect_rule_factory):
+def test_domain_rule_case_insensitive_match(host, domain, redirect_rule_factory):
     rule = redirect_rule_factory(path="test", domain=domain, case_sensitive=False)
-    result = get_domain_rule_or_404(domain, "/TEST")
+    result = find_redirect_rule_or_404(host, "/TEST")
     assert result == rule
 
 
 @pytest.mark.django_db
-def test_domain_rule_no_match_raises_404(domain):
+def test_domain_rule_no_match_raises_404(host):
     with pytest.raises(Http404):
-        get_domain_rule_or_404(domain, "nonexistent")
+        find_redirect_rule_or_404(host, "nonexistent")
 
 
 @pytest.mark.parametrize("path", ["test/", "/test", "/test/"])
 @pytest.mark.django_db
 def test_domain_rule_or_404_ignores_leading_and_trailing_slashes(
-    path, domain, redirect_rule_factory
+    path, host, domain, redirect_rule_factory
 ):
     expected_rule = redirect_rule_factory(path="test", domain=domain)
-    result = get_domain_rule_or_404(domain, path)
+    result = find_redirect_rule_or_404(host, path)
     assert result == expected_rule
 
 
 @pytest.mark.django_db
-def test_find_wildcard_rule_exact_match(domain, redirect_rule_factory):
+def test_wildcard_rule_exact_match(host, domain, redirect_rule_factory):
     expected_rule = redirect_rule_factory(
         path="/wildcard", domain=domain, match_subpaths=True
     )
-    result = find_wildcard_rule(domain, "wildcard/path")
+    result = find_redirect_rule_or_404(host, "wildcard/path")
     assert result == expected_rule
 
 
@@ -58,35 +62,107 @@ def test_find_wildcard_rule_exact_match(domain, redirect_rule_factory):
     ],
 )
 @pytest.mark.django_db
-def test_find_wildcard_rule_no_match(
-    rule_path, find_path, domain, redirect_rule_factory
+def test_wildcard_rule_no_match(
+    rule_path, find_path, host, domain, redirect_rule_factory
 ):
     redirect_rule_factory(path=rule_path, domain=domain, match_subpaths=True)
-    result = find_wildcard_rule(domain, find_path)
-    assert result is None
+    with pytest.raises(Http404):
+        find_redirect_rule_or_404(host, find_path)
 
 
 @pytest.mark.django_db
-def test_find_wildcard_rule_case_insensitive_match(domain, redirect_rule_factory):
+def test_wildcard_rule_case_insensitive_match(host, domain, redirect_rule_factory):
     expected_rule = redirect_rule_factory(
         path="/wildcard", domain=domain, match_subpaths=True
     )
-    result = find_wildcard_rule(domain, "WILDCARD/path")
+    result = find_redirect_rule_or_404(host, "WILDCARD/path")
     assert result == expected_rule
 
 
 @pytest.mark.parametrize("path", ["", "myon", "myon/myon/myon/myon/myon/myon"])
 @pytest.mark.django_db
-def test_find_wildcard_rule_case_empty_wildcard_path(
-    path, domain, redirect_rule_factory
+def test_wildcard_rule_case_empty_wildcard_path(
+    path, host, domain, redirect_rule_factory
 ):
     expected_rule = redirect_rule_factory(path="/", domain=domain, match_subpaths=True)
-    result = find_wildcard_rule(domain, path)
+    result = find_redirect_rule_or_404(host, path)
     assert result == expected_rule
 
 
 @pytest.mark.django_db
+class TestFindRedirectRule:
+    @pytest.mark.parametrize(
+        "path, expected_path",
+        [
+            ("Foo", "Foo"),
+            ("FOO", ""),
+            # Exact match before wildcard
+            ("bar/baz", "bar/baz"),
+            ("BAR/BAZ", "bar/baz"),
+            ("bar/qux", "bar"),
+            ("Bar/qux", "bar"),
+            # Case-sensitive wildcard
+            ("Lorem/ipsum", "Lorem"),
+            ("lorem/ipsum", ""),
+            # Most specific wildcard wins, the root matches everything else
+            ("other", ""),
+            ("", ""),
+        ],
+    )
+    def test_precedence(self, host, domain, redirect_rule_factory, path, expected_path):
+        redirect_rule_factory(domain=domain, path="Foo", case_sensitive=True)
+        redirect_rule_factory(domain=domain, path="bar", match_subpaths=True)
+        redirect_rule_factory(domain=domain, path="bar/baz")
+        redirect_rule_factory(
+            domain=domain, path="Lorem", case_sensitive=True, match_subpaths=True
+        )
+        redirect_rule_factory(domain=domain, path="", match_subpaths=True)
+
+        assert find_redirect_rule_or_404(host, path).path == expected_path
+
+    def test_unknown_host_raises_404(self, domain, redirect_rule_factory):
+        redirect_rule_factory(domain=domain, path="foo")
+
+        with pytest.raises(Http404):
+            find_redirect_rule_or_404("unknown.test", "foo")
+
+    def test_no_match_raises_404(self, host, domain, redirect_rule_factory):
+        redirect_rule_factory(domain=domain, path="foo", match_subpaths=True)
+
+        with pytest.raises(Http404):
+            find_redirect_rule_or_404(host, "bar/foo")
+
+    def test_ignores_other_domains(self, host, domain_factory, redirect_rule_factory):
+        redirect_rule_factory(domain=domain_factory(), path="foo")
+
+        with pytest.raises(Http404):
+            find_redirect_rule_or_404(host, "foo")
+
+    def test_uses_single_query(
+        self, host, domain, redirect_rule_factory, django_assert_num_queries
+    ):
+        redirect_rule_factory(domain=domain, path="foo", match_subpaths=True)
+
+        with django_assert_num_queries(1):
+            find_redirect_rule_or_404(host, "foo/bar/baz")
+
+    def test_async(self, host, domain, redirect_rule_factory):
+        rule = redirect_rule_factory(domain=domain, path="foo", match_subpaths=True)
+
+        assert async_to_sync(afind_redirect_rule_or_404)(host, "Foo/bar") == rule
+        with pytest.raises(Http404):
+            async_to_sync(afind_redirect_rule_or_404)(host, "bar")
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("routing_table")
 class TestRedirectView:
+    @pytest.fixture(autouse=True, params=[False, True], ids=["sync", "async"])
+    def async_view(self, request, settings, reload_urls):
+        """Run every test with both the sync and the async view."""
+        settings.REDIRECT_ASYNC_VIEW = request.param
+        reload_urls()
+
     @pytest.fixture
     def domain_client(self, client, domain):
         """
@@ -184,6 +260,7 @@ class TestRedirectView:
         response = domain_client.get("/bar")
 
         assert response.status_code == 404
+        assert response.json() == {"detail": "Not Found"}
 
     def test_redirect_invalid_domain(
         self, client: Client, domain_factory, redirect_rule_factory
@@ -194,6 +271,7 @@ class TestRedirectView:
         response = client.get("/foo", HTTP_HOST="404.com")
 
         assert response.status_code == 404
+        assert response.json() == {"detail": "Not Found"}
 
     @pytest.mark.parametrize("query_string", ["?param=value", "?param=value&foo=bar"])
     def test_redirect_with_pass_query_string_should_append_query_string(
@@ -266,3 +344,35 @@ class TestRedirectView:
 
         assert response.status_code == 302
         assert response["Location"] == exact_rule.destination
+
+    def test_redirect_encodes_destination(
+        self, domain_client: Client, domain, redirect_rule_factory
+    ):
+        redirect_rule_factory(
+            path="foo", domain=domain, destination="https://acme.test/ä?q=ö"
+        )
+
+        response = domain_client.get("/foo")
+
+        assert response.status_code == 302
+        assert response["Location"] == "https://acme.test/%C3%A4?q=%C3%B6"
+
+    @pytest.mark.parametrize("path", ["docs", "openapi.json"])
+    def test_redirect_from_former_api_docs_paths(
+        self, domain_client: Client, domain, redirect_rule_factory, path
+    ):
+        rule = redirect_rule_factory(path=path, domain=domain)
+
+        response = domain_client.get(f"/{path}")
+
+        assert response.status_code == 302
+        assert response["Location"] == rule.destination
+
+    def test_redirect_only_allows_get(
+        self, domain_client: Client, domain, redirect_rule_factory
+    ):
+        redirect_rule_factory(path="foo", domain=domain)
+
+        response = domain_client.post("/foo")
+
+        assert response.status_code == 405
@@ -0,0 +1,180 @@
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
+from django.test import AsyncRequestFactory
+
+from redirect import asgi
+from redirect.asgi import RedirectASGIApplication
+from redirect.tests.conftest import Server
+
+pytestmark = pytest.mark.usefixtures("routing_table", "keep_connections")
+
+
+class FakeDjangoApplication:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"django"})
+
+
+class Response:
+    def __init__(self):
+        self.status = None
+        self.headers = {}
+        self.body = b""
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            self.headers = {
+                name.decode().lower(): value.decode()
+                for name, value in message["headers"]
+            }
+        else:
+            self.body += message.get("body", b"")
+
+
+@pytest.fixture
+def server():
+    return Server(asgi, RedirectASGIApplication, FakeDjangoApplication)
+
+
+def _call(application, path, method="get", **extra):
+    scope = getattr(AsyncRequestFactory(), method)(path, **extra).scope
+    # The request factory uses the WSGI encoding for the path, an ASGI server passes
+    # it decoded as UTF-8
+    scope["path"] = scope["path"].encode("iso-8859-1").decode()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if request_sent:
+            return {"type": "http.disconnect"}
+        request_sent = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    response = Response()
+    async_to_sync(application)(scope, receive, response.send)
+    return response
+
+
+@pytest.mark.django_db
+class TestRedirectASGIApplication:
+    def test_redirect(self, application, django_application, host, domain):
+        domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+        response = _call(application, "/foo/", headers={"host": host})
+
+        assert response.status == 302
+        assert response.headers["location"] == "https://acme.test/"
+        assert response.headers["content-length"] == "0"
+        assert response.body == b""
+        assert django_application.calls == 0
+
+    def test_permanent_redirect_with_subpath_and_query_string(
+        self, application, host, domain
+    ):
+        domain.redirect_rules.create(
+            path="foo",
+            destination="https://acme.test/",
+            permanent=True,
+            match_subpaths=True,
+            append_subpath=True,
+            pass_query_string=True,
+        )
+
+        response = _call(application, "/foo/bär?a=1", headers={"host": host})
+
+        assert response.status == 301
+        assert response.headers["location"] == "https://acme.test/b%C3%A4r?a=1"
+
+    @pytest.mark.parametrize(
+        "path", ["/__healthz", "/__readiness", "/admin/", "/admin/login/"]
+    )
+    def test_reserved_paths_fall_through(
+        self, settings, django_application, host, domain, path
+    ):
+        settings.ENABLE_ADMIN_APP = True
+        settings.ADMIN_URL = "admin"
+        domain.redirect_rules.create(
+            path="", destination="https://acme.test/", match_subpaths=True
+        )
+
+        response = _call(
+            RedirectASGIApplication(django_application), path, headers={"host": host}
+        )
+
+        assert response.body == b"django"
+
+    def test_no_match_falls_through(self, application, host):
+        response = _call(application, "/foo", headers={"host": host})
+
+        assert response.body == b"django"
+
+    def test_unknown_host_falls_through(self, application, domain):
+        domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+        response = _call(application, "/foo", headers={"host": "unknown.test"})
+
+        assert response.body == b"django"
+
+    def test_debug_requests_fall_through(
+        self, settings, django_application, host, domain
+    ):
+        settings.REDIRECT_DEBUG_SECRET = "s3cret"  # noqa: S105
+        application = RedirectASGIApplication(django_application)
+        domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+        response = _call(
+            application, "/foo", headers={"host": host, "x-redirect-debug": "anything"}
+        )
+
+        assert response.body == b"django"
+
+    def test_disallowed_host_falls_through(self, settings, application, host, domain):
+        settings.ALLOWED_HOSTS = ["other.test"]
+        domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+        response = _call(application, "/foo", headers={"host": host})
+
+        assert response.body == b"django"
+
+    @pytest.mark.parametrize("method", ["post", "head", "options"])
+    def test_other_methods_fall_through(
+        self, application, django_application, host, domain, method
+    ):
+        domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+        _call(application, "/foo", method=method, headers={"host": host})
+
+        assert django_application.calls == 1
+
+    def test_unsafe_subpath_falls_through(self, application, host, domain):
+        domain.redirect_rules.create(
+            path="",
+            destination="https://acme.test/",
+            match_subpaths=True,
+            append_subpath=True,
+        )
+
+        response = _call(application, "/javascript:alert(1)", headers={"host": host})
+
+        assert response.body == b"django"
+
+    def test_same_response_as_django(self, host, domain, client):
+        domain.redirect_rules.create(
+            path="foo",
+            destination="https://acme.test/",
+            pass_query_string=True,
+        )
+        application = RedirectASGIApplication(ASGIHandler())
+
+        response = _call(application, "/foo?a=b", headers={"host": host})
+        django_response = client.get("/foo?a=b", HTTP_HOST=host)
+
+        assert response.status == django_response.status_code
+        assert response.headers["location"] == django_response["Location"]
+        assert response.headers["cache-control"] == django_response["Cache-Control"]
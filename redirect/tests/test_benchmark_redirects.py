@@ -0,0 +1,162 @@
+import json
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from redirect.api import find_redirect_rule_or_404
+from redirect.benchmark import (
+    SCENARIOS,
+    SyntheticRuleset,
+    benchmark_domains,
+    delete_benchmark_domains,
+)
+from redirect.models import Domain, RedirectRule, RulesetGeneration
+from redirect.routing import RoutingTable
+
+
+@pytest.mark.django_db
+def test_synthetic_ruleset_create():
+    ruleset = SyntheticRuleset(domain_count=3, rule_count=50, depth=3)
+    generation = RulesetGeneration.current()
+
+    ruleset.create()
+
+    assert benchmark_domains().count() == 3
+    assert RedirectRule.objects.count() == 50
+    assert RedirectRule.objects.filter(match_subpaths=True).count() == 5
+    assert all(
+        rule.path_key == rule.path.lower() and rule.path.count("/") == 2
+        for rule in RedirectRule.objects.all()
+    )
+    assert RulesetGeneration.current() > generation
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_synthetic_ruleset_requests(scenario):
+    ruleset = SyntheticRuleset(domain_count=3, rule_count=50)
+    ruleset.create()
+    table = RoutingTable.build()
+
+    requests = ruleset.requests(scenario, 20)
+
+    assert len(requests) == 20
+    for host, path in requests:
+        rule = table.resolve(host, path)
+        if scenario in ("miss", "unknown_host"):
+            assert rule is None
+            continue
+        assert rule.match_subpaths == (scenario == "wildcard")
+        assert rule.case_sensitive == (scenario == "exact")
+        # The database resolver agrees with the routing table
+        assert find_redirect_rule_or_404(host, path).id == rule.id
+
+
+def test_synthetic_ruleset_requests_without_wildcards():
+    ruleset = SyntheticRuleset(rule_count=50, wildcard_ratio=0)
+
+    assert ruleset.requests("wildcard", 10) == []
+    assert len(ruleset.requests("exact", 10)) == 10
+
+
+@pytest.mark.django_db
+def test_delete_benchmark_domains(domain):
+    SyntheticRuleset(domain_count=2, rule_count=10).create()
+
+    delete_benchmark_domains()
+
+    assert not benchmark_domains().exists()
+    assert list(Domain.objects.all()) == [domain]
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("resolver", ["table", "database"])
+def test_benchmark_redirects(resolver, tmp_path):
+    out = StringIO()
+    output = tmp_path / "results.json"
+
+    call_command(
+        "benchmark_redirects",
+        "--rules=20",
+        "--requests=20",
+        f"--resolver={resolver}",
+        f"--output={output}",
+        stdout=out,
+    )
+
+    assert "django" in out.getvalue()
+    assert ("fast path" in out.getvalue()) == (resolver == "table")
+    results = json.loads(output.read_text())
+    assert results["parameters"]["resolver"] == resolver
+    assert set(results["results"]["django"]) == set(SCENARIOS)
+    exact = results["results"]["django"]["exact"]
+    assert exact["requests"] == 20
+    assert exact["p50_us"] <= exact["p99_us"]
+    if resolver == "table":
+        assert exact["queries_per_request"] < 1
+    else:
+        assert exact["queries_per_request"] >= 1
+    # The benchmark domains are cleaned up
+    assert not Domain.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_benchmark_redirects_baseline(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    call_command(
+        "benchmark_redirects",
+        "--rules=20",
+        "--requests=20",
+        f"--output={baseline}",
+        stdout=StringIO(),
+    )
+    out = StringIO()
+
+    call_command(
+        "benchmark_redirects",
+        "--rules=20",
+        "--requests=20",
+        f"--baseline={baseline}",
+        stdout=out,
+    )
+
+    assert "Compared to the baseline" in out.getvalue()
+    assert "different parameters" not in out.getvalue()
+    assert "fast path  wildcard" in out.getvalue()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_benchmark_redirects_asgi():
+    out = StringIO()
+
+    call_command(
+        "benchmark_redirects",
+        "--rules=10",
+        "--requests=20",
+        "--asgi",
+        "--processes=2",
+        "--concurrency=5",
+        stdout=out,
+    )
+
+    assert "wsgi 2x1" in out.getvalue()
+    assert "asgi fast path" in out.getvalue()
+    assert not Domain.objects.exists()
+
+
+@pytest.mark.django_db
+def test_benchmark_redirects_requires_allowed_host(settings):
+    settings.ALLOWED_HOSTS = ["example.test"]
+
+    with pytest.raises(CommandError, match="must be in ALLOWED_HOSTS"):
+        call_command("benchmark_redirects", stdout=StringIO())
+
+
+@pytest.mark.django_db
+def test_benchmark_redirects_refuses_existing_domains():
+    SyntheticRuleset(domain_count=1, rule_count=1).create()
+
+    with pytest.raises(CommandError, match="already exist"):
+        call_command("benchmark_redirects", stdout=StringIO())
@@ -0,0 +1,93 @@
+import pytest
+
+from redirect.routing import cache_control
+
+pytestmark = pytest.mark.usefixtures("routing_table")
+
+
+@pytest.fixture(autouse=True)
+def max_ages(settings):
+    settings.REDIRECT_PERMANENT_MAX_AGE = 86400
+    settings.REDIRECT_TEMPORARY_MAX_AGE = 60
+    settings.REDIRECT_NOT_FOUND_MAX_AGE = 30
+
+
+def test_cache_control():
+    assert cache_control(60) == "public, max-age=60"
+    assert cache_control(0) == "no-store"
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    ("permanent", "expected"),
+    [(True, "public, max-age=86400"), (False, "public, max-age=60")],
+)
+def test_default_max_age(client, host, domain, permanent, expected):
+    domain.redirect_rules.create(
+        path="foo", destination="https://acme.test/", permanent=permanent
+    )
+
+    response = client.get("/foo", HTTP_HOST=host)
+
+    assert response["Cache-Control"] == expected
+    assert not response.has_header("Vary")
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    ("permanent", "expected"),
+    [(True, "public, max-age=3600"), (False, "no-store")],
+)
+def test_domain_max_age(client, host, domain, permanent, expected):
+    domain.permanent_max_age = 3600
+    domain.temporary_max_age = 0
+    domain.save()
+    domain.redirect_rules.create(
+        path="foo", destination="https://acme.test/", permanent=permanent
+    )
+
+    response = client.get("/foo", HTTP_HOST=host)
+
+    assert response["Cache-Control"] == expected
+
+
+@pytest.mark.django_db
+def test_rule_max_age(client, host, domain):
+    domain.permanent_max_age = 3600
+    domain.save()
+    domain.redirect_rules.create(
+        path="foo",
+        destination="https://acme.test/",
+        permanent=True,
+        pass_query_string=True,
+        cache_max_age=120,
+    )
+
+    response = client.get("/foo?a=b", HTTP_HOST=host)
+
+    assert response["Location"] == "https://acme.test/?a=b"
+    assert response["Cache-Control"] == "public, max-age=120"
+    # The query string is part of the cache key already
+    assert not response.has_header("Vary")
+
+
+@pytest.mark.django_db
+def test_not_found(client, routing_table, host, domain):
+    domain.not_found_max_age = 300
+    domain.save()
+
+    response = client.get("/missing", HTTP_HOST=host)
+
+    assert response.status_code == 404
+    # Only the routing table knows the domain of a miss without another query
+    assert response["Cache-Control"] == (
+        "public, max-age=300" if routing_table else "public, max-age=30"
+    )
+
+
+@pytest.mark.django_db
+def test_unknown_host(client, domain):
+    response = client.get("/missing", HTTP_HOST="unknown.test")
+
+    assert response.status_code == 404
+    assert response["Cache-Control"] == "public, max-age=30"
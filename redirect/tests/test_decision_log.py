@@ -0,0 +1,116 @@
+import json
+import logging
+import queue
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from redirect import decision_log, metrics
+from redirect.decision_log import DecisionLog
+
+
+@pytest.fixture
+def log(settings, monkeypatch):
+    settings.REDIRECT_DECISION_LOG = True
+    log = DecisionLog()
+    # Drained by the tests instead of a thread
+    log.thread = Mock()
+    log.queue = queue.Queue(10)
+    monkeypatch.setattr(decision_log, "decision_log", log)
+    return log
+
+
+def _decisions(caplog):
+    return [
+        json.loads(record.getMessage())
+        for record in caplog.records
+        if record.name == "redirect.decisions"
+    ]
+
+
+@pytest.mark.django_db
+def test_redirect_decisions(client, caplog, log, host, domain, routing_table):
+    rule = domain.redirect_rules.create(
+        path="wild", destination="https://acme.test/", match_subpaths=True
+    )
+
+    client.get("/wild/card", HTTP_HOST=host)
+    client.get("/missing", HTTP_HOST=host)
+    client.get("/wild", HTTP_HOST="unknown.test")
+    with caplog.at_level(logging.INFO, logger="redirect.decisions"):
+        log.drain()
+
+    decisions = _decisions(caplog)
+    assert [
+        (decision["host"], decision["path"], decision["rule_id"], decision["outcome"])
+        for decision in decisions
+    ] == [
+        (host, "/wild/card", rule.id, "wildcard"),
+        (host, "/missing", None, "not_found"),
+        (
+            "unknown.test",
+            "/wild",
+            None,
+            "unknown_host" if routing_table else "not_found",
+        ),
+    ]
+    assert all(decision["duration_ms"] >= 0 for decision in decisions)
+
+
+def test_full_queue_drops(caplog, log):
+    log.queue = queue.Queue(1)
+    metrics.DECISION_LOG_DROPPED.values = {}
+
+    for _ in range(3):
+        log.record("example.test", "/foo", 1, metrics.EXACT, 0.001)
+    with caplog.at_level(logging.INFO):
+        log.drain()
+
+    assert len(_decisions(caplog)) == 1
+    assert log.dropped == 2
+    assert metrics.DECISION_LOG_DROPPED.values == {(): 2}
+    assert "Dropped 2 redirect decisions" in caplog.text
+
+
+def test_sampling(log):
+    log.sample_rate = 0
+
+    log.record("example.test", "/foo", 1, metrics.EXACT, 0.001)
+
+    assert log.queue.empty()
+    assert log.dropped == 0
+
+
+def test_background_thread(settings, caplog, monkeypatch):
+    settings.REDIRECT_DECISION_LOG_SAMPLE_RATE = 1.0
+    settings.REDIRECT_DECISION_LOG_QUEUE_SIZE = 10
+    log = DecisionLog()
+
+    with caplog.at_level(logging.INFO, logger="redirect.decisions"):
+        log.record("example.test", "/foo", 1, metrics.EXACT, 0.001)
+        deadline = time.monotonic() + 10
+        while not _decisions(caplog):
+            assert time.monotonic() < deadline, "The decision was not logged"
+            time.sleep(0.01)
+
+    assert _decisions(caplog)[0]["rule_id"] == 1
+
+
+def test_reset_after_fork(log):
+    log.record("example.test", "/foo", 1, metrics.EXACT, 0.001)
+
+    log._reset()
+
+    assert log.queue is None
+    assert log.thread is None
+
+
+@pytest.mark.django_db
+def test_disabled(settings, client, log, host, domain):
+    settings.REDIRECT_DECISION_LOG = False
+    domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+    client.get("/foo", HTTP_HOST=host)
+
+    assert log.queue.empty()
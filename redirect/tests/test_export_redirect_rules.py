@@ -0,0 +1,191 @@
+import json
+import threading
+from io import StringIO
+
+import pytest
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+from redirect.models import Domain, DomainName, RedirectRule
+from redirect.rule_files import export_domains
+
+
+@pytest.fixture
+def ruleset(domain_factory, redirect_rule_factory):
+    # Created out of order, and with notes added by the import
+    other = domain_factory(display_name="Ötökkä", names=["xn--tkk-dlab1b.test"])
+    acme = domain_factory(
+        display_name="Acme",
+        names=["www.acme.test", "acme.test"],
+        notes="Generated by import command on 2026-01-01\nThe Acme site",
+    )
+    domain_factory(display_name="Empty", names=["empty.test"])
+    redirect_rule_factory(domain=other, path="ääkköset", destination="https://ä.test/")
+    redirect_rule_factory(
+        domain=acme,
+        path="foo/bar",
+        destination="https://acme.test/bar",
+        match_subpaths=True,
+        append_subpath=True,
+    )
+    redirect_rule_factory(
+        domain=acme,
+        path="Foo",
+        destination="https://acme.test/foo",
+        permanent=True,
+        case_sensitive=True,
+        pass_query_string=True,
+        notes="Generated by import command on 2026-01-01\nOld page",
+    )
+    redirect_rule_factory(domain=acme, path="", destination="https://acme.test/")
+
+
+EXPECTED = [
+    {
+        "display_name": "Acme",
+        "domain_names": ["acme.test", "www.acme.test"],
+        "notes": "The Acme site",
+        "rules": [
+            {
+                "path": "/",
+                "destination": "https://acme.test/",
+                "permanent": False,
+                "case_sensitive": False,
+                "match_subpaths": False,
+                "append_subpath": False,
+                "pass_query_string": False,
+            },
+            {
+                "path": "/Foo",
+                "destination": "https://acme.test/foo",
+                "permanent": True,
+                "case_sensitive": True,
+                "match_subpaths": False,
+                "append_subpath": False,
+                "pass_query_string": True,
+                "notes": "Old page",
+            },
+            {
+                "path": "/foo/bar",
+                "destination": "https://acme.test/bar",
+                "permanent": False,
+                "case_sensitive": False,
+                "match_subpaths": True,
+                "append_subpath": True,
+                "pass_query_string": False,
+            },
+        ],
+    },
+    {"display_name": "Empty", "domain_names": ["empty.test"], "rules": []},
+    {
+        "display_name": "Ötökkä",
+        "domain_names": ["xn--tkk-dlab1b.test"],
+        "rules": [
+            {
+                "path": "/ääkköset",
+                "destination": "https://ä.test/",
+                "permanent": False,
+                "case_sensitive": False,
+                "match_subpaths": False,
+                "append_subpath": False,
+                "pass_query_string": False,
+            }
+        ],
+    },
+]
+
+
+@pytest.mark.django_db
+def test_export_json(ruleset):
+    out = StringIO()
+    err = StringIO()
+
+    call_command("export_redirect_rules", stdout=out, stderr=err)
+
+    assert out.getvalue() == json.dumps(EXPECTED, ensure_ascii=False, indent=2) + "\n"
+    assert err.getvalue().strip() == "Exported 3 domains and 4 rules"
+
+
+@pytest.mark.django_db
+def test_export_json_lines(ruleset, tmp_path):
+    path = tmp_path / "rules.jsonl"
+
+    call_command("export_redirect_rules", str(path), stderr=StringIO())
+
+    assert path.read_text().splitlines() == [
+        json.dumps(item, ensure_ascii=False) for item in EXPECTED
+    ]
+
+
+@pytest.mark.django_db
+def test_export_empty():
+    out = StringIO()
+
+    call_command("export_redirect_rules", stdout=out, stderr=StringIO())
+
+    assert out.getvalue() == "[]\n"
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("file_name", ["rules.json", "rules.jsonl"])
+def test_export_imports_back_the_same(ruleset, tmp_path, file_name):
+    path = tmp_path / file_name
+    call_command("export_redirect_rules", str(path), stderr=StringIO())
+    exported = path.read_bytes()
+    Domain.objects.all().delete()
+
+    call_command("import_redirect_rules", str(path), stdout=StringIO())
+    call_command("export_redirect_rules", str(path), stderr=StringIO())
+
+    assert path.read_bytes() == exported
+
+
+@pytest.mark.django_db
+def test_export_prefetches_names_per_chunk(domain_factory, redirect_rule_factory):
+    for domain in domain_factory.create_batch(5):
+        redirect_rule_factory(domain=domain)
+
+    with CaptureQueriesContext(connection) as queries:
+        call_command(
+            "export_redirect_rules",
+            "--chunk-size",
+            "2",
+            stdout=StringIO(),
+            stderr=StringIO(),
+        )
+
+    name_queries = [
+        query
+        for query in queries
+        if f'FROM "{DomainName._meta.db_table}"' in query["sql"]
+    ]
+    assert len(name_queries) == 3
+
+
+@pytest.mark.django_db(transaction=True)
+def test_export_reads_one_snapshot(ruleset):
+    def change_rules():
+        try:
+            acme = Domain.objects.get(display_name="Acme")
+            RedirectRule.objects.filter(domain__display_name="Ötökkä").delete()
+            RedirectRule.objects.create(
+                domain=acme, path="zzz", destination="https://acme.test/zzz"
+            )
+            Domain.objects.filter(display_name="Empty").delete()
+        finally:
+            connections.close_all()
+
+    items = export_domains(chunk_size=1)
+    first = next(items)
+    # In another connection while the export is in progress
+    thread = threading.Thread(target=change_rules)
+    thread.start()
+    thread.join()
+
+    assert [first, *items] == EXPECTED
+
+
+def test_export_csv_not_supported(tmp_path):
+    with pytest.raises(CommandError, match="Can't export in the csv format"):
+        call_command("export_redirect_rules", str(tmp_path / "rules.csv"))
@@ -1,12 +1,28 @@
+import hashlib
 import json
 from io import StringIO
 from pathlib import Path
 
 import pytest
-from django.core.management import call_command
-
-from redirect.management.commands.import_redirect_rules import Command, ImporterError
-from redirect.models import Domain, DomainName, RedirectRule
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from redirect.management.commands.import_redirect_rules import (
+    Command,
+    DomainImport,
+    ImporterError,
+)
+from redirect.models import (
+    Domain,
+    DomainName,
+    ImportCheckpoint,
+    RedirectRule,
+    RedirectRuleStats,
+    RulesetGeneration,
+)
+from redirect.rule_files import RuleFileError
 
 
 def _make_path(path):
@@ -124,8 +140,13 @@ class IntegrationTest:
                 assert rule_from_json["notes"] in rule.notes
 
 
+@pytest.fixture
+def domain_import():
+    return DomainImport(Domain(display_name="Example"), ["example.com"])
+
+
 @pytest.mark.django_db
-def test_process_rule_creates_redirect_rule(import_command, domain):
+def test_process_rule_creates_redirect_rule(import_command, domain_import):
     rule = {
         "path": "/test",
         "destination": "https://acme.test",
@@ -137,23 +158,88 @@ def test_process_rule_creates_redirect_rule(import_command, domain):
         "notes": "Test note",
     }
 
-    import_command.process_rule(domain, rule)
+    import_command.pending_domains.append(domain_import)
+    import_command.process_rule(domain_import, rule)
+    import_command.insert_pending()
 
+    domain = Domain.objects.get(display_name="Example")
     assert RedirectRule.objects.filter(domain=domain, path="test").exists()
 
 
-@pytest.mark.django_db
-def test_process_rule_raises_error_if_rule_exists(
-    domain, import_command, redirect_rule_factory
-):
-    redirect_rule_factory(domain=domain, path="test", destination="https://acme.test")
+def test_process_rule_raises_error_if_rule_exists(import_command, domain_import):
     rule = {
         "path": "/test",
         "destination": "https://acme.test",
     }
+    import_command.process_rule(domain_import, rule)
 
     with pytest.raises(ImporterError, match=".*/test already exists.*"):
-        import_command.process_rule(domain, rule)
+        import_command.process_rule(domain_import, rule)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    ("existing", "new"),
+    [
+        ({"path": "Foo", "case_sensitive": True}, {"path": "foo"}),
+        ({"path": "foo"}, {"path": "Foo", "case_sensitive": True}),
+        (
+            {"path": "Foo", "case_sensitive": True},
+            {"path": "FOO", "case_sensitive": True},
+        ),
+        ({"path": "foo", "match_subpaths": True}, {"path": "FOO/bar"}),
+        ({"path": "foo/bar"}, {"path": "foo", "match_subpaths": True}),
+        (
+            {"path": "foo/bar", "match_subpaths": True},
+            {"path": "foo", "match_subpaths": True},
+        ),
+        (
+            {"path": "foo", "match_subpaths": True},
+            {"path": "FOO/bar/baz", "match_subpaths": True},
+        ),
+        (
+            {"path": "Foo", "match_subpaths": True, "case_sensitive": True},
+            {"path": "foo/bar", "match_subpaths": True, "case_sensitive": True},
+        ),
+        (
+            {"path": "Foo", "match_subpaths": True, "case_sensitive": True},
+            {"path": "foo/bar", "match_subpaths": True},
+        ),
+        (
+            {"path": "", "match_subpaths": True},
+            {"path": "foo", "match_subpaths": True},
+        ),
+    ],
+)
+def test_process_rule_checks_conflicts_like_the_model(
+    import_command, domain_import, domain, existing, new
+):
+    """The checks done in memory agree with `RedirectRule.clean`."""
+    RedirectRule.objects.create(
+        domain=domain, destination="https://acme.test", **existing
+    )
+    try:
+        RedirectRule.objects.create(
+            domain=domain, destination="https://acme.test", **new
+        )
+    except ValidationError:
+        conflicts = True
+    else:
+        conflicts = False
+    import_command.process_rule(
+        domain_import, {"destination": "https://acme.test", **existing}
+    )
+
+    if conflicts:
+        with pytest.raises(ValidationError, match="conflicts with existing rule"):
+            import_command.process_rule(
+                domain_import, {"destination": "https://acme.test", **new}
+            )
+    else:
+        import_command.process_rule(
+            domain_import, {"destination": "https://acme.test", **new}
+        )
+        assert len(import_command.pending_rules) == 2
 
 
 @pytest.mark.django_db
@@ -173,6 +259,7 @@ def test_process_domain_creates_domain_and_names(import_command, monkeypatch):
         "rules": [],
     }
     import_command.process_domain(item, 0)
+    import_command.insert_pending()
 
     assert Domain.objects.filter(display_name="Example").exists()
     assert DomainName.objects.filter(name="example.com").exists()
@@ -202,6 +289,7 @@ def test_process_domain_raises_error_if_domain_name_exists(import_command, domai
         "notes": "Test note",
         "rules": [],
     }
+    import_command.load_taken_names([item])
 
     with pytest.raises(
         ImporterError, match=f"Domain names .*{domain_name}.* already exist.*"
@@ -235,6 +323,485 @@ def test_process_domain_processes_rules_for_domain(import_command, monkeypatch):
         ],
     }
     import_command.process_domain(item, 0)
+    import_command.insert_pending()
 
     assert Domain.objects.filter(display_name="Example").exists()
     assert call_count == 2
+
+
+@pytest.mark.django_db
+def test_import_bumps_ruleset_generation():
+    generation = RulesetGeneration.current()
+
+    call_command("import_redirect_rules", SIMPLE_JSON_PATH, stdout=StringIO())
+
+    assert RulesetGeneration.current() > generation
+
+
+@pytest.mark.django_db
+def test_force_skips_conflicting_rules(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(
+        json.dumps(
+            [
+                {
+                    "domain_names": ["acme.test"],
+                    "rules": [
+                        {"path": "/foo", "destination": "https://acme.test/1"},
+                        {"path": "/FOO", "destination": "https://acme.test/2"},
+                        {"path": "/foo/", "destination": "https://acme.test/3"},
+                        {"path": "/bar", "destination": "https://acme.test/4"},
+                    ],
+                },
+                {"domain_names": ["acme.test"], "rules": []},
+            ]
+        )
+    )
+    out = StringIO()
+
+    call_command("import_redirect_rules", str(path), "--force", stdout=out)
+
+    assert list(
+        RedirectRule.objects.order_by("path").values_list("path", "destination")
+    ) == [("bar", "https://acme.test/4"), ("foo", "https://acme.test/1")]
+    assert Domain.objects.count() == 1
+    assert "2 imported" in out.getvalue()
+    assert "2 failed to import" in out.getvalue()
+    assert "1 failed to import" in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_import_queries_dont_grow_with_rules(tmp_path, django_assert_max_num_queries):
+    path = tmp_path / "rules.json"
+    path.write_text(
+        json.dumps(
+            [
+                {
+                    "domain_names": [f"domain{domain}.test"],
+                    "rules": [
+                        {
+                            "path": f"/path{rule}",
+                            "destination": "https://acme.test/",
+                            "match_subpaths": rule % 2 == 0,
+                        }
+                        for rule in range(500)
+                    ],
+                }
+                for domain in range(10)
+            ]
+        )
+    )
+    out = StringIO()
+
+    with django_assert_max_num_queries(30):
+        call_command(
+            "import_redirect_rules", str(path), "--batch-size", "2000", stdout=out
+        )
+
+    assert RedirectRule.objects.count() == 5000
+    assert "rules/s" in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_import_csv(tmp_path):
+    path = tmp_path / "rules.csv"
+    path.write_text(
+        "domain_names,display_name,path,destination,permanent,match_subpaths\n"
+        "acme.test www.acme.test,Acme,/foo,https://foo.test,true,\n"
+        "acme.test www.acme.test,,/bar,https://bar.test,,true\n"
+        "other.test,,/,https://other.test,,\n"
+    )
+
+    call_command("import_redirect_rules", str(path), stdout=StringIO())
+
+    domain = Domain.objects.get(display_name="Acme")
+    assert sorted(domain.names.values_list("name", flat=True)) == [
+        "acme.test",
+        "www.acme.test",
+    ]
+    assert list(
+        domain.redirect_rules.order_by("path").values_list(
+            "path", "permanent", "match_subpaths"
+        )
+    ) == [("bar", False, True), ("foo", True, False)]
+    assert RedirectRule.objects.get(domain__names__name="other.test").path == ""
+
+
+@pytest.mark.django_db
+def test_import_json_lines(tmp_path):
+    path = tmp_path / "rules.txt"
+    path.write_text(
+        '{"domain_names": ["acme.test"], "rules": [{"path": "/foo", "destination": "https://foo.test"}]}\n'
+        '{"domain_names": ["other.test"], "rules": []}\n'
+    )
+
+    call_command(
+        "import_redirect_rules", str(path), "--format", "jsonl", stdout=StringIO()
+    )
+
+    assert sorted(Domain.objects.values_list("display_name", flat=True)) == [
+        "acme.test",
+        "other.test",
+    ]
+    assert RedirectRule.objects.get().path == "foo"
+
+
+@pytest.mark.django_db
+def test_import_in_batches(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(
+        json.dumps(
+            [
+                {
+                    "domain_names": [f"domain{domain}.test"],
+                    "rules": [
+                        {"path": f"/{rule}", "destination": "https://acme.test/"}
+                        for rule in range(3)
+                    ],
+                }
+                for domain in range(4)
+            ]
+            # Taken by a domain inserted in an earlier batch
+            + [{"domain_names": ["domain0.test"], "rules": []}]
+        )
+    )
+    out = StringIO()
+
+    with pytest.raises(ImporterError):
+        call_command(
+            "import_redirect_rules", str(path), "--batch-size", "5", stdout=out
+        )
+
+    assert "Progress: " in out.getvalue()
+    assert "4 domain(s) and 12 rule(s) processed" in out.getvalue()
+    assert Domain.objects.count() == 0
+
+    out = StringIO()
+    call_command(
+        "import_redirect_rules", str(path), "--batch-size", "5", "--force", stdout=out
+    )
+
+    assert Domain.objects.count() == 4
+    assert RedirectRule.objects.count() == 12
+    assert "Progress: 100% of the file read, 5 domain(s) and 12 rule(s) processed" in (
+        out.getvalue()
+    )
+
+
+@pytest.mark.django_db
+def test_import_invalid_file(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text('[{"domain_names": ["acme.test"], "rules": []}, {')
+
+    with pytest.raises(RuleFileError, match="Invalid JSON at character 48"):
+        call_command("import_redirect_rules", str(path), stdout=StringIO())
+
+    assert Domain.objects.count() == 0
+
+
+SYNC_ITEMS = [
+    {
+        "domain_names": ["acme.test", "www.acme.test"],
+        "notes": "Acme",
+        "rules": [
+            {"path": "/foo", "destination": "https://acme.test/foo"},
+            {
+                "path": "/bar",
+                "destination": "https://acme.test/bar",
+                "permanent": True,
+                "notes": "Bar",
+            },
+            {"path": "/baz", "destination": "https://acme.test/baz"},
+            {"path": "/qux", "destination": "https://acme.test/qux"},
+        ],
+    },
+    {
+        "domain_names": ["other.test"],
+        "rules": [
+            {
+                "path": "/",
+                "destination": "https://other.test/",
+                "match_subpaths": True,
+            }
+        ],
+    },
+]
+
+
+def _write_json(tmp_path, items):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(items))
+    return str(path)
+
+
+@pytest.mark.django_db
+def test_sync_unchanged_file_touches_nothing(tmp_path):
+    path = _write_json(tmp_path, SYNC_ITEMS)
+    call_command("import_redirect_rules", path, stdout=StringIO())
+    generation = RulesetGeneration.current()
+    out = StringIO()
+
+    with CaptureQueriesContext(connection) as queries:
+        call_command("import_redirect_rules", path, "--sync", stdout=out)
+
+    assert not [
+        query["sql"]
+        for query in queries
+        if query["sql"].startswith(("INSERT", "UPDATE", "DELETE"))
+    ]
+    assert RulesetGeneration.current() == generation
+    assert (
+        "redirect rules: 0 created, 0 updated, 0 deleted, 5 unchanged" in out.getvalue()
+    )
+
+
+# The imports are committed like when run one after the other
+@pytest.mark.django_db(transaction=True)
+def test_sync_applies_differences(tmp_path):
+    call_command(
+        "import_redirect_rules", _write_json(tmp_path, SYNC_ITEMS), stdout=StringIO()
+    )
+    rules = {rule.path: rule for rule in RedirectRule.objects.all()}
+    RedirectRuleStats.objects.create(rule=rules["qux"], hits=1)
+    generation = RulesetGeneration.current()
+    items = [
+        {
+            "domain_names": ["acme.test", "acme2.test"],
+            "rules": [
+                {"path": "/foo", "destination": "https://acme.test/foo"},
+                {
+                    "path": "/bar/",
+                    "destination": "https://acme.test/new",
+                    "permanent": True,
+                    "notes": "New",
+                },
+                {
+                    "path": "/baz",
+                    "destination": "https://acme.test/baz",
+                    "notes": "Baz",
+                },
+                {"path": "/QUX", "destination": "https://acme.test/qux"},
+            ],
+        },
+        {"domain_names": ["new.test"], "rules": []},
+    ]
+    out = StringIO()
+
+    call_command(
+        "import_redirect_rules", _write_json(tmp_path, items), "--sync", stdout=out
+    )
+
+    domain = Domain.objects.get(names__name="acme.test")
+    assert domain.notes == rules["foo"].domain.notes
+    assert sorted(domain.names.values_list("name", flat=True)) == [
+        "acme.test",
+        "acme2.test",
+    ]
+    synced = {rule.path: rule for rule in domain.redirect_rules.all()}
+    assert sorted(synced) == ["QUX", "bar", "baz", "foo"]
+    assert synced["foo"].updated_at == rules["foo"].updated_at
+    assert synced["bar"].id == rules["bar"].id
+    assert synced["bar"].destination == "https://acme.test/new"
+    assert synced["bar"].notes.endswith("\nNew")
+    assert synced["bar"].updated_at > rules["bar"].updated_at
+    assert synced["baz"].notes.endswith("\nBaz")
+    assert not RedirectRuleStats.objects.exists()
+    assert Domain.objects.filter(names__name="new.test").exists()
+    assert RulesetGeneration.current() == generation + 1
+    assert "redirect rules: 1 created, 2 updated, 1 deleted, 1 unchanged" in (
+        out.getvalue()
+    )
+    assert "domain names: 1 added, 1 removed" in out.getvalue()
+    assert "Updated rule bar: destination, notes" in out.getvalue()
+    assert "Deleted rule qux" in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_sync_dry_run(tmp_path):
+    call_command(
+        "import_redirect_rules", _write_json(tmp_path, SYNC_ITEMS), stdout=StringIO()
+    )
+    items = [{"domain_names": ["acme.test"], "rules": []}]
+    out = StringIO()
+
+    call_command(
+        "import_redirect_rules",
+        _write_json(tmp_path, items),
+        "--sync",
+        "--dry-run",
+        stdout=out,
+    )
+
+    assert "redirect rules: 0 created, 0 updated, 4 deleted, 0 unchanged" in (
+        out.getvalue()
+    )
+    assert "domain names: 0 added, 1 removed" in out.getvalue()
+    assert RedirectRule.objects.count() == 5
+    assert DomainName.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_sync_force_checks_against_kept_rules(tmp_path):
+    items = [
+        {
+            "domain_names": ["acme.test"],
+            "rules": [{"path": "/foo/bar", "destination": "https://acme.test/1"}],
+        }
+    ]
+    call_command(
+        "import_redirect_rules", _write_json(tmp_path, items), stdout=StringIO()
+    )
+    items[0]["rules"] = [
+        {
+            "path": "/foo",
+            "destination": "https://acme.test/2",
+            "match_subpaths": True,
+        },
+        # Conflicts with the one above, so the existing rule is kept as it is
+        {
+            "path": "/foo/bar",
+            "destination": "https://acme.test/3",
+            "match_subpaths": True,
+        },
+        # Conflicts with the kept rule
+        {"path": "/FOO/BAR", "destination": "https://acme.test/4"},
+    ]
+    out = StringIO()
+
+    call_command(
+        "import_redirect_rules",
+        _write_json(tmp_path, items),
+        "--sync",
+        "--force",
+        stdout=out,
+    )
+
+    assert list(
+        RedirectRule.objects.order_by("path").values_list(
+            "path", "destination", "match_subpaths"
+        )
+    ) == [
+        ("foo", "https://acme.test/2", True),
+        ("foo/bar", "https://acme.test/1", False),
+    ]
+    assert "conflicts with existing rule(s): foo/bar" in out.getvalue()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    ("items", "message"),
+    [
+        (
+            [{"domain_names": ["acme.test", "other.test"], "rules": []}],
+            "belong to different domains",
+        ),
+        (
+            [SYNC_ITEMS[0], {"domain_names": ["www.acme.test"], "rules": []}],
+            "already synced",
+        ),
+    ],
+)
+def test_sync_rejects_ambiguous_domains(tmp_path, items, message):
+    call_command(
+        "import_redirect_rules", _write_json(tmp_path, SYNC_ITEMS), stdout=StringIO()
+    )
+
+    with pytest.raises(ImporterError, match=message):
+        call_command(
+            "import_redirect_rules",
+            _write_json(tmp_path, items),
+            "--sync",
+            "--batch-size",
+            "1",
+            stdout=StringIO(),
+        )
+
+
+CHUNKED_ITEMS = [
+    {
+        "domain_names": [f"domain{domain}.test"],
+        "rules": [{"path": "/foo", "destination": "https://acme.test/"}],
+    }
+    for domain in range(5)
+]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_chunked_import_resumes_after_last_committed_chunk(tmp_path, monkeypatch):
+    path = _write_json(tmp_path, CHUNKED_ITEMS)
+    process_domain = Command.process_domain
+
+    def fail_at_item_3(self, item, index):
+        if index == 3:
+            raise RuntimeError("Connection lost")
+        process_domain(self, item, index)
+
+    monkeypatch.setattr(Command, "process_domain", fail_at_item_3)
+    out = StringIO()
+
+    with pytest.raises(RuntimeError):
+        call_command("import_redirect_rules", path, "--chunk-size", "2", stdout=out)
+
+    assert "Committed items up to #2" in out.getvalue()
+    assert "the items up to #2 stay imported" in out.getvalue()
+    assert sorted(DomainName.objects.values_list("name", flat=True)) == [
+        "domain0.test",
+        "domain1.test",
+    ]
+    checkpoint = ImportCheckpoint.objects.get()
+    assert (checkpoint.file_name, checkpoint.committed_items) == (path, 2)
+    assert not checkpoint.finished
+
+    monkeypatch.setattr(Command, "process_domain", process_domain)
+    out = StringIO()
+    call_command(
+        "import_redirect_rules", path, "--chunk-size", "2", "--resume", stdout=out
+    )
+
+    assert "Resuming after item #2" in out.getvalue()
+    assert "Processing item #3..." in out.getvalue()
+    assert "Processing item #2..." not in out.getvalue()
+    assert DomainName.objects.count() == 5
+    assert RedirectRule.objects.count() == 5
+    checkpoint.refresh_from_db()
+    assert (checkpoint.committed_items, checkpoint.finished) == (5, True)
+
+    out = StringIO()
+    call_command(
+        "import_redirect_rules", path, "--chunk-size", "2", "--resume", stdout=out
+    )
+
+    assert "The file was imported already" in out.getvalue()
+    assert DomainName.objects.count() == 5
+
+
+@pytest.mark.django_db
+def test_chunked_import_restarts_without_resume(tmp_path):
+    path = _write_json(tmp_path, CHUNKED_ITEMS)
+    ImportCheckpoint.objects.create(
+        file_hash=hashlib.sha256(Path(path).read_bytes()).hexdigest(),
+        file_name=path,
+        committed_items=2,
+    )
+    out = StringIO()
+
+    call_command("import_redirect_rules", path, "--chunk-size", "10", stdout=out)
+
+    assert "Restarting the import that stopped after item #2" in out.getvalue()
+    assert DomainName.objects.count() == 5
+    assert ImportCheckpoint.objects.get().finished
+
+
+@pytest.mark.parametrize(
+    ("args", "message"),
+    [
+        (["--resume"], "--resume requires --chunk-size"),
+        (
+            ["--dry-run", "--chunk-size", "10"],
+            "--dry-run can't be combined with --chunk-size",
+        ),
+    ],
+)
+def test_chunked_import_invalid_arguments(args, message):
+    with pytest.raises(CommandError, match=message):
+        call_command("import_redirect_rules", SIMPLE_JSON_PATH, *args)
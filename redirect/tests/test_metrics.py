@@ -0,0 +1,201 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+from redirect import metrics, routing
+from redirect.metrics import Counter, Gauge, Histogram, Registry
+
+
+@pytest.fixture(autouse=True)
+def clean_registry(settings):
+    settings.REDIRECT_METRICS = True
+    metrics.REGISTRY.reset()
+    metrics.RULESET_GENERATION.values = {}
+    yield
+    metrics.REGISTRY.reset()
+
+
+@pytest.fixture
+def registry():
+    registry = Registry()
+    registry.register(Counter("requests_total", "Requests.", ("domain",)))
+    registry.register(Gauge("generation", "Generation."))
+    registry.register(
+        Histogram("latency_seconds", "Latency.", ("outcome",), buckets=(0.1, 1))
+    )
+    return registry
+
+
+def _exited_pid():
+    process = subprocess.Popen(["true"])  # noqa: S607
+    process.wait()
+    return process.pid
+
+
+def test_exposition(registry):
+    registry.metrics["requests_total"].inc(('a "b"',))
+    registry.metrics["requests_total"].inc(('a "b"',), 2)
+    registry.metrics["generation"].set(7)
+    for value in (0.05, 0.5, 5):
+        registry.metrics["latency_seconds"].observe(value, ("exact",))
+
+    text = registry.exposition(registry.merge([registry.dump()]))
+
+    assert text.splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{domain="a \\"b\\""} 3.0',
+        "# HELP generation Generation.",
+        "# TYPE generation gauge",
+        "generation 7.0",
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{outcome="exact",le="0.1"} 1.0',
+        'latency_seconds_bucket{outcome="exact",le="1.0"} 2.0',
+        'latency_seconds_bucket{outcome="exact",le="+Inf"} 3.0',
+        'latency_seconds_sum{outcome="exact"} 5.55',
+        'latency_seconds_count{outcome="exact"} 3.0',
+    ]
+
+
+def test_merge(registry):
+    other = Registry()
+    for metric in registry.metrics.values():
+        other.register(type(metric)(metric.name, "", metric.labelnames))
+    other.metrics["latency_seconds"].buckets = (0.1, 1)
+    registry.metrics["requests_total"].inc(("a",))
+    other.metrics["requests_total"].inc(("a",))
+    other.metrics["requests_total"].inc(("b",))
+    registry.metrics["generation"].set(3)
+    other.metrics["generation"].set(4)
+    registry.metrics["latency_seconds"].observe(0.5, ("exact",))
+    other.metrics["latency_seconds"].observe(0.5, ("exact",))
+
+    merged = registry.merge([registry.dump(), other.dump()])
+
+    assert merged["requests_total"] == {("a",): 2, ("b",): 1}
+    assert merged["generation"] == {(): 4}
+    assert merged["latency_seconds"] == {("exact",): [0, 2, 0, 1.0]}
+
+
+def test_collect_aggregates_processes(settings, tmp_path):
+    settings.REDIRECT_METRICS_DIR = str(tmp_path)
+    metrics.REDIRECTS.inc(("example.test",))
+    other = {"tirehtoori_redirects_total": [[["example.test"], 2]]}
+    (tmp_path / f"{os.getppid()}-cafe.json").write_text(json.dumps(other))
+
+    text = metrics.collect()
+
+    assert 'tirehtoori_redirects_total{domain="example.test"} 3.0' in text
+
+
+def test_collect_archives_exited_processes(settings, tmp_path):
+    settings.REDIRECT_METRICS_DIR = str(tmp_path)
+    exited = {
+        "tirehtoori_redirects_total": [[["example.test"], 2]],
+        "tirehtoori_ruleset_generation": [[[], 5]],
+    }
+    (tmp_path / f"{_exited_pid()}-cafe.json").write_text(json.dumps(exited))
+    metrics.RULESET_GENERATION.set(4)
+
+    text = metrics.collect()
+    # Counters don't go backwards on the next scrape
+    assert metrics.collect() == text
+
+    assert 'tirehtoori_redirects_total{domain="example.test"} 2.0' in text
+    # Gauges of exited processes are dropped
+    assert "tirehtoori_ruleset_generation 4.0" in text
+    assert sorted(path.name for path in tmp_path.glob("*.json")) == [
+        metrics.REGISTRY.file_name,
+        "archive.json",
+    ]
+
+
+def test_flush_interval(settings, tmp_path):
+    settings.REDIRECT_METRICS_DIR = str(tmp_path)
+    settings.REDIRECT_METRICS_FLUSH_INTERVAL = 60
+
+    metrics.record_resolution(metrics.EXACT, 0.001, "example.test")
+    metrics.record_resolution(metrics.EXACT, 0.001, "example.test")
+
+    dump = json.loads((tmp_path / metrics.REGISTRY.file_name).read_text())
+    assert dump["tirehtoori_redirects_total"] == [[["example.test"], 1]]
+
+
+def test_reset_after_fork():
+    metrics.REDIRECTS.inc(("example.test",))
+    metrics.RULESET_GENERATION.set(3)
+    file_name = metrics.REGISTRY.file_name
+
+    metrics.REGISTRY.reset()
+
+    assert metrics.REDIRECTS.values == {}
+    assert metrics.RULESET_GENERATION.values == {(): 3}
+    assert metrics.REGISTRY.file_name != file_name
+
+
+@pytest.mark.django_db
+def test_resolution_outcomes(client, host, domain, routing_table):
+    domain.redirect_rules.create(
+        path="exact", destination="https://acme.test/", case_sensitive=True
+    )
+    domain.redirect_rules.create(path="ci", destination="https://acme.test/")
+    domain.redirect_rules.create(
+        path="wild", destination="https://acme.test/", match_subpaths=True
+    )
+
+    for path in ("/exact", "/CI", "/wild/card", "/missing"):
+        client.get(path, HTTP_HOST=host)
+    client.get("/exact", HTTP_HOST="unknown.test")
+
+    outcomes = {
+        labels[0]: sum(counts[:-1])
+        for labels, counts in metrics.RESOLUTION_SECONDS.values.items()
+    }
+    if routing_table:
+        assert outcomes == {
+            "exact": 1,
+            "case_insensitive": 1,
+            "wildcard": 1,
+            "not_found": 1,
+            "unknown_host": 1,
+        }
+    else:
+        assert outcomes == {
+            "exact": 1,
+            "case_insensitive": 1,
+            "wildcard": 1,
+            "not_found": 2,
+        }
+    assert metrics.REDIRECTS.values == {(host,): 3}
+
+
+@pytest.mark.django_db
+def test_routing_table_metrics(client, host, domain):
+    domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+    client.get("/foo", HTTP_HOST=host)
+    client.get("/foo", HTTP_HOST=host)
+    client.get("/foo", HTTP_HOST="unknown.test")
+    client.get("/foo", HTTP_HOST="unknown.test")
+
+    assert metrics.CACHE_REQUESTS.values == {
+        ("routing_table", "miss"): 1,
+        ("routing_table", "hit"): 3,
+        ("unknown_hosts", "miss"): 1,
+        ("unknown_hosts", "hit"): 1,
+    }
+    assert metrics.RULESET_GENERATION.values == {(): routing._routing_table.generation}
+    assert sum(metrics.RULESET_LOAD_SECONDS.values[()][:-1]) == 1
+
+
+@pytest.mark.django_db
+def test_disabled(settings, client, host, domain):
+    settings.REDIRECT_METRICS = False
+    domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+    client.get("/foo", HTTP_HOST=host)
+
+    assert metrics.RESOLUTION_SECONDS.values == {}
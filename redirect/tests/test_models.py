@@ -1,9 +1,14 @@
+import importlib
 import itertools
+import string
+from random import Random
 
 import pytest
+from django.apps import apps
 from django.core.exceptions import ValidationError
+from django.db import transaction
 
-from redirect.models import RedirectRule
+from redirect.models import DomainName, RedirectRule, RulesetGeneration
 
 
 @pytest.mark.django_db
@@ -19,6 +24,45 @@ class TestRedirectRule:
 
         assert rule.path == "foo"
 
+    def test_clean_sets_lowercase_path_key(self, domain):
+        rule = RedirectRule(
+            domain=domain, path="/Foo/BAR/", destination=self.DEFAULT_DESTINATION
+        )
+
+        rule.clean()
+
+        assert rule.path_key == "foo/bar"
+
+    @pytest.mark.parametrize("match_subpaths", [False, True])
+    def test_save_long_path_and_destination(self, domain, match_subpaths):
+        # Incompressible, so that the index rows are as large as the values
+        random = Random(0)  # noqa: S311
+        alphabet = string.ascii_letters + string.digits
+        path = "".join(random.choices(alphabet, k=1000))
+        destination = "https://test.test/" + "".join(random.choices(alphabet, k=982))
+
+        rule = RedirectRule.objects.create(
+            domain=domain,
+            path=path,
+            destination=destination,
+            match_subpaths=match_subpaths,
+        )
+
+        assert RedirectRule.objects.get(domain=domain, path_key=path.lower()) == rule
+
+    def test_save_sets_path_key(self, domain):
+        rule = RedirectRule.objects.create(
+            domain=domain,
+            path="/Foo/",
+            destination=self.DEFAULT_DESTINATION,
+            case_sensitive=True,
+        )
+        rule.path = "Bar"
+        rule.save()
+
+        rule.refresh_from_db()
+        assert rule.path_key == "bar"
+
     def test_save_calls_clean_method(self, monkeypatch, domain):
         call_count = 0
 
@@ -344,3 +388,135 @@ class TestRedirectRule:
 
         with pytest.raises(ValidationError):
             rule.save()
+
+
+@pytest.mark.django_db
+class TestRulesetGeneration:
+    def test_bump_increments_generation(self):
+        generation = RulesetGeneration.current()
+
+        RulesetGeneration.bump()
+
+        assert RulesetGeneration.current() == generation + 1
+
+    def test_bump_creates_missing_row(self):
+        RulesetGeneration.objects.all().delete()
+        assert RulesetGeneration.current() == 0
+
+        RulesetGeneration.bump()
+
+        assert RulesetGeneration.current() == 1
+
+    # Each change is committed on its own
+    @pytest.mark.django_db(transaction=True)
+    def test_domain_changes_bump_generation(self, domain_factory):
+        generation = RulesetGeneration.current()
+
+        domain = domain_factory(names=["acme.test"])
+        assert RulesetGeneration.current() > generation
+
+        generation = RulesetGeneration.current()
+        domain.delete()
+        assert RulesetGeneration.current() > generation
+
+    # Each change is committed on its own
+    @pytest.mark.django_db(transaction=True)
+    def test_domain_name_changes_bump_generation(self, domain):
+        generation = RulesetGeneration.current()
+
+        domain_name = DomainName.objects.create(name="acme.test", domain=domain)
+        assert RulesetGeneration.current() == generation + 1
+
+        domain_name.name = "www.acme.test"
+        domain_name.save()
+        assert RulesetGeneration.current() == generation + 2
+
+        domain_name.delete()
+        assert RulesetGeneration.current() == generation + 3
+
+    # Each change is committed on its own
+    @pytest.mark.django_db(transaction=True)
+    def test_redirect_rule_changes_bump_generation(self, domain):
+        generation = RulesetGeneration.current()
+
+        rule = RedirectRule.objects.create(
+            domain=domain, path="foo", destination="https://test.test"
+        )
+        assert RulesetGeneration.current() == generation + 1
+
+        rule.destination = "https://acme.test"
+        rule.save()
+        assert RulesetGeneration.current() == generation + 2
+
+        rule.delete()
+        assert RulesetGeneration.current() == generation + 3
+
+    def test_rolled_back_change_does_not_bump_generation(self, domain):
+        generation = RulesetGeneration.current()
+
+        with pytest.raises(RuntimeError), transaction.atomic():
+            RedirectRule.objects.create(
+                domain=domain, path="foo", destination="https://test.test"
+            )
+            raise RuntimeError()
+
+        assert RulesetGeneration.current() == generation
+
+    @pytest.mark.django_db(transaction=True)
+    def test_changes_in_a_transaction_bump_generation_once(self, domain):
+        generation = RulesetGeneration.current()
+
+        with transaction.atomic():
+            for path in ["foo", "bar"]:
+                RedirectRule.objects.create(
+                    domain=domain, path=path, destination="https://test.test"
+                )
+            DomainName.objects.create(name="acme.test", domain=domain)
+        assert RulesetGeneration.current() == generation + 1
+
+        with transaction.atomic():
+            RedirectRule.objects.filter(domain=domain).delete()
+        assert RulesetGeneration.current() == generation + 2
+
+    @pytest.mark.django_db(transaction=True)
+    def test_change_after_rollback_bumps_generation(self, domain):
+        generation = RulesetGeneration.current()
+
+        with transaction.atomic():
+            with pytest.raises(RuntimeError), transaction.atomic():
+                RedirectRule.objects.create(
+                    domain=domain, path="foo", destination="https://test.test"
+                )
+                raise RuntimeError()
+            RedirectRule.objects.create(
+                domain=domain, path="bar", destination="https://test.test"
+            )
+        assert RulesetGeneration.current() == generation + 1
+
+        with pytest.raises(RuntimeError), transaction.atomic():
+            RedirectRule.objects.create(
+                domain=domain, path="baz", destination="https://test.test"
+            )
+            raise RuntimeError()
+        RedirectRule.objects.create(
+            domain=domain, path="baz", destination="https://test.test"
+        )
+        assert RulesetGeneration.current() == generation + 2
+
+
+@pytest.mark.django_db
+def test_migration_populates_path_key_like_save(domain, redirect_rule_factory):
+    migration = importlib.import_module(
+        "redirect.migrations.0007_redirectrule_path_key"
+    )
+    rules = [
+        redirect_rule_factory(domain=domain, path=path)
+        for path in ["ÄÄKKÖSET/Öljy", "Foo", "bar"]
+    ]
+    expected = [rule.path_key for rule in rules]
+    RedirectRule.objects.update(path_key="")
+
+    migration.populate_path_key(apps, None)
+
+    assert [rule.path_key for rule in RedirectRule.objects.order_by("id")] == expected
+    assert expected[0] == "ääkköset/öljy"
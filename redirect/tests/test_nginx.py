@@ -0,0 +1,288 @@
+import os
+import re
+from io import StringIO
+from urllib.parse import unquote
+
+import pytest
+from django.core.management import call_command
+
+from redirect.nginx import compile_nginx_maps
+from redirect.routing import RoutingTable
+from redirect.tests.conftest import rule_row
+
+DOMAIN_NAMES = [
+    ("example.test", 1, None),
+    ("WWW.Example.test", 1, None),
+    ("bücher.test", 2, None),
+    ("skipped.test", 3, None),
+]
+
+
+RULES = [
+    rule_row(1, 1, "Foo", case_sensitive=True),
+    rule_row(1, 2, "foo/bar", permanent=True),
+    rule_row(
+        1, 3, "FOO", match_subpaths=True, append_subpath=True, case_sensitive=True
+    ),
+    rule_row(1, 4, "Lorem", case_sensitive=True, match_subpaths=True),
+    rule_row(1, 5, "", match_subpaths=True, pass_query_string=True),
+    rule_row(
+        1,
+        6,
+        "docs",
+        destination="https://dest.test/manual/index.html",
+        match_subpaths=True,
+        append_subpath=True,
+        pass_query_string=True,
+    ),
+    rule_row(
+        1,
+        7,
+        "a/b",
+        destination="https://dest.test/x/",
+        match_subpaths=True,
+        append_subpath=True,
+        case_sensitive=True,
+    ),
+    rule_row(1, 8, "space here"),
+    rule_row(1, 9, "dollar", destination="https://dest.test/$1"),
+    rule_row(1, 10, "unsafe", destination="javascript:alert(1)"),
+    rule_row(1, 11, "__private"),
+    rule_row(2, 12, "Foo", permanent=True),
+    rule_row(2, 13, "cached", max_age=600),
+    rule_row(2, 14, "ääkköset", case_sensitive=True),
+    rule_row(3, 15, "ok"),
+    rule_row(3, 16, "Ä"),
+    rule_row(4, 17, "nameless"),
+]
+
+REQUESTS = [
+    ("example.test", path)
+    for path in [
+        "/",
+        "/Foo",
+        "/foo",
+        "/FOO",
+        "/foo/",
+        "/Foo/",
+        "/fo",
+        "/foo/bar",
+        "/FOO/BAR/",
+        "/foo/baz",
+        "/foo/baz/qux",
+        "/Foo/baz",
+        "/FOO/baz",
+        "/Lorem",
+        "/Lorem/ipsum",
+        "/lorem",
+        "/lorem/ipsum",
+        "/docs",
+        "/docs/",
+        "/docs/intro",
+        "/DOCS/intro?page=2",
+        "/a/b",
+        "/a/b/",
+        "/a/b/c/d",
+        "/a/bb",
+        "/space%20here",
+        "/SPACE%20here/",
+        "/dollar",
+        "/anything/else?x=1&y=2",
+        "/?q=1",
+        "/unsafe",
+        "/foo/b%C3%A4r",
+        "/foo/b%61r",
+        "/foo//bar",
+        "//foo",
+        "/docs/../x",
+        "/docs/.well-known",
+        "/admin/foo",
+        "/__private",
+        "/__healthz",
+    ]
+] + [
+    ("www.example.test", "/foo/bar"),
+    ("xn--bcher-kva.test", "/foo"),
+    ("xn--bcher-kva.test", "/cached"),
+    ("xn--bcher-kva.test", "/%C3%A4%C3%A4kk%C3%B6set"),
+    ("xn--bcher-kva.test", "/%c3%a4%c3%a4kk%c3%b6set"),
+    ("skipped.test", "/ok"),
+    ("unknown.test", "/foo"),
+]
+
+# Answered by nginx instead of being passed on to the application
+ANSWERED = [
+    ("example.test", "/"),
+    ("example.test", "/Foo"),
+    ("example.test", "/foo"),
+    ("example.test", "/Foo/"),
+    ("example.test", "/FOO/baz"),
+    ("example.test", "/foo/bar"),
+    ("example.test", "/FOO/BAR/"),
+    ("example.test", "/foo/baz/qux"),
+    ("example.test", "/Lorem/ipsum"),
+    ("example.test", "/docs/intro"),
+    ("example.test", "/DOCS/intro?page=2"),
+    ("example.test", "/a/b/c/d"),
+    ("example.test", "/space%20here"),
+    ("example.test", "/dollar"),
+    ("example.test", "/anything/else?x=1&y=2"),
+    ("www.example.test", "/foo/bar"),
+    ("xn--bcher-kva.test", "/cached"),
+    ("xn--bcher-kva.test", "/%C3%A4%C3%A4kk%C3%B6set"),
+]
+
+
+def _entries(contents):
+    for line in contents.splitlines():
+        if line and not line.startswith("#"):
+            quoted = re.fullmatch(r'"((?:[^"\\]|\\.)*)" "((?:[^"\\]|\\.)*)";', line)
+            yield tuple(re.sub(r"\\(.)", r"\1", part) for part in quoted.groups())
+
+
+def _nginx(export, host, request_uri):
+    """Resolve a GET request like the exported configuration does in nginx."""
+    path = re.match(r"^((?:/[^?/]+)*/?)(?:\?|$)", request_uri)
+    key = host + (path.group(1) if path else "")
+    args = request_uri.partition("?")[2]
+    variables = {"is_args": "?" if args else "", "args": args, "tirehtoori_dollar": "$"}
+
+    exact = {}
+    regexes = []
+    for name, contents in sorted(export.files.items()):
+        if name.startswith("exact/"):
+            exact.update(_entries(contents))
+        elif name.startswith("regex/"):
+            regexes += _entries(contents)
+
+    redirect = None
+    if (value := exact.get(key.lower())) is not None:
+        expected, _, redirect = value.partition("|")
+        if expected and expected != key:
+            redirect = None
+    if redirect is None:
+        for pattern, value in regexes:
+            if match := re.match(pattern[1:].replace("(?<", "(?P<"), key):
+                variables.update(match.groupdict())
+                redirect = value
+                break
+    if not redirect:
+        return None
+    status, cache_control, location = redirect.split("|", 2)
+    location = re.sub(
+        r"\$\{?(\w+)\}?", lambda match: variables[match.group(1)], location
+    )
+    return int(status), cache_control, location
+
+
+def _application(table, host, request_uri):
+    raw_path, _, query_string = request_uri.partition("?")
+    path = unquote(raw_path)[1:]
+    if path.startswith(("admin", "__")):
+        return None
+    rule = table.resolve(host, path)
+    if rule is None:
+        return None
+    return rule.status, rule.cache_control, rule.location_for(path, query_string)
+
+
+@pytest.fixture
+def export():
+    return compile_nginx_maps(DOMAIN_NAMES, RULES, "/etc/nginx/tirehtoori")
+
+
+@pytest.mark.parametrize(("host", "request_uri"), REQUESTS)
+def test_resolves_like_the_application(export, host, request_uri):
+    table = RoutingTable.from_rows(DOMAIN_NAMES, RULES)
+
+    answer = _nginx(export, host, request_uri)
+
+    if (host, request_uri) in ANSWERED:
+        assert answer is not None
+    if answer is not None:
+        assert answer == _application(table, host, request_uri)
+
+
+def test_skipped_rules(export):
+    assert [
+        (skipped.rule_id, skipped.domain_skipped) for skipped in export.skipped_rules
+    ] == [(10, False), (11, False), (16, True)]
+    assert "domain-3.map" not in str(sorted(export.files))
+    assert export.rule_count == 12
+
+
+def test_skipped_names(settings):
+    settings.ALLOWED_HOSTS = ["example.test"]
+
+    export = compile_nginx_maps(DOMAIN_NAMES, RULES, "/etc/nginx/tirehtoori")
+
+    assert export.skipped_names == [
+        "skipped.test",
+        "www.example.test",
+        "xn--bcher-kva.test",
+    ]
+    assert _nginx(export, "example.test", "/foo/bar") is not None
+    assert _nginx(export, "www.example.test", "/foo/bar") is None
+
+
+def test_includes(export):
+    maps = export.files["tirehtoori-maps.conf"]
+
+    assert "include /etc/nginx/tirehtoori/exact/*.map;" in maps
+    assert "include /etc/nginx/tirehtoori/regex/*.map;" in maps
+
+
+def test_deterministic(export):
+    assert (
+        compile_nginx_maps(
+            reversed(DOMAIN_NAMES), reversed(RULES), "/etc/nginx/tirehtoori"
+        ).files
+        == export.files
+    )
+
+
+@pytest.mark.django_db
+def test_command(tmp_path, domain, redirect_rule_factory, domain_factory):
+    rule = redirect_rule_factory(domain=domain, path="foo")
+    other_domain = domain_factory()
+    redirect_rule_factory(domain=other_domain, path="bar", match_subpaths=True)
+    other_domain_id = other_domain.id
+    exact_file = tmp_path / f"exact/domain-{domain.id}.map"
+    maps_file = tmp_path / "tirehtoori-maps.conf"
+
+    out = StringIO()
+    call_command("export_nginx_maps", str(tmp_path), stdout=out)
+
+    assert "Exported 2 rules, 5 files changed" in out.getvalue()
+    assert f'"{domain.names.first().name}/foo"' in exact_file.read_text()
+    assert f"include {tmp_path}/exact/*.map;" in maps_file.read_text()
+    modified = maps_file.stat().st_mtime_ns
+
+    rule.path = "baz"
+    rule.save()
+    other_domain.delete()
+    out = StringIO()
+    call_command("export_nginx_maps", str(tmp_path), stdout=out)
+
+    assert out.getvalue().splitlines() == [
+        f"Wrote exact/domain-{domain.id}.map",
+        f"Removed exact/domain-{other_domain_id}.map",
+        f"Removed regex/domain-{other_domain_id}.map",
+        "Exported 1 rules, 3 files changed",
+    ]
+    assert f'"{domain.names.first().name}/baz"' in exact_file.read_text()
+    assert maps_file.stat().st_mtime_ns == modified
+
+
+@pytest.mark.django_db
+def test_command_reports_skipped_rules(tmp_path, domain, redirect_rule_factory):
+    rule = redirect_rule_factory(domain=domain, path="Ä")
+    err = StringIO()
+
+    call_command("export_nginx_maps", str(tmp_path), stdout=StringIO(), stderr=err)
+
+    assert err.getvalue().strip() == (
+        f"Can't express rule {rule.id} (/Ä) in nginx: a case-insensitive path with "
+        f"non-ASCII characters, domain {domain.id} left to the application"
+    )
+    assert not os.path.exists(tmp_path / f"exact/domain-{domain.id}.map")
@@ -0,0 +1,94 @@
+"""
+Guards against performance regressions on the redirect path: an extra query per
+request, or a lookup query the planner can no longer answer from an index.
+"""
+
+import json
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from redirect.benchmark import SCENARIOS, SyntheticRuleset
+
+# Tables a lookup must never scan sequentially, as they grow with the ruleset
+INDEXED_TABLES = {"redirect_redirectrule", "redirect_domainname"}
+
+# Queries per request when resolving with the database instead of the routing table
+MAX_DATABASE_QUERIES = {
+    "exact": 1,
+    "case_insensitive": 1,
+    "wildcard": 1,
+    "miss": 1,
+    "unknown_host": 1,
+}
+
+
+@pytest.fixture
+def ruleset(db):
+    # Large enough for the planner to prefer indexes over scanning small tables
+    ruleset = SyntheticRuleset(domain_count=500, rule_count=10000)
+    ruleset.create()
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {', '.join(sorted(INDEXED_TABLES))}")
+    return ruleset
+
+
+def _get(client, ruleset, scenario):
+    host, path = ruleset.requests(scenario, 1)[0]
+    response = client.get(path, HTTP_HOST=host)
+    if scenario in ("miss", "unknown_host"):
+        assert response.status_code == 404
+    else:
+        assert response.status_code in (301, 302)
+
+
+def _plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def _sequential_scans(sql: str) -> set[str]:
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+        (explained,) = cursor.fetchone()
+    if isinstance(explained, str):
+        explained = json.loads(explained)
+    return {
+        node["Relation Name"]
+        for node in _plan_nodes(explained[0]["Plan"])
+        if node["Node Type"] == "Seq Scan"
+    }
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_database_resolver_queries(
+    settings, client, ruleset, django_assert_max_num_queries, scenario
+):
+    settings.REDIRECT_ROUTING_TABLE = False
+
+    with django_assert_max_num_queries(MAX_DATABASE_QUERIES[scenario]):
+        _get(client, ruleset, scenario)
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_routing_table_queries(client, ruleset, django_assert_num_queries, scenario):
+    # Loads the routing table
+    _get(client, ruleset, "exact")
+
+    with django_assert_num_queries(0):
+        _get(client, ruleset, scenario)
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_lookup_query_plans(settings, client, ruleset, scenario):
+    settings.REDIRECT_ROUTING_TABLE = False
+
+    with CaptureQueriesContext(connection) as queries:
+        _get(client, ruleset, scenario)
+
+    assert queries.captured_queries
+    for query in queries.captured_queries:
+        scanned = _sequential_scans(query["sql"]) & INDEXED_TABLES
+        assert not scanned, f"Sequential scan on {scanned}: {query['sql']}"
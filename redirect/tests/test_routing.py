@@ -0,0 +1,457 @@
+import asyncio
+import gc
+import tracemalloc
+from functools import partial
+from unittest.mock import Mock
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.exceptions import DisallowedRedirect
+
+from redirect import routing
+from redirect.models import DomainName, RulesetGeneration
+from redirect.routing import (
+    CompiledRule,
+    DomainRoutes,
+    HostIndex,
+    RoutingTable,
+    aget_routing_table,
+    get_routing_table,
+    normalize_host,
+    pack_flags,
+)
+from redirect.tests.conftest import rule_row
+
+# Rule rows for domain 1
+_rule = partial(rule_row, 1)
+
+
+def _compiled_rule(rule_id, path, **kwargs):
+    _domain_id, rule_id, path, destination, *flags, max_age = _rule(
+        rule_id, path, **kwargs
+    )
+    return CompiledRule(rule_id, path, destination, pack_flags(*flags), max_age=max_age)
+
+
+def _table(*rules):
+    return RoutingTable.from_rows(
+        [("example.test", 1, None), ("www.example.test", 1, None)], rules
+    )
+
+
+def _resolved_id(table, path, host="example.test"):
+    rule = table.resolve(host, path)
+    return rule.id if rule else None
+
+
+def test_resolve_unknown_host():
+    table = _table(_rule(1, "foo"))
+
+    assert table.resolve("unknown.test", "foo") is None
+
+
+def test_resolve_all_domain_names():
+    table = _table(_rule(1, "foo"))
+
+    assert _resolved_id(table, "foo") == 1
+    assert _resolved_id(table, "foo", host="www.example.test") == 1
+
+
+@pytest.mark.parametrize("path", ["foo", "/foo", "foo/", "/foo/"])
+def test_resolve_ignores_leading_and_trailing_slashes(path):
+    table = _table(_rule(1, "foo"))
+
+    assert _resolved_id(table, path) == 1
+
+
+def test_resolve_case_sensitive_takes_precedence():
+    table = _table(
+        _rule(1, "Foo", case_sensitive=True),
+        _rule(2, "foo", case_sensitive=False),
+    )
+
+    assert _resolved_id(table, "Foo") == 1
+    assert _resolved_id(table, "FOO") == 2
+    assert _resolved_id(table, "foo") == 2
+
+
+def test_resolve_case_sensitive_no_match():
+    table = _table(_rule(1, "foo", case_sensitive=True))
+
+    assert _resolved_id(table, "FOO") is None
+
+
+def test_resolve_exact_takes_precedence_over_wildcard():
+    table = _table(_rule(1, "foo", match_subpaths=True), _rule(2, "foo/bar"))
+
+    assert _resolved_id(table, "foo/bar") == 2
+    assert _resolved_id(table, "foo/baz") == 1
+    assert _resolved_id(table, "foo") == 1
+
+
+@pytest.mark.parametrize(
+    "rule_path, find_path",
+    [
+        ("foo", "bar"),
+        ("fooooooo", "foo"),
+        ("foo", "fooooooo"),
+        ("foo", "fooooooo/bar"),
+        ("foo/foo", "foo"),
+    ],
+)
+def test_resolve_wildcard_no_match(rule_path, find_path):
+    table = _table(_rule(1, rule_path, match_subpaths=True))
+
+    assert _resolved_id(table, find_path) is None
+
+
+def test_resolve_wildcard_case_sensitivity():
+    table = _table(
+        _rule(1, "Foo", match_subpaths=True, case_sensitive=True),
+        _rule(2, "bar", match_subpaths=True),
+    )
+
+    assert _resolved_id(table, "Foo/x") == 1
+    assert _resolved_id(table, "foo/x") is None
+    assert _resolved_id(table, "BAR/x") == 2
+
+
+@pytest.mark.parametrize("path", ["", "myon", "myon/myon/myon/myon/myon/myon"])
+def test_resolve_empty_wildcard_path(path):
+    table = _table(_rule(1, "", match_subpaths=True))
+
+    assert _resolved_id(table, path) == 1
+
+
+def test_rules_of_domain_without_names_are_ignored():
+    table = RoutingTable.from_rows([], [_rule(1, "foo")])
+
+    assert len(table.hosts) == 0
+
+
+def test_compiled_rule_precomputes_response():
+    rule = _compiled_rule(1, "foo", destination="https://dest.test/ä ö")
+
+    assert rule.location == "https://dest.test/%C3%A4%20%C3%B6"
+    assert rule.status == 302
+    assert _compiled_rule(1, "foo", permanent=True).status == 301
+
+
+@pytest.mark.parametrize(
+    "rule_kwargs, path, query_string, expected",
+    [
+        ({}, "foo", "a=1", "https://dest.test/"),
+        (
+            {"pass_query_string": True},
+            "foo",
+            "a=1&b=ä",
+            "https://dest.test/?a=1&b=%C3%A4",
+        ),
+        ({"pass_query_string": True}, "foo", "", "https://dest.test/"),
+        ({"match_subpaths": True}, "foo/bar", "", "https://dest.test/"),
+        (
+            {"match_subpaths": True, "append_subpath": True},
+            "foo/bar/baz",
+            "",
+            "https://dest.test/bar/baz",
+        ),
+        (
+            {"match_subpaths": True, "append_subpath": True, "pass_query_string": True},
+            "foo/bär",
+            "a=1",
+            "https://dest.test/b%C3%A4r?a=1",
+        ),
+    ],
+)
+def test_compiled_rule_location_for(rule_kwargs, path, query_string, expected):
+    rule = _compiled_rule(1, "foo", destination="https://dest.test/", **rule_kwargs)
+
+    assert rule.location_for(path, query_string) == expected
+
+
+def test_compiled_rule_rejects_unsafe_subpath():
+    rule = _compiled_rule(
+        1,
+        "",
+        destination="https://dest.test/",
+        match_subpaths=True,
+        append_subpath=True,
+    )
+
+    with pytest.raises(DisallowedRedirect):
+        rule.location_for("javascript:alert(1)")
+
+
+def test_rules_with_unsafe_destination_are_skipped():
+    table = _table(
+        _rule(1, "foo", destination="javascript:alert(1)"),
+        _rule(2, "bar"),
+    )
+
+    assert _resolved_id(table, "foo") is None
+    assert _resolved_id(table, "bar") == 2
+
+
+@pytest.mark.parametrize(
+    "host, expected",
+    [
+        ("example.test", "example.test"),
+        ("Example.TEST", "example.test"),
+        ("example.test:8000", "example.test"),
+        ("example.test.", "example.test"),
+        ("localhost:8000", "localhost"),
+        ("[::1]:8000", "[::1]"),
+        ("Bücher.example:443", "xn--bcher-kva.example"),
+        ("xn--bcher-kva.example", "xn--bcher-kva.example"),
+    ],
+)
+def test_normalize_host(host, expected):
+    assert normalize_host(host) == expected
+
+
+@pytest.mark.parametrize(
+    "host", ["EXAMPLE.test", "example.test:8000", "bücher.example", "BÜCHER.example:80"]
+)
+def test_resolve_normalizes_host(host):
+    table = RoutingTable.from_rows(
+        [("example.test", 1, None), ("xn--bcher-kva.example", 1, None)],
+        [_rule(1, "foo")],
+    )
+
+    assert _resolved_id(table, "foo", host=normalize_host(host)) == 1
+    assert _resolved_id(table, "foo", host=host) == 1
+
+
+def test_resolve_normalizes_domain_names():
+    table = RoutingTable.from_rows(
+        [("Bücher.Example:8000", 1, None)], [_rule(1, "foo")]
+    )
+
+    assert _resolved_id(table, "foo", host="xn--bcher-kva.example") == 1
+
+
+def test_host_index_caches_unknown_hosts():
+    routes = DomainRoutes()
+    index = HostIndex({"example.test": routes}, max_unknown=2)
+
+    assert index.get("unknown.test") is None
+    assert "unknown.test" in index.unknown
+    assert index.get("Example.test") is routes
+    assert "Example.test" not in index.unknown
+
+
+def test_host_index_negative_cache_is_bounded():
+    index = HostIndex({}, max_unknown=2)
+
+    for host in ["a.test", "b.test", "c.test"]:
+        index.get(host)
+
+    assert list(index.unknown) == ["b.test", "c.test"]
+
+
+def test_host_index_negative_cache_can_be_disabled():
+    index = HostIndex({}, max_unknown=0)
+
+    index.get("unknown.test")
+
+    assert len(index.unknown) == 0
+
+
+@pytest.mark.django_db
+def test_build_from_database(domain_factory, redirect_rule_factory):
+    domain = domain_factory(names=["acme.test", "www.acme.test"])
+    rule = redirect_rule_factory(domain=domain, path="foo", permanent=True)
+
+    table = RoutingTable.build()
+
+    compiled = table.resolve("www.acme.test", "/foo")
+    assert compiled.id == rule.id
+    assert compiled.destination == rule.destination
+    assert compiled.permanent is True
+
+
+@pytest.mark.django_db
+def test_get_routing_table_is_reused(domain):
+    assert get_routing_table() is get_routing_table()
+
+
+@pytest.mark.django_db
+def test_get_routing_table_is_rebuilt_after_generation_change(domain, settings):
+    settings.REDIRECT_RULESET_CHECK_INTERVAL = 0
+    table = get_routing_table()
+
+    RulesetGeneration.bump()
+
+    new_table = get_routing_table()
+    assert new_table is not table
+    assert new_table.generation == table.generation + 1
+
+
+@pytest.mark.django_db
+def test_get_routing_table_checks_generation_once_per_interval(
+    domain, settings, django_assert_num_queries
+):
+    settings.REDIRECT_RULESET_CHECK_INTERVAL = 60
+    table = get_routing_table()
+
+    # Changes made by other processes are not noticed before the interval has passed
+    RulesetGeneration.bump()
+    with django_assert_num_queries(0):
+        assert get_routing_table() is table
+
+    settings.REDIRECT_RULESET_CHECK_INTERVAL = 0
+    assert get_routing_table() is not table
+
+
+@pytest.mark.django_db
+def test_get_routing_table_is_not_rebuilt_if_generation_is_unchanged(
+    domain, settings, django_assert_num_queries
+):
+    settings.REDIRECT_RULESET_CHECK_INTERVAL = 0
+    table = get_routing_table()
+
+    # Only the generation is queried
+    with django_assert_num_queries(1):
+        assert get_routing_table() is table
+
+
+# The table is invalidated when the change is committed
+@pytest.mark.django_db(transaction=True)
+def test_get_routing_table_is_rebuilt_after_rule_change(domain, redirect_rule_factory):
+    table = get_routing_table()
+    assert table.resolve(domain.names.first().name, "foo") is None
+
+    redirect_rule_factory(domain=domain, path="foo")
+
+    new_table = get_routing_table()
+    assert new_table is not table
+    assert new_table.resolve(domain.names.first().name, "foo") is not None
+
+
+# The table is invalidated when the change is committed
+@pytest.mark.django_db(transaction=True)
+def test_get_routing_table_is_rebuilt_after_domain_name_delete(domain):
+    name = domain.names.first()
+    assert get_routing_table().hosts.get(name.name) is not None
+
+    name.delete()
+
+    assert routing._routing_table is None
+    assert get_routing_table().hosts.get(name.name) is None
+
+
+# The table is invalidated when the change is committed
+@pytest.mark.django_db(transaction=True)
+def test_get_routing_table_forgets_unknown_hosts_after_domain_name_change(domain):
+    assert get_routing_table().resolve("acme.test", "") is None
+    assert "acme.test" in get_routing_table().hosts.unknown
+
+    DomainName.objects.create(name="acme.test", domain=domain)
+
+    assert "acme.test" not in get_routing_table().hosts.unknown
+
+
+@pytest.mark.django_db
+def test_aget_routing_table_shares_refresh(domain, settings, monkeypatch):
+    settings.REDIRECT_RULESET_CHECK_INTERVAL = 60
+    build = Mock(wraps=RoutingTable.build)
+    monkeypatch.setattr(RoutingTable, "build", build)
+
+    async def get_concurrently():
+        return await asyncio.gather(*(aget_routing_table() for _ in range(10)))
+
+    tables = async_to_sync(get_concurrently)()
+
+    assert build.call_count == 1
+    assert all(table is tables[0] for table in tables)
+    assert async_to_sync(aget_routing_table)() is tables[0]
+
+
+@pytest.mark.django_db
+def test_aget_routing_table_is_rebuilt_after_generation_change(domain, settings):
+    settings.REDIRECT_RULESET_CHECK_INTERVAL = 0
+    table = async_to_sync(aget_routing_table)()
+    assert async_to_sync(aget_routing_table)() is table
+
+    RulesetGeneration.bump()
+
+    new_table = async_to_sync(aget_routing_table)()
+    assert new_table is not table
+    assert new_table.generation == table.generation + 1
+    # Shared with the sync code
+    assert get_routing_table() is new_table
+
+
+def test_compiled_rule_flags():
+    rule = _compiled_rule(
+        1, "foo", permanent=True, match_subpaths=True, case_sensitive=True
+    )
+
+    assert rule.permanent is True
+    assert rule.pass_query_string is False
+    assert rule.match_subpaths is True
+    assert rule.append_subpath is False
+    assert rule.case_sensitive is True
+    assert rule.status == 301
+
+
+def test_compiled_rule_shares_unencoded_destination():
+    rule = _compiled_rule(1, "foo", destination="https://dest.test/")
+
+    assert rule.location is rule.destination
+
+
+def test_build_shares_destinations():
+    table = _table(
+        _rule(1, "foo", destination="".join(["https://dest.test/", "ä"])),
+        _rule(2, "bar", destination="".join(["https://dest.test/", "ä"])),
+    )
+    foo = table.resolve("example.test", "foo")
+    bar = table.resolve("example.test", "bar")
+
+    assert foo.destination is bar.destination
+    assert foo.location is bar.location
+
+
+def _generated_rows(rule_count):
+    """
+    Rows resembling real rulesets: 100 rules per domain, a third of them with a
+    destination of their own.
+    """
+    domain_count = max(rule_count // 100, 1)
+    domain_names = ((f"www.domain-{i}.test", i, None) for i in range(domain_count))
+    rules = (
+        (
+            i % domain_count,
+            i,
+            f"palvelut/osio-{i % 500}/sivu-{i}",
+            "https://www.hel.fi/fi/" if i % 3 else f"https://www.hel.fi/fi/sivu-{i}",
+            i % 2 == 0,
+            i % 5 == 0,
+            i % 7 == 0,
+            i % 11 == 0,
+            i % 3 == 0,
+            None,
+        )
+        for i in range(rule_count)
+    )
+    return domain_names, rules
+
+
+@pytest.mark.parametrize(
+    "rule_count", [10_000, 100_000, pytest.param(1_000_000, marks=pytest.mark.slow)]
+)
+def test_memory_per_rule(rule_count):
+    domain_names, rules = _generated_rows(rule_count)
+    gc.collect()
+
+    tracemalloc.start()
+    try:
+        table = RoutingTable.from_rows(domain_names, rules)
+        gc.collect()
+        size, _peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert table.resolve("www.domain-0.test", "palvelut/osio-0/sivu-0") is not None
+    assert size / rule_count < 320
@@ -0,0 +1,198 @@
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+from redirect import rule_files
+from redirect.rule_files import RuleFileError, detect_format, read_domains
+
+TEST_DATA = Path(__file__).parent / "test_data/import_redirect_rules"
+
+
+def _read(contents: str, file_format: str) -> list[dict]:
+    return list(read_domains(io.BytesIO(contents.encode()), file_format))
+
+
+@pytest.mark.parametrize(
+    ("path", "expected"),
+    [
+        ("rules.json", "json"),
+        ("rules.JSONL", "jsonl"),
+        ("rules.ndjson", "jsonl"),
+        ("export/rules.csv", "csv"),
+        ("rules", "json"),
+    ],
+)
+def test_detect_format(path, expected):
+    assert detect_format(path) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+@pytest.mark.parametrize("path", sorted(TEST_DATA.glob("*.json")))
+def test_read_json(monkeypatch, path, chunk_size):
+    monkeypatch.setattr(rule_files, "CHUNK_SIZE", chunk_size)
+
+    with open(path, "rb") as file:
+        assert list(read_domains(file, "json")) == json.loads(path.read_text())
+
+
+def test_read_json_large_domain(monkeypatch):
+    monkeypatch.setattr(rule_files, "CHUNK_SIZE", 16)
+    items = [
+        {"domain_names": ["a.test"], "rules": []},
+        {
+            "domain_names": ["b.test"],
+            "rules": [
+                {"path": f"/{i}", "destination": "https://ä.test"} for i in range(1000)
+            ],
+        },
+        {"domain_names": ["c.test"], "rules": []},
+    ]
+
+    assert _read(json.dumps(items, indent=2), "json") == items
+
+
+@pytest.mark.parametrize("contents", ["[]", " \n[ ]\n", "\ufeff[]"])
+def test_read_json_empty(contents):
+    assert _read(contents, "json") == []
+
+
+@pytest.mark.parametrize(
+    ("contents", "message"),
+    [
+        ("", "Expected a JSON array of domains"),
+        ('{"domain_names": []}', "Expected a JSON array of domains"),
+        ("[", "Unexpected end of the JSON array"),
+        ('[{"rules": []}', "Unexpected end of the JSON array"),
+        ('[{"rules": []} {}]', "Expected , or ] at character 15"),
+        ('[{"rules": [}]', "Invalid JSON at character 12"),
+        ("[1]", "Expected a domain object at character 1"),
+    ],
+)
+def test_read_json_invalid(contents, message):
+    with pytest.raises(RuleFileError, match=message):
+        _read(contents, "json")
+
+
+def test_read_json_invalid_early_without_reading_the_rest(monkeypatch):
+    monkeypatch.setattr(rule_files, "CHUNK_SIZE", 1024)
+    item = json.dumps({"domain_names": ["a.test"], "rules": []})
+    file = io.BytesIO(
+        (
+            '[{"domain_names": ["a.test"],, "rules": []}, ' + ", ".join([item] * 100000)
+        ).encode()
+    )
+
+    with pytest.raises(RuleFileError, match="Invalid JSON at character 29"):
+        list(read_domains(file, "json"))
+
+    assert file.tell() < 16 * 1024
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 5])
+def test_read_json_values_cut_by_chunks(monkeypatch, chunk_size):
+    monkeypatch.setattr(rule_files, "CHUNK_SIZE", chunk_size)
+    items = [
+        {
+            "domain_names": ["a.test"],
+            "display_name": 'Ää \u00e4 "quoted"',
+            "rules": [{"path": "/", "permanent": False, "max_age": 12345, "x": None}],
+        }
+    ] * 3
+
+    assert _read(json.dumps(items), "json") == items
+    assert _read(json.dumps(items, ensure_ascii=False), "json") == items
+
+
+def test_read_json_lines():
+    assert _read(
+        '{"domain_names": ["a.test"], "rules": []}\n\n'
+        '{"domain_names": ["b.test"], "rules": [{"path": "/"}]}\n',
+        "jsonl",
+    ) == [
+        {"domain_names": ["a.test"], "rules": []},
+        {"domain_names": ["b.test"], "rules": [{"path": "/"}]},
+    ]
+
+
+@pytest.mark.parametrize(
+    ("contents", "message"),
+    [
+        ('{"domain_names": []}\n{', "Invalid JSON on line 2"),
+        ("[]", "Expected a domain object on line 1"),
+    ],
+)
+def test_read_json_lines_invalid(contents, message):
+    with pytest.raises(RuleFileError, match=message):
+        _read(contents, "jsonl")
+
+
+def test_read_csv():
+    contents = (
+        "domain_names,display_name,path,destination,permanent,match_subpaths,notes\r\n"
+        "acme.test www.acme.test,Acme,/foo,https://foo.test,true,,A note\r\n"
+        "acme.test www.acme.test,,/bar,https://bar.test,0,Yes,\r\n"
+        "other.test,,/,https://other.test,,,\r\n"
+    )
+
+    assert _read(contents, "csv") == [
+        {
+            "domain_names": ["acme.test", "www.acme.test"],
+            "display_name": "Acme",
+            "rules": [
+                {
+                    "path": "/foo",
+                    "destination": "https://foo.test",
+                    "permanent": True,
+                    "notes": "A note",
+                },
+                {
+                    "path": "/bar",
+                    "destination": "https://bar.test",
+                    "permanent": False,
+                    "match_subpaths": True,
+                },
+            ],
+        },
+        {
+            "domain_names": ["other.test"],
+            "rules": [{"path": "/", "destination": "https://other.test"}],
+        },
+    ]
+
+
+@pytest.mark.parametrize(
+    ("contents", "message"),
+    [
+        ("domain_names,path\n", "Missing CSV column\\(s\\): destination"),
+        (
+            "domain_names,path,destination,permanent\na.test,/,https://a.test,maybe\n",
+            "Invalid value 'maybe' for permanent on line 2",
+        ),
+    ],
+)
+def test_read_csv_invalid(contents, message):
+    with pytest.raises(RuleFileError, match=message):
+        _read(contents, "csv")
+
+
+def test_read_json_incrementally(monkeypatch):
+    monkeypatch.setattr(rule_files, "CHUNK_SIZE", 1024)
+    item = {"domain_names": ["a.test"], "rules": [{"path": "/", "destination": ""}]}
+    file = io.BytesIO(json.dumps([item] * 10000).encode())
+
+    domains = read_domains(file, "json")
+
+    assert next(domains) == item
+    assert file.tell() < 16 * 1024
+    assert sum(1 for _ in domains) == 9999
+
+
+def test_read_leaves_file_open():
+    file = io.BytesIO(b'[{"domain_names": ["a.test"], "rules": []}]')
+
+    list(read_domains(file, "json"))
+
+    assert not file.closed
+    assert file.tell() == len(file.getvalue())
@@ -0,0 +1,186 @@
+import io
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from redirect.models import RulesetGeneration
+from redirect.routing import RoutingTable, get_routing_table
+from redirect.snapshot import (
+    RulesetSnapshot,
+    SnapshotError,
+    open_current_snapshot,
+    write_snapshot,
+)
+from redirect.tests.conftest import rule_row
+
+DOMAIN_NAMES = [
+    ("example.test", 1, None),
+    ("WWW.Example.test", 1, None),
+    ("bücher.test", 2, 30),
+    ("nameless.test", 3, None),
+]
+
+
+RULES = [
+    rule_row(1, 1, "Foo", case_sensitive=True),
+    rule_row(1, 2, "foo/bar", permanent=True),
+    rule_row(1, 3, "foo", match_subpaths=True, append_subpath=True),
+    rule_row(1, 4, "Lorem", case_sensitive=True, match_subpaths=True),
+    rule_row(1, 5, "", match_subpaths=True, pass_query_string=True),
+    rule_row(1, 6, "ääkköset", destination="https://dest.test/ö"),
+    rule_row(1, 7, "unsafe", destination="javascript:alert(1)"),
+    rule_row(2, 8, "Foo"),
+    rule_row(2, 10, "cached", max_age=600),
+    rule_row(4, 9, "unreachable"),
+]
+
+
+def _snapshot(domain_names=DOMAIN_NAMES, rules=RULES, generation=0):
+    file = io.BytesIO()
+    write_snapshot(file, domain_names, rules, generation)
+    return RulesetSnapshot(file.getvalue())
+
+
+@pytest.mark.parametrize(
+    "host",
+    ["example.test", "www.example.test", "EXAMPLE.test:8000", "xn--bcher-kva.test"],
+)
+@pytest.mark.parametrize(
+    "path",
+    [
+        "",
+        "/",
+        "Foo",
+        "foo",
+        "FOO/",
+        "foo/bar",
+        "Foo/Bar",
+        "foo/baz/qux",
+        "Lorem/ipsum",
+        "lorem/ipsum",
+        "ÄÄKKÖSET",
+        "unsafe",
+        "unreachable",
+        "cached",
+        "other/path",
+    ],
+)
+def test_resolves_like_routing_table(host, path):
+    table = RoutingTable.from_rows(DOMAIN_NAMES, RULES)
+
+    assert _snapshot().resolve(host, path) == table.resolve(host, path)
+
+
+@pytest.mark.parametrize(
+    "host", ["example.test", "xn--bcher-kva.test", "Bücher.test", "unknown.test"]
+)
+def test_not_found_cache_control_like_routing_table(settings, host):
+    settings.REDIRECT_NOT_FOUND_MAX_AGE = 10
+    table = RoutingTable.from_rows(DOMAIN_NAMES, RULES)
+
+    assert _snapshot().not_found_cache_control(host) == (
+        table.not_found_cache_control(host)
+    )
+
+
+def test_unknown_host():
+    assert _snapshot().resolve("unknown.test", "foo") is None
+
+
+def test_empty_snapshot():
+    snapshot = _snapshot([], [], generation=3)
+
+    assert snapshot.generation == 3
+    assert len(snapshot) == 0
+    assert snapshot.resolve("example.test", "") is None
+
+
+def test_compiled_rules_are_reused():
+    snapshot = _snapshot()
+
+    assert snapshot.resolve("example.test", "Foo") is snapshot.resolve(
+        "example.test", "Foo"
+    )
+
+
+def test_strings_are_stored_once_and_sorted():
+    snapshot = _snapshot()
+    offsets = snapshot.string_offsets
+    strings = [
+        bytes(snapshot.string_data[offsets[number] : offsets[number + 1]])
+        for number in range(len(offsets) - 1)
+    ]
+
+    assert strings == sorted(set(strings))
+    assert b"foo" in strings
+
+
+@pytest.mark.parametrize("data", [b"", b"not a snapshot", b"TIRSNAP2" + bytes(8)])
+def test_rejects_invalid_data(data):
+    with pytest.raises(SnapshotError):
+        RulesetSnapshot(data)
+
+
+@pytest.mark.django_db
+class TestOpenCurrentSnapshot:
+    @pytest.fixture
+    def path(self, tmp_path):
+        return tmp_path / "ruleset.snapshot"
+
+    def test_compiles_missing_snapshot(self, path, domain, redirect_rule_factory):
+        rule = redirect_rule_factory(domain=domain, path="foo")
+
+        snapshot = open_current_snapshot(path)
+
+        assert path.exists()
+        assert snapshot.generation == RulesetGeneration.current()
+        assert snapshot.resolve(domain.names.first().name, "foo").id == rule.id
+
+    def test_reuses_current_snapshot(self, path, domain):
+        open_current_snapshot(path)
+        modified = path.stat().st_mtime_ns
+
+        open_current_snapshot(path)
+
+        assert path.stat().st_mtime_ns == modified
+
+    # The rule is added in a transaction of its own
+    @pytest.mark.django_db(transaction=True)
+    def test_recompiles_outdated_snapshot(self, path, domain, redirect_rule_factory):
+        snapshot = open_current_snapshot(path)
+
+        rule = redirect_rule_factory(domain=domain, path="foo")
+
+        new_snapshot = open_current_snapshot(path)
+        assert new_snapshot.generation > snapshot.generation
+        assert new_snapshot.resolve(domain.names.first().name, "foo").id == rule.id
+        # The old mapping stays usable
+        assert snapshot.resolve(domain.names.first().name, "foo") is None
+
+    def test_recompiles_invalid_file(self, path, domain):
+        path.write_bytes(b"garbage")
+
+        assert open_current_snapshot(path).generation == RulesetGeneration.current()
+
+    def test_used_by_get_routing_table(self, settings, path, domain):
+        settings.REDIRECT_RULESET_SNAPSHOT = str(path)
+
+        assert isinstance(get_routing_table(), RulesetSnapshot)
+
+    def test_get_routing_table_falls_back_to_building(self, settings, tmp_path, domain):
+        settings.REDIRECT_RULESET_SNAPSHOT = str(tmp_path / "missing" / "snapshot")
+
+        assert isinstance(get_routing_table(), RoutingTable)
+
+
+@pytest.mark.django_db
+def test_compile_ruleset_snapshot_command(tmp_path, domain, redirect_rule_factory):
+    redirect_rule_factory(domain=domain, path="foo")
+    path = tmp_path / "ruleset.snapshot"
+    out = StringIO()
+
+    call_command("compile_ruleset_snapshot", str(path), stdout=out)
+
+    assert "Wrote 1 rules" in out.getvalue()
+    assert RulesetSnapshot.open(path).resolve(domain.names.first().name, "foo")
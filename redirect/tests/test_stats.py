@@ -0,0 +1,172 @@
+import time
+from datetime import UTC, datetime
+from unittest.mock import Mock
+
+import pytest
+from django.contrib.admin import AdminSite
+from django.db import DatabaseError
+from django.test import RequestFactory
+
+from redirect import stats
+from redirect.admin import RedirectRuleAdmin
+from redirect.models import RedirectRule, RedirectRuleStats, RulesetGeneration
+from redirect.stats import HitCounter, write_hits
+
+
+@pytest.fixture
+def hit_counter(monkeypatch):
+    hit_counter = HitCounter()
+    # Flushed by the tests instead of a thread
+    hit_counter.thread = Mock()
+    hit_counter.flush_hits = 1000
+    monkeypatch.setattr(stats, "hit_counter", hit_counter)
+    return hit_counter
+
+
+@pytest.mark.django_db
+def test_write_hits(domain, redirect_rule_factory):
+    rule = redirect_rule_factory(domain=domain)
+    other_rule = redirect_rule_factory(domain=domain)
+    updated_at = rule.updated_at
+    generation = RulesetGeneration.current()
+
+    write_hits({rule.id: [2, 1000.0], other_rule.id: [1, 1000.0]})
+    write_hits({rule.id: [3, 2000.0], other_rule.id: [1, 500.0]})
+
+    rule_stats = RedirectRuleStats.objects.get(rule=rule)
+    assert rule_stats.hits == 5
+    assert rule_stats.last_hit_at == datetime.fromtimestamp(2000, UTC)
+    other_stats = RedirectRuleStats.objects.get(rule=other_rule)
+    assert other_stats.hits == 2
+    assert other_stats.last_hit_at == datetime.fromtimestamp(1000, UTC)
+    # The rules themselves are left alone
+    rule.refresh_from_db()
+    assert rule.updated_at == updated_at
+    assert RulesetGeneration.current() == generation
+
+
+@pytest.mark.django_db
+def test_write_hits_skips_deleted_rules(redirect_rule_factory):
+    rule = redirect_rule_factory()
+
+    write_hits({rule.id: [1, 1000.0], rule.id + 1000: [1, 1000.0]})
+
+    assert list(RedirectRuleStats.objects.values_list("rule_id", "hits")) == [
+        (rule.id, 1)
+    ]
+
+
+@pytest.mark.django_db
+def test_flush(hit_counter, redirect_rule_factory):
+    rule = redirect_rule_factory()
+
+    hit_counter.record(rule.id)
+    hit_counter.record(rule.id)
+    hit_counter.flush()
+    hit_counter.flush()
+
+    assert RedirectRuleStats.objects.get(rule=rule).hits == 2
+    assert hit_counter.hits == {}
+    assert hit_counter.pending == 0
+
+
+def test_flush_failure_keeps_hits(hit_counter, monkeypatch):
+    monkeypatch.setattr(stats, "write_hits", Mock(side_effect=DatabaseError))
+    hit_counter.record(1)
+    hit_counter.record(1)
+    last_hit = hit_counter.hits[1][1]
+
+    with pytest.raises(DatabaseError):
+        hit_counter.flush()
+    hit_counter.record(1)
+
+    assert hit_counter.hits[1][0] == 3
+    assert hit_counter.hits[1][1] >= last_hit
+    assert hit_counter.pending == 3
+
+
+def test_flush_after_hits(hit_counter):
+    hit_counter.flush_hits = 2
+
+    hit_counter.record(1)
+    assert not hit_counter.wakeup.is_set()
+    hit_counter.record(2)
+
+    assert hit_counter.wakeup.is_set()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_background_flush(settings, monkeypatch, redirect_rule_factory):
+    settings.REDIRECT_RULE_STATS_FLUSH_HITS = 2
+    hit_counter = HitCounter()
+    monkeypatch.setattr(stats, "hit_counter", hit_counter)
+    rule = redirect_rule_factory()
+
+    hit_counter.record(rule.id)
+    hit_counter.record(rule.id)
+
+    deadline = time.monotonic() + 10
+    while not RedirectRuleStats.objects.filter(rule=rule).exists():
+        assert time.monotonic() < deadline, "Hits were not flushed"
+        time.sleep(0.01)
+    assert RedirectRuleStats.objects.get(rule=rule).hits == 2
+
+
+def test_reset_after_fork(hit_counter):
+    hit_counter.record(1)
+
+    hit_counter._reset()
+
+    assert hit_counter.hits == {}
+    assert hit_counter.thread is None
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("enabled", [True, False])
+def test_redirect_counts_hits(settings, client, hit_counter, host, domain, enabled):
+    settings.REDIRECT_RULE_STATS = enabled
+    rule = domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+    client.get("/foo", HTTP_HOST=host)
+    client.get("/bar", HTTP_HOST=host)
+
+    assert list(hit_counter.hits) == ([rule.id] if enabled else [])
+
+
+@pytest.mark.django_db
+class TestRedirectRuleAdmin:
+    @pytest.fixture
+    def model_admin(self):
+        return RedirectRuleAdmin(RedirectRule, AdminSite())
+
+    def test_hits(self, model_admin, redirect_rule_factory):
+        rule = redirect_rule_factory()
+        unused_rule = redirect_rule_factory()
+        write_hits({rule.id: [3, 1000.0]})
+
+        rules = {
+            obj.id: obj for obj in model_admin.get_queryset(RequestFactory().get("/"))
+        }
+
+        assert model_admin.hits(rules[rule.id]) == 3
+        assert model_admin.last_hit_at(rules[rule.id]) == datetime.fromtimestamp(
+            1000, UTC
+        )
+        assert model_admin.hits(rules[unused_rule.id]) == 0
+        assert model_admin.last_hit_at(rules[unused_rule.id]) is None
+
+    @pytest.mark.parametrize("column", ["hits", "last_hit_at"])
+    def test_sort(self, admin_client, redirect_rule_factory, column):
+        rules = [redirect_rule_factory() for _ in range(3)]
+        write_hits({rules[1].id: [5, 2000.0], rules[2].id: [1, 1000.0]})
+        # The action checkbox comes first
+        index = RedirectRuleAdmin.list_display.index(column) + 1
+
+        response = admin_client.get("/admin/redirect/redirectrule/", {"o": f"-{index}"})
+
+        assert response.status_code == 200
+        assert [rule.id for rule in response.context["cl"].result_list] == [
+            rules[1].id,
+            rules[2].id,
+            rules[0].id,
+        ]
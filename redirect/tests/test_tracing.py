@@ -0,0 +1,123 @@
+import json
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import AsyncRequestFactory, RequestFactory
+
+from redirect.tracing import atraced_redirect, traced_redirect
+
+SECRET = "s3cret"  # noqa: S105
+
+
+@pytest.fixture(autouse=True)
+def debug_secret(settings):
+    settings.REDIRECT_DEBUG_SECRET = SECRET
+
+
+def _phases(response) -> list[str]:
+    return [timing.split(";")[0] for timing in response["Server-Timing"].split(", ")]
+
+
+def _get(host, path, secret=SECRET):
+    headers = {"host": host}
+    if secret is not None:
+        headers["x-redirect-debug"] = secret
+    request = RequestFactory().get(f"/{path}", headers=headers)
+    return traced_redirect(request, path)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    ("path", "match", "phases"),
+    [
+        ("exact", "exact", ["table", "host", "exact"]),
+        ("CI", "case_insensitive", ["table", "host", "exact", "case_insensitive"]),
+        (
+            "wild/card",
+            "wildcard",
+            ["table", "host", "exact", "case_insensitive", "wildcard"],
+        ),
+    ],
+)
+def test_debug_headers(routing_table, host, domain, path, match, phases):
+    rules = {
+        "exact": domain.redirect_rules.create(
+            path="exact", destination="https://acme.test/", case_sensitive=True
+        ),
+        "case_insensitive": domain.redirect_rules.create(
+            path="ci", destination="https://acme.test/"
+        ),
+        "wildcard": domain.redirect_rules.create(
+            path="wild", destination="https://acme.test/", match_subpaths=True
+        ),
+    }
+
+    response = _get(host, path)
+
+    assert response.status_code == 302
+    assert response["Location"] == "https://acme.test/"
+    assert response["X-Redirect-Rule"] == str(rules[match].id)
+    assert response["X-Redirect-Match"] == match
+    assert _phases(response) == [*(phases if routing_table else ["database"]), "total"]
+    assert all(
+        float(timing.split("dur=")[1]) >= 0
+        for timing in response["Server-Timing"].split(", ")
+    )
+
+
+@pytest.mark.django_db
+def test_not_found(routing_table, host, domain):
+    response = _get(host, "missing")
+
+    assert response.status_code == 404
+    assert "X-Redirect-Rule" not in response
+    assert response["X-Redirect-Match"] == "not_found"
+
+
+@pytest.mark.django_db
+def test_unknown_host(domain):
+    response = _get("unknown.test", "foo")
+
+    assert response.status_code == 404
+    assert json.loads(response.content) == {"detail": "Not Found"}
+    assert response["X-Redirect-Match"] == "unknown_host"
+    assert _phases(response) == ["table", "host", "total"]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("secret", [None, "wrong"])
+def test_without_secret(host, domain, secret):
+    domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+    response = _get(host, "foo", secret)
+
+    assert response.status_code == 302
+    assert "Server-Timing" not in response
+    assert "X-Redirect-Rule" not in response
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async(host, domain):
+    rule = domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+    request = AsyncRequestFactory().get("/foo", headers={"x-redirect-debug": SECRET})
+    request.META["HTTP_HOST"] = host
+
+    response = async_to_sync(atraced_redirect)(request, "foo")
+
+    assert response.status_code == 302
+    assert response["X-Redirect-Rule"] == str(rule.id)
+
+
+@pytest.fixture
+def urls_with_debug_secret(reload_urls):
+    reload_urls()
+
+
+@pytest.mark.django_db
+def test_url_conf(client, urls_with_debug_secret, host, domain):
+    domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+    response = client.get("/foo", HTTP_HOST=host, HTTP_X_REDIRECT_DEBUG=SECRET)
+
+    assert response.status_code == 302
+    assert response["X-Redirect-Match"] == "case_insensitive"
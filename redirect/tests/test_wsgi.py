@@ -0,0 +1,197 @@
+from unittest.mock import Mock
+
+import pytest
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import DatabaseError
+from django.test import RequestFactory
+
+from redirect import routing, wsgi
+from redirect.tests.conftest import Server
+from redirect.wsgi import RedirectApplication
+
+pytestmark = pytest.mark.usefixtures("keep_connections")
+
+
+class FakeDjangoApplication:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, environ, start_response):
+        self.calls += 1
+        start_response("200 OK", [])
+        return [b"django"]
+
+
+class StartResponse:
+    def __call__(self, status, headers):
+        self.status = status
+        self.headers = dict(headers)
+
+
+@pytest.fixture
+def server():
+    return Server(wsgi, RedirectApplication, FakeDjangoApplication)
+
+
+def _call(application, path, method="get", **extra):
+    environ = getattr(RequestFactory(), method)(path, **extra).environ
+    # WSGIRequest stores the decoded path in the environ, undo that to get what a
+    # WSGI server would pass, i.e. the raw bytes decoded as ISO-8859-1
+    environ["PATH_INFO"] = environ["PATH_INFO"].encode().decode("iso-8859-1")
+    start_response = StartResponse()
+    body = b"".join(application(environ, start_response))
+    return start_response, body
+
+
+@pytest.mark.django_db
+class TestRedirectApplication:
+    def test_redirect(self, application, django_application, host, domain):
+        domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+        response, body = _call(application, "/foo/", HTTP_HOST=host)
+
+        assert response.status == "302 Found"
+        assert response.headers["Location"] == "https://acme.test/"
+        assert response.headers["Content-Length"] == "0"
+        assert body == b""
+        assert django_application.calls == 0
+
+    def test_permanent_redirect_with_subpath_and_query_string(
+        self, application, host, domain
+    ):
+        domain.redirect_rules.create(
+            path="foo",
+            destination="https://acme.test/",
+            permanent=True,
+            match_subpaths=True,
+            append_subpath=True,
+            pass_query_string=True,
+        )
+
+        response, _ = _call(application, "/foo/bär?a=1", HTTP_HOST=host)
+
+        assert response.status == "301 Moved Permanently"
+        assert response.headers["Location"] == "https://acme.test/b%C3%A4r?a=1"
+
+    def test_root_path(self, application, host, domain):
+        domain.redirect_rules.create(path="", destination="https://acme.test/")
+
+        response, _ = _call(application, "/", HTTP_HOST=host)
+
+        assert response.headers["Location"] == "https://acme.test/"
+
+    @pytest.mark.parametrize(
+        "path", ["/__healthz", "/__readiness", "/admin/", "/admin/login/"]
+    )
+    def test_reserved_paths_fall_through(
+        self, settings, django_application, host, domain, path
+    ):
+        settings.ENABLE_ADMIN_APP = True
+        settings.ADMIN_URL = "admin"
+        domain.redirect_rules.create(
+            path="", destination="https://acme.test/", match_subpaths=True
+        )
+
+        response, body = _call(
+            RedirectApplication(django_application), path, HTTP_HOST=host
+        )
+
+        assert body == b"django"
+        assert django_application.calls == 1
+
+    def test_no_match_falls_through(self, application, django_application, host):
+        _, body = _call(application, "/foo", HTTP_HOST=host)
+
+        assert body == b"django"
+
+    def test_unknown_host_falls_through(self, application, django_application, domain):
+        domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+        _, body = _call(application, "/foo", HTTP_HOST="unknown.test")
+
+        assert body == b"django"
+
+    def test_debug_requests_fall_through(
+        self, settings, django_application, host, domain
+    ):
+        settings.REDIRECT_DEBUG_SECRET = "s3cret"  # noqa: S105
+        application = RedirectApplication(django_application)
+        domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+        _, body = _call(
+            application, "/foo", HTTP_HOST=host, HTTP_X_REDIRECT_DEBUG="anything"
+        )
+
+        assert body == b"django"
+
+    def test_disallowed_host_falls_through(
+        self, settings, application, django_application, host, domain
+    ):
+        settings.ALLOWED_HOSTS = ["other.test"]
+        domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+        _, body = _call(application, "/foo", HTTP_HOST=host)
+
+        assert body == b"django"
+
+    @pytest.mark.parametrize("method", ["post", "head", "options"])
+    def test_other_methods_fall_through(
+        self, application, django_application, host, domain, method
+    ):
+        domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+
+        _, body = _call(application, "/foo", method=method, HTTP_HOST=host)
+
+        assert django_application.calls == 1
+
+    def test_unsafe_subpath_falls_through(
+        self, application, django_application, host, domain
+    ):
+        domain.redirect_rules.create(
+            path="",
+            destination="https://acme.test/",
+            match_subpaths=True,
+            append_subpath=True,
+        )
+
+        _, body = _call(application, "/javascript:alert(1)", HTTP_HOST=host)
+
+        assert body == b"django"
+
+    def test_same_response_as_django(self, host, domain, client):
+        domain.redirect_rules.create(
+            path="foo",
+            destination="https://acme.test/",
+            pass_query_string=True,
+        )
+        application = RedirectApplication(WSGIHandler())
+
+        response, _ = _call(application, "/foo?a=b", HTTP_HOST=host)
+        django_response = client.get("/foo?a=b", HTTP_HOST=host)
+
+        assert response.status == f"302 {django_response.reason_phrase}"
+        assert response.headers["Location"] == django_response["Location"]
+        assert response.headers["Cache-Control"] == django_response["Cache-Control"]
+
+
+@pytest.mark.django_db
+def test_preload_routing_table(monkeypatch, domain):
+    monkeypatch.setattr(wsgi.connections, "close_all", Mock())
+    monkeypatch.setattr(wsgi.gc, "freeze", Mock())
+
+    wsgi.preload_routing_table()
+
+    assert routing._routing_table is not None
+    wsgi.connections.close_all.assert_called_once()
+    wsgi.gc.freeze.assert_called_once()
+
+
+def test_preload_routing_table_without_database(monkeypatch):
+    monkeypatch.setattr(wsgi.connections, "close_all", Mock())
+    monkeypatch.setattr(wsgi.gc, "freeze", Mock())
+    monkeypatch.setattr(wsgi, "get_routing_table", Mock(side_effect=DatabaseError))
+
+    wsgi.preload_routing_table()
+
+    wsgi.connections.close_all.assert_called_once()
+    wsgi.gc.freeze.assert_called_once()
@@ -0,0 +1,177 @@
+"""
+Debug headers describing how a redirect request was resolved.
+
+With `REDIRECT_DEBUG_SECRET` set, a request carrying it in the `X-Redirect-Debug`
+header is answered with:
+- `Server-Timing`: the duration of each step of the resolution, in milliseconds
+- `X-Redirect-Rule`: the id of the matched rule, if any
+- `X-Redirect-Match`: how the rule matched, or why nothing did, one of the
+  `redirect.metrics` outcomes
+
+Without the secret the URL conf routes requests to the regular views and the fast
+paths don't look for the header, so resolving costs nothing extra.
+"""
+
+import secrets
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.exception import response_for_exception
+from django.http import Http404
+from django.views.decorators.http import require_GET
+
+from redirect import metrics
+from redirect.api import (
+    RedirectRuleNotFound,
+    RuleRedirectResponse,
+    aredirect,
+    find_redirect_rule_or_404,
+    redirect,
+)
+from redirect.routing import (
+    CompiledRule,
+    DomainRoutes,
+    RoutingTable,
+    get_routing_table,
+    observe_resolution,
+    resolution_outcome,
+)
+
+DEBUG_HEADER = "X-Redirect-Debug"
+# The header as found in the WSGI environ and the ASGI scope
+DEBUG_HEADER_ENVIRON_KEY = "HTTP_X_REDIRECT_DEBUG"
+DEBUG_HEADER_SCOPE_NAME = b"x-redirect-debug"
+
+
+class ResolutionTrace:
+    """Durations of the steps taken to resolve a request, and their result."""
+
+    def __init__(self):
+        self.phases: list[tuple[str, float]] = []
+        self.rule: CompiledRule | None = None
+        self.outcome = metrics.NOT_FOUND
+        self.started_at = self.lapped_at = time.perf_counter()
+
+    def lap(self, phase: str):
+        """End a step of the resolution."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.lapped_at))
+        self.lapped_at = now
+
+    def found(self, rule: CompiledRule | None, path: str):
+        self.rule = rule
+        if rule is not None:
+            self.outcome = resolution_outcome(rule, path)
+
+    def apply(self, response):
+        """Add the debug headers to a response."""
+        phases = [*self.phases, ("total", time.perf_counter() - self.started_at)]
+        response["Server-Timing"] = ", ".join(
+            f"{phase};dur={seconds * 1000:.3f}" for phase, seconds in phases
+        )
+        if self.rule is not None:
+            response["X-Redirect-Rule"] = str(self.rule.id)
+        response["X-Redirect-Match"] = self.outcome
+        # Must not be served to anyone else from a cache
+        response["Cache-Control"] = "no-store"
+        return response
+
+
+def trace_routes(trace: ResolutionTrace, routes: DomainRoutes, path: str):
+    """`DomainRoutes.resolve`, timing each lookup."""
+    cleaned_path = path.strip("/")
+    rule = routes.exact.get(cleaned_path)
+    trace.lap("exact")
+    if rule is None:
+        lowered_path = cleaned_path.lower()
+        rule = routes.exact_ci.get(lowered_path)
+        trace.lap("case_insensitive")
+        if rule is None:
+            segments = cleaned_path.split("/") if cleaned_path else []
+            rule = routes.wildcard.find(segments) or routes.wildcard_ci.find(
+                [segment.lower() for segment in segments]
+            )
+            trace.lap("wildcard")
+    trace.found(rule, path)
+
+
+def trace_resolution(host: str, path: str) -> ResolutionTrace:
+    """Resolve a request like `resolve_redirect_rule_or_404`, timing each step."""
+    trace = ResolutionTrace()
+    if not settings.REDIRECT_ROUTING_TABLE:
+        # The domain and the rule are looked up in a single query
+        try:
+            rule = find_redirect_rule_or_404(host, path)
+        except Http404:
+            rule = None
+        else:
+            rule = CompiledRule.from_model(rule, rule.max_age)
+        trace.lap("database")
+        trace.found(rule, path)
+        return trace
+
+    table = get_routing_table()
+    trace.lap("table")
+    if not isinstance(table, RoutingTable):
+        # A snapshot resolves in one go
+        trace.found(table.resolve(host, path), path)
+        trace.lap("resolve")
+        if trace.rule is None and not table.knows_host(host):
+            trace.outcome = metrics.UNKNOWN_HOST
+        return trace
+
+    routes = table.hosts.get(host)
+    trace.lap("host")
+    if routes is None:
+        trace.outcome = metrics.UNKNOWN_HOST
+        return trace
+    trace_routes(trace, routes, path)
+    return trace
+
+
+def is_debug_request(request) -> bool:
+    """Whether a request carries the debug secret."""
+    secret = settings.REDIRECT_DEBUG_SECRET
+    provided = request.headers.get(DEBUG_HEADER)
+    return bool(secret and provided) and secrets.compare_digest(
+        provided.encode(), secret.encode()
+    )
+
+
+def _traced_response(
+    request, host: str, path: str, trace: ResolutionTrace, start: float
+):
+    if trace.rule is None:
+        observe_resolution(host, path, None, start)
+        # The Cache-Control header is replaced by the trace
+        response = response_for_exception(request, RedirectRuleNotFound("no-store"))
+    else:
+        rule = trace.rule
+        location = rule.location_for(path, request.META.get("QUERY_STRING", ""))
+        observe_resolution(host, path, rule, start)
+        response = RuleRedirectResponse(location, rule.status, rule.cache_control)
+    return trace.apply(response)
+
+
+@require_GET
+def traced_redirect(request, path: str = ""):
+    """`redirect`, adding the debug headers for requests carrying the debug secret."""
+    if not is_debug_request(request):
+        return redirect(request, path)
+    start = time.perf_counter()
+    host = request.get_host()
+    trace = trace_resolution(host, path)
+    return _traced_response(request, host, path, trace, start)
+
+
+@require_GET
+async def atraced_redirect(request, path: str = ""):
+    """Async version of `traced_redirect`."""
+    if not is_debug_request(request):
+        return await aredirect(request, path)
+    start = time.perf_counter()
+    host = request.get_host()
+    # Debug requests are rare enough not to need a separate async resolution
+    trace = await sync_to_async(trace_resolution)(host, path)
+    return _traced_response(request, host, path, trace, start)
@@ -0,0 +1,136 @@
+"""
+WSGI fast path for redirect traffic.
+
+Redirect-only pods don't need sessions, CSRF, authentication, messages or URL
+resolution to answer a 301. `RedirectApplication` wraps the regular Django WSGI
+application, answers requests that match a redirect rule straight from the routing
+table and passes everything else on to Django.
+
+Enable it with `REDIRECT_WSGI_FAST_PATH=True`, see `tirehtoori/wsgi.py`.
+"""
+
+import gc
+import logging
+import time
+from http import HTTPStatus
+
+from django.conf import settings
+from django.core.exceptions import DisallowedRedirect
+from django.core.handlers.wsgi import get_path_info
+from django.db import DatabaseError, close_old_connections, connections
+from django.http.request import split_domain_port, validate_host
+
+from redirect.routing import get_routing_table, observe_resolution
+from redirect.tracing import DEBUG_HEADER_ENVIRON_KEY
+
+logger = logging.getLogger(__name__)
+
+STATUS_LINES = {
+    status: f"{status} {HTTPStatus(status).phrase}"
+    for status in (HTTPStatus.MOVED_PERMANENTLY, HTTPStatus.FOUND)
+}
+
+
+def preload_routing_table():
+    """
+    Load the routing table before the uWSGI master forks the workers, so that they
+    start warm and share its memory.
+    """
+    try:
+        get_routing_table()
+    except DatabaseError:
+        # The workers load it on demand instead, readiness waits for that
+        logger.exception("Could not preload the routing table")
+    # The workers must not share the master's connection
+    connections.close_all()
+    # Keep garbage collection in the workers from writing to, and thereby copying,
+    # the pages holding the objects created so far
+    gc.freeze()
+
+
+def reserved_path_prefixes() -> tuple[str, ...]:
+    """Prefixes of paths that are never redirects, as Django's URL conf sees them."""
+    # Health checks and other service endpoints all start with "/__"
+    prefixes = ("/__",)
+    if settings.ENABLE_ADMIN_APP:
+        prefixes += (f"/{settings.ADMIN_URL}",)
+    return prefixes
+
+
+def is_allowed_host(host: str) -> bool:
+    """Check a host like `HttpRequest.get_host` does."""
+    domain, _port = split_domain_port(host)
+    return bool(domain) and validate_host(domain, settings.ALLOWED_HOSTS)
+
+
+class RedirectApplication:
+    def __init__(self, django_application):
+        self.django_application = django_application
+        self.reserved_prefixes = reserved_path_prefixes()
+        # Debug requests are left to the view adding the debug headers
+        self.debug_header = (
+            DEBUG_HEADER_ENVIRON_KEY if settings.REDIRECT_DEBUG_SECRET else None
+        )
+
+    def __call__(self, environ, start_response):
+        try:
+            response = self.respond(environ, start_response)
+        except DisallowedRedirect:
+            # Let Django produce the error response
+            response = None
+        finally:
+            # What Django does at the start and end of each request, so a connection
+            # used to check the ruleset generation doesn't outlive its welcome
+            close_old_connections()
+
+        if response is None:
+            return self.django_application(environ, start_response)
+        return response
+
+    def respond(self, environ, start_response) -> list[bytes] | None:
+        """Answer a redirect request, or return None to pass it on to Django."""
+        start = time.perf_counter()
+        if environ["REQUEST_METHOD"] != "GET":
+            return None
+
+        path = get_path_info(environ)
+        if path.startswith(self.reserved_prefixes):
+            return None
+        if self.debug_header is not None and self.debug_header in environ:
+            return None
+
+        host = self.get_host(environ)
+        if host is None:
+            return None
+
+        rule = get_routing_table().resolve(host, path)
+        if rule is None:
+            # Let Django render the 404, the view records the miss
+            return None
+
+        location = rule.location_for(path[1:], environ.get("QUERY_STRING", ""))
+        observe_resolution(host, path, rule, start)
+        start_response(
+            STATUS_LINES[rule.status],
+            [
+                ("Content-Type", "text/html; charset=utf-8"),
+                ("Location", location),
+                ("Cache-Control", rule.cache_control),
+                ("Content-Length", "0"),
+            ],
+        )
+        return [b""]
+
+    def get_host(self, environ) -> str | None:
+        """
+        Return the request host like `HttpRequest.get_host`, or None if it is not in
+        `ALLOWED_HOSTS`.
+        """
+        host = environ.get("HTTP_HOST")
+        if not host:
+            host = environ["SERVER_NAME"]
+            port = environ["SERVER_PORT"]
+            if port != ("443" if environ["wsgi.url_scheme"] == "https" else "80"):
+                host = f"{host}:{port}"
+
+        return host if is_allowed_host(host) else None
@@ -9,8 +9,18 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tirehtoori.settings")
+# Resolve redirects on the event loop instead of in a thread per request
+os.environ.setdefault("REDIRECT_ASYNC_VIEW", "True")
 
 application = get_asgi_application()
+
+if settings.REDIRECT_ASGI_FAST_PATH:
+    # Answer redirects on the event loop without going through the middleware stack,
+    # see redirect/asgi.py
+    from redirect.asgi import RedirectASGIApplication
+
+    application = RedirectASGIApplication(application)
@@ -36,6 +36,27 @@ env = environ.Env(
     ENABLE_REDIRECT_APP=(bool, False),
     ENABLE_ADMIN_APP=(bool, False),
     OPENSHIFT_BUILD_COMMIT=(str, ""),
+    REDIRECT_ROUTING_TABLE=(bool, True),
+    REDIRECT_RULESET_CHECK_INTERVAL=(float, 5.0),
+    REDIRECT_UNKNOWN_HOST_CACHE_SIZE=(int, 10000),
+    REDIRECT_WSGI_FAST_PATH=(bool, False),
+    REDIRECT_ASYNC_VIEW=(bool, False),
+    REDIRECT_ASGI_FAST_PATH=(bool, False),
+    REDIRECT_RULESET_SNAPSHOT=(str, ""),
+    REDIRECT_PRELOAD=(bool, False),
+    REDIRECT_METRICS=(bool, False),
+    REDIRECT_METRICS_DIR=(str, ""),
+    REDIRECT_METRICS_FLUSH_INTERVAL=(float, 1.0),
+    REDIRECT_RULE_STATS=(bool, False),
+    REDIRECT_RULE_STATS_FLUSH_INTERVAL=(float, 60.0),
+    REDIRECT_RULE_STATS_FLUSH_HITS=(int, 10000),
+    REDIRECT_DECISION_LOG=(bool, False),
+    REDIRECT_DECISION_LOG_SAMPLE_RATE=(float, 1.0),
+    REDIRECT_DECISION_LOG_QUEUE_SIZE=(int, 10000),
+    REDIRECT_DEBUG_SECRET=(str, ""),
+    REDIRECT_PERMANENT_MAX_AGE=(int, 86400),
+    REDIRECT_TEMPORARY_MAX_AGE=(int, 60),
+    REDIRECT_NOT_FOUND_MAX_AGE=(int, 60),
     SECRET_KEY=(str, ""),
     SENTRY_DSN=(str, ""),
     SENTRY_ENVIRONMENT=(str, "local"),
@@ -184,6 +205,65 @@ ADMIN_URL = env("ADMIN_URL")
 # Enable API
 ENABLE_REDIRECT_APP = env("ENABLE_REDIRECT_APP")
 
+# Resolve redirects from an in-process routing table instead of querying the
+# database on every request. Processes compare the ruleset generation to the one
+# their table was built from at most every REDIRECT_RULESET_CHECK_INTERVAL seconds,
+# and rebuild the table only when it has changed.
+REDIRECT_ROUTING_TABLE = env("REDIRECT_ROUTING_TABLE")
+REDIRECT_RULESET_CHECK_INTERVAL = env("REDIRECT_RULESET_CHECK_INTERVAL")
+# Maximum number of unknown hosts remembered per process
+REDIRECT_UNKNOWN_HOST_CACHE_SIZE = env("REDIRECT_UNKNOWN_HOST_CACHE_SIZE")
+# Path of a compiled ruleset snapshot shared by all processes through mmap instead of
+# each building its own routing table. Must be writable by the processes, e.g.
+# /tmp/ruleset.snapshot, as the first one to notice a new generation recompiles it.
+REDIRECT_RULESET_SNAPSHOT = env("REDIRECT_RULESET_SNAPSHOT")
+# Load the routing table when the WSGI application is loaded, i.e. in the uWSGI
+# master before it forks the workers.
+REDIRECT_PRELOAD = (
+    env("REDIRECT_PRELOAD") and ENABLE_REDIRECT_APP and REDIRECT_ROUTING_TABLE
+)
+# Answer redirects from the routing table before the request reaches Django's
+# middleware. Requires both the redirect app and the routing table.
+REDIRECT_WSGI_FAST_PATH = (
+    env("REDIRECT_WSGI_FAST_PATH") and ENABLE_REDIRECT_APP and REDIRECT_ROUTING_TABLE
+)
+# Serve redirects with an async view. Enabled by default by tirehtoori/asgi.py.
+REDIRECT_ASYNC_VIEW = env("REDIRECT_ASYNC_VIEW")
+# Like REDIRECT_WSGI_FAST_PATH, for ASGI deployments. Also works without the routing
+# table, looking rules up with the async ORM.
+REDIRECT_ASGI_FAST_PATH = env("REDIRECT_ASGI_FAST_PATH") and ENABLE_REDIRECT_APP
+# Record resolution metrics and serve them in the Prometheus format at __metrics
+REDIRECT_METRICS = env("REDIRECT_METRICS") and ENABLE_REDIRECT_APP
+# Directory shared by the worker processes, e.g. /tmp/metrics, through which a scrape
+# of any worker reports the metrics of all of them. Written to at most every
+# REDIRECT_METRICS_FLUSH_INTERVAL seconds per worker. Without it each worker only
+# reports its own metrics.
+REDIRECT_METRICS_DIR = env("REDIRECT_METRICS_DIR")
+REDIRECT_METRICS_FLUSH_INTERVAL = env("REDIRECT_METRICS_FLUSH_INTERVAL")
+# Count hits per redirect rule, shown in the admin. Each process writes its counts to
+# the database every REDIRECT_RULE_STATS_FLUSH_INTERVAL seconds, or sooner once
+# REDIRECT_RULE_STATS_FLUSH_HITS hits have accumulated.
+REDIRECT_RULE_STATS = env("REDIRECT_RULE_STATS") and ENABLE_REDIRECT_APP
+REDIRECT_RULE_STATS_FLUSH_INTERVAL = env("REDIRECT_RULE_STATS_FLUSH_INTERVAL")
+REDIRECT_RULE_STATS_FLUSH_HITS = env("REDIRECT_RULE_STATS_FLUSH_HITS")
+# Log the host, path, matched rule, outcome and duration of resolved requests as JSON
+# to the redirect.decisions logger, from a background thread. A share of
+# REDIRECT_DECISION_LOG_SAMPLE_RATE of the requests is logged, and decisions are
+# dropped while REDIRECT_DECISION_LOG_QUEUE_SIZE of them are waiting to be written.
+REDIRECT_DECISION_LOG = env("REDIRECT_DECISION_LOG") and ENABLE_REDIRECT_APP
+REDIRECT_DECISION_LOG_SAMPLE_RATE = env("REDIRECT_DECISION_LOG_SAMPLE_RATE")
+REDIRECT_DECISION_LOG_QUEUE_SIZE = env("REDIRECT_DECISION_LOG_QUEUE_SIZE")
+# Requests carrying this secret in the X-Redirect-Debug header get Server-Timing and
+# X-Redirect-Rule/X-Redirect-Match headers describing how they were resolved. Unset,
+# the debug headers are disabled altogether and cost nothing.
+REDIRECT_DEBUG_SECRET = env("REDIRECT_DEBUG_SECRET")
+# Seconds browsers and CDNs may cache permanent and temporary redirects and responses
+# to paths without a redirect rule for, unless the domain or the rule sets its own.
+# 0 disables caching.
+REDIRECT_PERMANENT_MAX_AGE = env("REDIRECT_PERMANENT_MAX_AGE")
+REDIRECT_TEMPORARY_MAX_AGE = env("REDIRECT_TEMPORARY_MAX_AGE")
+REDIRECT_NOT_FOUND_MAX_AGE = env("REDIRECT_NOT_FOUND_MAX_AGE")
+
 # get build time from a file in docker image
 APP_BUILD_TIME = datetime.fromtimestamp(os.path.getmtime(__file__))
 COMMIT_HASH = env.str("OPENSHIFT_BUILD_COMMIT", "")
@@ -1,3 +1,8 @@
+import pytest
+from django.db import DatabaseError
+
+from redirect.factories import DomainFactory
+from redirect.models import RulesetGeneration
 from tirehtoori import __version__
 
 
@@ -7,13 +12,66 @@ def test_healthz(client):
     assert response.status_code == 200
 
 
+@pytest.mark.django_db
 def test_readiness(client, settings):
+    RulesetGeneration.bump()
+
     response = client.get("/__readiness")
 
     data = response.json()
     assert response.status_code == 200
-    assert len(data) == 4
+    assert len(data) == 5
     assert data["status"] == "ok"
     assert data["packageVersion"] == __version__
     assert data["commitHash"] == settings.COMMIT_HASH
     assert "buildTime" in data
+    assert data["rulesetGeneration"] == 1
+
+
+@pytest.mark.django_db
+def test_readiness_without_routing_table(client, settings):
+    settings.REDIRECT_ROUTING_TABLE = False
+    RulesetGeneration.bump()
+
+    response = client.get("/__readiness")
+
+    assert response.status_code == 200
+    assert response.json()["rulesetGeneration"] == 1
+
+
+def test_readiness_until_rules_are_loaded(client, monkeypatch):
+    def get_routing_table():
+        raise DatabaseError
+
+    monkeypatch.setattr("redirect.api.get_routing_table", get_routing_table)
+
+    response = client.get("/__readiness")
+
+    assert response.status_code == 503
+    assert response.json()["status"] == "unavailable"
+    assert "rulesetGeneration" not in response.json()
+
+
+@pytest.fixture
+def metrics_enabled(settings, reload_urls):
+    settings.REDIRECT_METRICS = True
+    reload_urls()
+
+
+@pytest.mark.django_db
+def test_metrics(client, metrics_enabled):
+    domain = DomainFactory()
+    host = domain.names.first().name
+    domain.redirect_rules.create(path="foo", destination="https://acme.test/")
+    client.get("/foo", HTTP_HOST=host)
+
+    response = client.get("/__metrics")
+
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = response.content.decode()
+    assert f'tirehtoori_redirects_total{{domain="{host}"}}' in text
+    assert (
+        'tirehtoori_redirect_resolution_seconds_count{outcome="case_insensitive"}'
+        in text
+    )
@@ -15,15 +15,18 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+import logging
+
 from django.conf import settings
 from django.contrib import admin
+from django.db import DatabaseError
 from django.http import HttpResponse, JsonResponse
 from django.urls import path, re_path
 from django.views.decorators.http import require_GET
 
 from tirehtoori import __version__
 
-from .api import api
+logger = logging.getLogger(__name__)
 
 urlpatterns = []
 
@@ -31,6 +34,18 @@ if settings.ENABLE_ADMIN_APP:
     urlpatterns.append(path(f"{settings.ADMIN_URL}/", admin.site.urls))
 
 if settings.ENABLE_REDIRECT_APP:
+    from redirect.api import aredirect, redirect, ruleset_generation
+
+    # The async view avoids a thread hop per request under ASGI, but would need one
+    # under WSGI
+    redirect_view = aredirect if settings.REDIRECT_ASYNC_VIEW else redirect
+    if settings.REDIRECT_DEBUG_SECRET:
+        from redirect.tracing import atraced_redirect, traced_redirect
+
+        redirect_view = (
+            atraced_redirect if settings.REDIRECT_ASYNC_VIEW else traced_redirect
+        )
+
     if settings.ENABLE_ADMIN_APP:
         # NOTE: Django uses a cache for url resolving. If any other, non-system url is
         # requested before admin, the cache will be populated with the catch-all
@@ -38,9 +53,13 @@ if settings.ENABLE_REDIRECT_APP:
         # redirect view. Using a negative lookahead assertion to exclude admin urls
         # fixes this issue.
         # Keep this in mind if you need to add any other "reserved" urls.
-        urlpatterns.append(re_path(rf"^(?!{settings.ADMIN_URL})", api.urls))
+        urlpatterns.append(
+            re_path(rf"^(?!{settings.ADMIN_URL})(?P<path>.*)$", redirect_view)
+        )
     else:
-        urlpatterns.append(path("", api.urls))
+        urlpatterns.append(re_path(r"^(?P<path>.*)$", redirect_view))
+
+    handler404 = "redirect.api.page_not_found"
 
 
 #
@@ -59,7 +78,28 @@ def readiness(*args, **kwargs):
         "commitHash": settings.COMMIT_HASH,
         "buildTime": settings.APP_BUILD_TIME.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
     }
-    return JsonResponse(response_json, status=200)
+    status = 200
+    if settings.ENABLE_REDIRECT_APP:
+        # Only ready to serve redirects once they can be resolved. Loads the routing
+        # table unless it was preloaded, see tirehtoori/wsgi.py.
+        try:
+            response_json["rulesetGeneration"] = ruleset_generation()
+        except DatabaseError:
+            logger.exception("Redirect rules could not be loaded")
+            response_json["status"] = "unavailable"
+            status = 503
+    return JsonResponse(response_json, status=status)
+
+
+@require_GET
+def metrics(*args, **kwargs):
+    from redirect.metrics import CONTENT_TYPE, collect
+
+    return HttpResponse(collect(), content_type=CONTENT_TYPE)
+
 
+service_urlpatterns = [path("__healthz", healthz), path("__readiness", readiness)]
+if settings.REDIRECT_METRICS:
+    service_urlpatterns.append(path("__metrics", metrics))
 
-urlpatterns = [path("__healthz", healthz), path("__readiness", readiness)] + urlpatterns
+urlpatterns = service_urlpatterns + urlpatterns
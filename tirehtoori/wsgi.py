@@ -9,8 +9,23 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tirehtoori.settings")
 
 application = get_wsgi_application()
+
+if settings.REDIRECT_PRELOAD:
+    # Build the routing table once in the uWSGI master instead of in every worker,
+    # see redirect/wsgi.py
+    from redirect.wsgi import preload_routing_table
+
+    preload_routing_table()
+
+if settings.REDIRECT_WSGI_FAST_PATH:
+    # Answer redirects without going through the middleware stack, see
+    # redirect/wsgi.py
+    from redirect.wsgi import RedirectApplication
+
+    application = RedirectApplication(application)